@@ -3,11 +3,14 @@ Generate max projection backgrounds from video and save to disk.
 This pre-computes backgrounds so optimization runs don't need to regenerate them.
 """
 
-import cv2
 import numpy as np
 from pathlib import Path
 from skimage.transform import rescale
 import json
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'utils'))
+from frames import VideoFrames
 
 def generate_and_save_backgrounds(video_path, 
                                    output_dir,
@@ -28,12 +31,9 @@ def generate_and_save_backgrounds(video_path,
     output_path.mkdir(exist_ok=True, parents=True)
     
     print(f"Opening video: {video_path}")
-    cap = cv2.VideoCapture(video_path)
-    
-    if not cap.isOpened():
-        raise IOError(f"Cannot open video: {video_path}")
+    video = VideoFrames(video_path)
     
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    total_frames = video.frame_count
     frames_to_process = min(max_frames, total_frames)
     
     print(f"Total frames in video: {total_frames}")
@@ -47,6 +47,9 @@ def generate_and_save_backgrounds(video_path,
     
     backgrounds = {}
     
+    # Decode the whole range in one sequential pass instead of seeking to every frame
+    frames = iter(VideoFrames(video_path, stop=frames_to_process))
+    
     for chunk_idx in range(num_chunks):
         start_frame = chunk_idx * chunk_size
         end_frame = min(start_frame + chunk_size, frames_to_process)
@@ -56,16 +59,12 @@ def generate_and_save_backgrounds(video_path,
         # Load chunk frames
         chunk_frames = []
         for frame_num in range(start_frame, end_frame):
-            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_num)
-            ret, frame = cap.read()
+            gray = next(frames, None)
             
-            if not ret:
+            if gray is None:
                 print(f"  Warning: Could not read frame {frame_num}")
                 continue
             
-            # Convert to grayscale
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            
             # Downsample
             if downsample_factor > 1:
                 gray = rescale(gray, 1.0 / downsample_factor, 
@@ -97,7 +96,7 @@ def generate_and_save_backgrounds(video_path,
             'shape': background.shape
         }
     
-    cap.release()
+    frames.close()
     
     # Save metadata
     metadata = {
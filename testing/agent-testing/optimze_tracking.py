@@ -22,14 +22,32 @@ from typing import Dict, Tuple, Optional
 import warnings
 import logging
 from datetime import datetime
+import sys
+import time
+import hashlib
+import itertools
+import os
+import queue
+import sqlite3
+from multiprocessing import get_context
+from scipy.optimize import linear_sum_assignment
 warnings.filterwarnings('ignore')
 
+# Share the background engines and frame sources with the production tracking code
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'utils'))
+from background import make_background
+from framecache import FrameCache, fingerprint
+from frames import VideoFrames
+from parallel import available_cores
+from preprocess import subtract_absdiff
+
 
 class MiracidiaTracker:
     """Handles miracidia detection and trajectory linking."""
     
     def __init__(self, video_path: str, max_frames: Optional[int] = None, downsample_factor: int = 1,
-                 backgrounds_dir: Optional[str] = None):
+                 backgrounds_dir: Optional[str] = None, cache_dir: Optional[str] = None,
+                 cache_budget_mb: int = 20480):
         """
         Initialize tracker with video file.
         
@@ -38,9 +56,11 @@ class MiracidiaTracker:
             max_frames: Maximum number of frames to process (None = all)
             downsample_factor: Factor to downsample images (1 = no downsampling, 2 = half size, etc.)
             backgrounds_dir: Directory containing pre-computed backgrounds (None = generate on-the-fly)
+            cache_dir: Directory of decoded, downsampled frames shared between runs
+                (None = decode the video every time)
+            cache_budget_mb: Size the frame cache may grow to before old entries are evicted
         """
         self.video_path = Path(video_path)
-        self.video_cap = None
         self.total_frames = 0
         self.features = None
         self.trajectories = None
@@ -49,24 +69,27 @@ class MiracidiaTracker:
         self.background_cache = {}  # Cache backgrounds by chunk index
         self.backgrounds_dir = Path(backgrounds_dir) if backgrounds_dir else None
         self.backgrounds_metadata = None
+        self.frame_cache = FrameCache(cache_dir, cache_budget_mb) if cache_dir else None
         
         # Load pre-computed backgrounds if available
         if self.backgrounds_dir and self.backgrounds_dir.exists():
             metadata_file = self.backgrounds_dir / 'backgrounds_metadata.json'
             if metadata_file.exists():
                 with open(metadata_file, 'r') as f:
-                    self.backgrounds_metadata = json.load(f)
-                print(f"Loaded background metadata: {len(self.backgrounds_metadata['backgrounds'])} chunks")
+                    metadata = json.load(f)
+                # backgrounds made at another resolution do not fit these frames
+                if metadata.get('downsample_factor', downsample_factor) == downsample_factor:
+                    self.backgrounds_metadata = metadata
+                    print(f"Loaded background metadata: {len(metadata['backgrounds'])} chunks")
+                else:
+                    print(f"Ignoring pre-computed backgrounds made at {metadata['downsample_factor']}x downsampling")
         
     def load_video(self) -> None:
-        """Open video file using CV2 without loading all frames."""
+        """Read the video's frame count without loading any frames."""
         print(f"Opening video: {self.video_path}")
-        self.video_cap = cv2.VideoCapture(str(self.video_path))
-        
-        if not self.video_cap.isOpened():
-            raise IOError(f"Cannot open video file: {self.video_path}")
-        
-        self.total_frames = int(self.video_cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        # the capture is opened only to read the count and released straight away;
+        # frames are decoded later by iter_frames
+        self.total_frames = VideoFrames(self.video_path).frame_count
         
         # Limit frames if specified
         if self.max_frames is not None:
@@ -76,13 +99,27 @@ class MiracidiaTracker:
             actual_frames = self.total_frames
             print(f"Will process all {actual_frames} frames")
     
-    def get_frame(self, frame_idx: int) -> Optional[np.ndarray]:
-        """Get a specific frame from the video."""
-        self.video_cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
-        ret, frame = self.video_cap.read()
-        if ret:
-            return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        return None
+    def iter_frames(self, stop_frame: int, start_frame: int = 0):
+        """
+        Yield (downsampled) greyscale frames start_frame..stop_frame-1.
+        
+        Frames are decoded sequentially on a prefetch thread instead of seeking to each one,
+        or, with a frame cache, mapped from the copy decoded by an earlier run.
+        """
+        if self.frame_cache is not None:
+            cached = self.frame_cache.load(self.video_path, stop=self.max_frames,
+                                           downsample=self.downsample_factor)
+            for frame in cached[start_frame:stop_frame]:
+                yield np.asarray(frame)
+            return
+        
+        for frame in VideoFrames(self.video_path, start=start_frame, stop=stop_frame):
+            # Downsample if requested
+            if self.downsample_factor > 1:
+                from skimage.transform import rescale
+                frame = rescale(frame, 1.0 / self.downsample_factor, anti_aliasing=True, preserve_range=True).astype(np.uint8)
+            
+            yield frame
         
     def subtract_background(self, frame: np.ndarray, background: np.ndarray) -> np.ndarray:
         """
@@ -99,24 +136,10 @@ class MiracidiaTracker:
         # Use absolute difference like production code
         # This captures both bright objects moving over dark background
         # and dark objects moving over bright background
-        subtracted = np.absolute(frame.astype(np.int16) - background.astype(np.int16))
-        
-        # Clip to valid range
-        subtracted = np.clip(subtracted, 0, 255)
-        return subtracted.astype(np.uint8)
+        return subtract_absdiff(frame, background, np.empty_like(frame))
     
-    def generate_background(self, start_frame: int = 0, chunk_size: int = 25, use_max: bool = True) -> np.ndarray:
-        """
-        Generate or load background by median/max projection over chunk of frames.
-        
-        Args:
-            start_frame: Starting frame index
-            chunk_size: Number of frames to use for background
-            use_max: Use maximum instead of median (better for removing stationary bright objects)
-            
-        Returns:
-            Background image
-        """
+    def _stored_background(self, start_frame: int, chunk_size: int, use_max: bool) -> Optional[np.ndarray]:
+        """Pre-computed or already generated background for a chunk, None if there is none."""
         # Calculate chunk index
         chunk_idx = start_frame // chunk_size
         
@@ -131,28 +154,35 @@ class MiracidiaTracker:
         
         # Check cache
         cache_key = (start_frame, chunk_size, use_max, self.downsample_factor)
-        if cache_key in self.background_cache:
-            return self.background_cache[cache_key]
+        return self.background_cache.get(cache_key)
+    
+    def generate_background(self, start_frame: int = 0, chunk_size: int = 25, use_max: bool = True,
+                            frames: Optional[list] = None) -> np.ndarray:
+        """
+        Generate or load background by median/max projection over chunk of frames.
+        
+        Args:
+            start_frame: Starting frame index
+            chunk_size: Number of frames to use for background
+            use_max: Use maximum instead of median (better for removing stationary bright objects)
+            frames: The chunk's frames, if the caller has already decoded them
+                (None = read them from the video)
+            
+        Returns:
+            Background image
+        """
+        background = self._stored_background(start_frame, chunk_size, use_max)
+        if background is not None:
+            return background
         
         # Generate background on-the-fly (fallback)
-        print(f"  Generating background for chunk {chunk_idx} on-the-fly...")
         end_frame = min(start_frame + chunk_size, self.total_frames)
         if self.max_frames is not None:
             end_frame = min(end_frame, self.max_frames)
-        
-        chunk = []
-        for i in range(start_frame, end_frame):
-            frame = self.get_frame(i)
-            if frame is None:
-                continue
-            
-            # Frame is already grayscale from get_frame()
-            # Apply downsampling if needed
-            if self.downsample_factor > 1:
-                from skimage.transform import rescale
-                frame = rescale(frame, 1.0 / self.downsample_factor, anti_aliasing=True, preserve_range=True).astype(np.uint8)
-            
-            chunk.append(frame)
+        chunk = frames
+        if chunk is None:
+            print(f"  Generating background for chunk {start_frame // chunk_size} on-the-fly...")
+            chunk = list(self.iter_frames(end_frame, start_frame))
         
         if len(chunk) == 0:
             raise ValueError(f"No frames loaded for background generation (start={start_frame}, end={end_frame})")
@@ -164,9 +194,54 @@ class MiracidiaTracker:
             background = np.median(chunk, axis=0).astype(np.uint8)
         
         # Cache the result
-        self.background_cache[cache_key] = background
+        self.background_cache[(start_frame, chunk_size, use_max, self.downsample_factor)] = background
         return background
     
+    def processed_frames(self,
+                         use_background_subtraction: bool = True,
+                         chunk_size: int = 25,
+                         use_max_projection: bool = True,
+                         background_mode: Optional[str] = None):
+        """
+        Yield (frame_idx, frame) for every frame to detect in, background-subtracted
+        as detect_features() describes.
+        """
+        # Determine how many frames to process
+        total_frames = self.total_frames if self.max_frames is None else min(self.max_frames, self.total_frames)
+        
+        if background_mode is None:
+            background_mode = 'chunk' if use_max_projection else 'chunk-median'
+        use_precomputed = self.backgrounds_metadata is not None and background_mode == 'chunk'
+        
+        # Process frames one at a time (no memory loading)
+        frames = self.iter_frames(total_frames)
+        if use_background_subtraction and not use_precomputed:
+            # Stream frames through a background engine (same API as production tracking)
+            engine = make_background(background_mode, chunk_size)
+            for frame_idx, frame, background in engine.apply(frames):
+                yield frame_idx, self.subtract_background(frame, background)
+            return
+        
+        frames = enumerate(frames)
+        if not use_background_subtraction:
+            yield from frames
+            return
+        
+        # Use rolling window: one background per chunk_size block
+        for chunk_start in itertools.count(0, chunk_size):
+            first = next(frames, None)
+            if first is None:
+                return
+            chunk = itertools.chain([first], itertools.islice(frames, chunk_size - 1))
+            background = self._stored_background(chunk_start, chunk_size, use_max=True)
+            if background is None:
+                # Not pre-computed: build it from this pass's frames instead of decoding them twice
+                chunk = list(chunk)
+                background = self.generate_background(chunk_start, chunk_size, use_max=True,
+                                                      frames=[frame for _, frame in chunk])
+            for frame_idx, frame in chunk:
+                yield frame_idx, self.subtract_background(frame, background)
+    
     def detect_features(self, 
                        diameter: int = 11,
                        minmass: float = 100,
@@ -179,7 +254,8 @@ class MiracidiaTracker:
                        invert: bool = False,
                        use_background_subtraction: bool = True,
                        chunk_size: int = 25,
-                       use_max_projection: bool = True) -> pd.DataFrame:
+                       use_max_projection: bool = True,
+                       background_mode: Optional[str] = None) -> pd.DataFrame:
         """
         Detect features (miracidia) in all frames using TrackPy.
         Can optionally use rolling background subtraction.
@@ -197,6 +273,12 @@ class MiracidiaTracker:
             use_background_subtraction: Use rolling window background subtraction (default True)
             chunk_size: Frames per background generation (default 25)
             use_max_projection: Use max instead of median for background (default True)
+            background_mode: Background engine from utils/background.py ('chunk',
+                'chunk-median', 'max', 'median', 'percentile'). None = 'chunk' if
+                use_max_projection else 'chunk-median', the per-chunk max or median this
+                harness has always used. 'max', 'median' and 'percentile' slide a
+                window centred on each frame instead. Pre-computed backgrounds are only
+                used in 'chunk' mode.
             
         Returns:
             DataFrame with detected features
@@ -205,74 +287,27 @@ class MiracidiaTracker:
         print(f"  diameter={diameter}, minmass={minmass}, separation={separation}, invert={invert}")
         print(f"  background_subtraction={use_background_subtraction}, use_max_projection={use_max_projection}, chunk_size={chunk_size}")
         
-        if separation is None:
-            separation = diameter + 1
-        
-        all_features = []
-        
-        # Determine how many frames to process
-        total_frames = self.total_frames if self.max_frames is None else min(self.max_frames, self.total_frames)
-        
-        # Process frames one at a time (no memory loading)
-        for frame_idx in range(total_frames):
-            frame = self.get_frame(frame_idx)
-            
-            if frame is None:
-                print(f"  Warning: Could not read frame {frame_idx}")
-                continue
-            
-            # Frame is already grayscale from get_frame()
-            
-            # Downsample if requested
-            if self.downsample_factor > 1:
-                from skimage.transform import rescale
-                frame = rescale(frame, 1.0 / self.downsample_factor, anti_aliasing=True, preserve_range=True).astype(np.uint8)
-            
-            # Optionally subtract background (now enabled by default with rolling window)
-            if use_background_subtraction:
-                # Use rolling window: regenerate background every chunk_size frames
-                chunk_idx = frame_idx // chunk_size
-                background = self.generate_background(chunk_idx * chunk_size, chunk_size, use_max=use_max_projection)
-                processed = self.subtract_background(frame, background)
-            else:
-                processed = frame
-            
-            # Detect features
-            try:
-                features = tp.locate(
-                    processed,
-                    diameter=diameter,
-                    minmass=minmass,
-                    separation=separation,
-                    maxsize=maxsize,
-                    noise_size=noise_size,
-                    smoothing_size=smoothing_size,
-                    threshold=threshold,
-                    percentile=percentile,
-                    invert=invert
-                )
-                
-                if len(features) > 0:
-                    features['frame'] = frame_idx
-                    all_features.append(features)
-                    
-            except Exception as e:
-                print(f"  Warning: Frame {frame_idx} failed: {e}")
-                continue
-            
-            if frame_idx % 100 == 0:
-                total_found = sum(len(f) for f in all_features)
-                print(f"  Processed frame {frame_idx}/{total_frames}, "
-                      f"total features: {total_found}")
+        stream = self.processed_frames(use_background_subtraction, chunk_size,
+                                       use_max_projection, background_mode)
+        self.features = locate_frames(
+            stream,
+            diameter=diameter,
+            minmass=minmass,
+            separation=separation,
+            maxsize=maxsize,
+            noise_size=noise_size,
+            smoothing_size=smoothing_size,
+            threshold=threshold,
+            percentile=percentile,
+            invert=invert
+        )
         
-        if all_features:
-            self.features = pd.concat(all_features, ignore_index=True)
+        if len(self.features) > 0:
             print(f"\nTotal features detected: {len(self.features)}")
             print(f"Frames with detections: {self.features['frame'].nunique()}")
-            return self.features
         else:
             print("\nWARNING: No features detected!")
-            return pd.DataFrame()
+        return self.features
     
     def link_trajectories(self,
                          search_range: float = 5,
@@ -313,6 +348,49 @@ class MiracidiaTracker:
         return self.trajectories
 
 
+def locate_frames(frames, diameter: int, minmass: float, separation: Optional[float] = None,
+                  progress: bool = True, **kwargs) -> pd.DataFrame:
+    """
+    Run tp.locate on every (frame_idx, frame) of frames and return all features.
+    
+    Args:
+        frames: Iterable of (frame_idx, preprocessed frame)
+        diameter: Approximate feature size (odd integer)
+        minmass: Minimum integrated brightness
+        separation: Minimum separation between features (None = diameter + 1)
+        progress: Print a progress line every 100 frames
+        **kwargs: Other tp.locate arguments
+        
+    Returns:
+        DataFrame with detected features (empty if there were none)
+    """
+    if separation is None:
+        separation = diameter + 1
+    
+    all_features = []
+    for frame_idx, frame in frames:
+        # Detect features
+        try:
+            features = tp.locate(frame, diameter=diameter, minmass=minmass,
+                                 separation=separation, **kwargs)
+            
+            if len(features) > 0:
+                features['frame'] = frame_idx
+                all_features.append(features)
+                
+        except Exception as e:
+            print(f"  Warning: Frame {frame_idx} failed: {e}")
+            continue
+        
+        if progress and frame_idx % 100 == 0:
+            total_found = sum(len(f) for f in all_features)
+            print(f"  Processed frame {frame_idx}, total features: {total_found}")
+    
+    if all_features:
+        return pd.concat(all_features, ignore_index=True)
+    return pd.DataFrame()
+
+
 class TrackingEvaluator:
     """Evaluates tracking quality using quantitative metrics."""
     
@@ -327,6 +405,7 @@ class TrackingEvaluator:
         self.trajectories = trajectories
         self.fps = video_fps
         self.metrics = {}
+        self._step_arrays = None
         
     def compute_all_metrics(self) -> Dict:
         """
@@ -365,6 +444,52 @@ class TrackingEvaluator:
             'metrics': self.metrics
         }
     
+    def _steps(self) -> Dict[str, np.ndarray]:
+        """
+        Trajectories as arrays sorted by track and frame, computed once.
+        
+        Tracks are ordered by first appearance (the order of
+        trajectories['particle'].unique()) so values concatenated across
+        tracks come out in the same order as a per-particle loop would give.
+        
+        Returns:
+            Dictionary with 'x', 'y', 'track' (track index of each row),
+            'starts' and 'lengths' (first row and row count of each track),
+            'step' (distance from the previous detection of the same track,
+            NaN on each track's first row) and 'velocity' (step divided by
+            the frame gap)
+        """
+        if self._step_arrays is not None:
+            return self._step_arrays
+        
+        codes, _ = pd.factorize(self.trajectories['particle'])
+        frames = self.trajectories['frame'].to_numpy()
+        order = np.lexsort((frames, codes))
+        track = codes[order]
+        frames = frames[order].astype(float)
+        x = self.trajectories['x'].to_numpy(dtype=float)[order]
+        y = self.trajectories['y'].to_numpy(dtype=float)[order]
+        
+        first = np.ones(len(track), dtype=bool)
+        first[1:] = track[1:] != track[:-1]
+        starts = np.flatnonzero(first)
+        lengths = np.diff(np.append(starts, len(track)))
+        
+        dx = np.diff(x, prepend=np.nan)
+        dy = np.diff(y, prepend=np.nan)
+        dt = np.diff(frames, prepend=np.nan)
+        dx[first] = dy[first] = dt[first] = np.nan
+        step = np.sqrt(dx**2 + dy**2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            velocity = step / dt
+        
+        self._step_arrays = {
+            'x': x, 'y': y, 'track': track,
+            'starts': starts, 'lengths': lengths,
+            'step': step, 'velocity': velocity,
+        }
+        return self._step_arrays
+    
     def _compute_track_lengths(self) -> None:
         """Compute track length distribution metrics with movement analysis."""
         track_lengths = self.trajectories.groupby('particle').size()
@@ -380,36 +505,26 @@ class TrackingEvaluator:
         self.metrics['medium_tracks'] = ((track_lengths >= 20) & (track_lengths < 40)).sum()
         self.metrics['long_tracks'] = (track_lengths >= 40).sum()
         
-        # NEW: Analyze movement for long tracks
-        moving_long_tracks = 0
-        stationary_long_tracks = 0
+        # Analyze movement for long tracks (40+ frames), all tracks at once
+        s = self._steps()
+        starts, lengths = s['starts'], s['lengths']
+        long_tracks = lengths >= 40
+        ends = starts + lengths - 1
         
-        for particle_id in self.trajectories['particle'].unique():
-            track = self.trajectories[self.trajectories['particle'] == particle_id].sort_values('frame')
-            track_length = len(track)
-            
-            if track_length >= 40:  # Only analyze long tracks
-                # Calculate total displacement (start to end)
-                start_x, start_y = track.iloc[0]['x'], track.iloc[0]['y']
-                end_x, end_y = track.iloc[-1]['x'], track.iloc[-1]['y']
-                total_displacement = np.sqrt((end_x - start_x)**2 + (end_y - start_y)**2)
-                
-                # Calculate mean velocity
-                if track_length > 1:
-                    dx = track['x'].diff()
-                    dy = track['y'].diff()
-                    displacements = np.sqrt(dx**2 + dy**2)
-                    mean_velocity = displacements.mean()
-                else:
-                    mean_velocity = 0
-                
-                # Classify as moving if EITHER:
-                # - Total displacement > 10 pixels (moved substantially), OR
-                # - Mean velocity > 0.5 pixels/frame (consistent movement)
-                if total_displacement > 10 or mean_velocity > 0.5:
-                    moving_long_tracks += 1
-                else:
-                    stationary_long_tracks += 1
+        # Total displacement (start to end)
+        total_displacement = np.sqrt((s['x'][ends] - s['x'][starts])**2 +
+                                     (s['y'][ends] - s['y'][starts])**2)
+        
+        # Mean velocity: mean step length, skipping each track's first row
+        steps = pd.Series(s['step'])
+        mean_velocity = steps.groupby(s['track'], sort=False).mean().to_numpy()
+        
+        # Classify as moving if EITHER:
+        # - Total displacement > 10 pixels (moved substantially), OR
+        # - Mean velocity > 0.5 pixels/frame (consistent movement)
+        moving = (total_displacement > 10) | (mean_velocity > 0.5)
+        moving_long_tracks = int(np.sum(long_tracks & moving))
+        stationary_long_tracks = int(np.sum(long_tracks & ~moving))
         
         # Store movement metrics
         self.metrics['long_tracks_moving'] = moving_long_tracks
@@ -423,52 +538,39 @@ class TrackingEvaluator:
         
     def _compute_motion_metrics(self) -> None:
         """Compute metrics related to motion smoothness and realism."""
-        motion_scores = []
-        velocity_list = []
-        acceleration_list = []
+        s = self._steps()
         
-        for particle_id in self.trajectories['particle'].unique():
-            track = self.trajectories[self.trajectories['particle'] == particle_id].sort_values('frame')
-            
-            if len(track) < 3:
-                continue
-            
-            # Compute frame-to-frame displacements
-            dx = track['x'].diff()
-            dy = track['y'].diff()
-            displacements = np.sqrt(dx**2 + dy**2)
-            
-            # Velocity (pixels/frame)
-            velocities = displacements / track['frame'].diff()
-            velocities = velocities[~np.isnan(velocities)]
-            
-            if len(velocities) > 0:
-                velocity_list.extend(velocities.tolist())
-                
-                # Motion smoothness (lower std = smoother)
-                motion_scores.append(velocities.std())
-                
-                # Acceleration (change in velocity)
-                if len(velocities) > 1:
-                    accelerations = np.abs(velocities.diff())
-                    acceleration_list.extend(accelerations[~np.isnan(accelerations)].tolist())
+        # Only tracks of 3+ detections; velocities in pixels/frame
+        in_long_track = np.repeat(s['lengths'] >= 3, s['lengths'])
+        velocity = s['velocity'][in_long_track]
+        track = s['track'][in_long_track]
+        keep = ~np.isnan(velocity)
+        velocity, track = velocity[keep], track[keep]
+        
+        # Motion smoothness per track (lower std = smoother)
+        motion_scores = pd.Series(velocity).groupby(track, sort=False).std().to_numpy()
         
-        if motion_scores:
+        # Acceleration (change in velocity within a track)
+        same_track = track[1:] == track[:-1]
+        accelerations = np.abs(np.diff(velocity))[same_track]
+        accelerations = accelerations[~np.isnan(accelerations)]
+        
+        if len(motion_scores):
             self.metrics['motion_smoothness_mean'] = np.mean(motion_scores)
             self.metrics['motion_smoothness_std'] = np.std(motion_scores)
         else:
             self.metrics['motion_smoothness_mean'] = 0
             self.metrics['motion_smoothness_std'] = 0
         
-        if velocity_list:
-            self.metrics['velocity_mean'] = np.mean(velocity_list)
-            self.metrics['velocity_median'] = np.median(velocity_list)
-            self.metrics['velocity_std'] = np.std(velocity_list)
-            self.metrics['velocity_max'] = np.max(velocity_list)
+        if len(velocity):
+            self.metrics['velocity_mean'] = np.mean(velocity)
+            self.metrics['velocity_median'] = np.median(velocity)
+            self.metrics['velocity_std'] = np.std(velocity)
+            self.metrics['velocity_max'] = np.max(velocity)
             
             # Detect unrealistic jumps (likely tracking errors)
             # Miracidia typically move < 50 pixels/frame at 8 fps
-            self.metrics['unrealistic_velocities'] = np.sum(np.array(velocity_list) > 50)
+            self.metrics['unrealistic_velocities'] = np.sum(velocity > 50)
         else:
             self.metrics['velocity_mean'] = 0
             self.metrics['velocity_median'] = 0
@@ -476,8 +578,8 @@ class TrackingEvaluator:
             self.metrics['velocity_max'] = 0
             self.metrics['unrealistic_velocities'] = 0
         
-        if acceleration_list:
-            self.metrics['acceleration_mean'] = np.mean(acceleration_list)
+        if len(accelerations):
+            self.metrics['acceleration_mean'] = np.mean(accelerations)
         else:
             self.metrics['acceleration_mean'] = 0
     
@@ -601,8 +703,175 @@ class TrackingEvaluator:
         print(f"\nCoverage:")
         print(f"  Frame coverage: {m['frame_coverage']:.2%}")
         print(f"  Detections per frame: {m['detections_per_frame_mean']:.1f}")
-        
+
+        print("\n" + "="*60)
+
+
+class GroundTruthEvaluator:
+    """Scores tracking against known trajectories (e.g. a synthetic video's _truth.csv)."""
+
+    def __init__(self, trajectories: pd.DataFrame, truth: pd.DataFrame,
+                 max_distance: float, scale: float = 1.0):
+        """
+        Initialize evaluator.
+
+        Args:
+            trajectories: Detections (from detect_features) or linked trajectories (from tp.link).
+                Identity metrics are only computed if there is a 'particle' column.
+            truth: DataFrame with frame, particle, y and x of every true organism
+            max_distance: A detection within this distance (truth pixels) of a true organism matches it
+            scale: Downsample factor the detections were made at; their coordinates are
+                mapped back to full resolution before matching
+        """
+        self.trajectories = trajectories
+        self.truth = truth
+        self.max_distance = max_distance
+        self.scale = scale
+        self.metrics = {}
+
+    def _positions(self, detections: pd.DataFrame) -> np.ndarray:
+        """Detection coordinates in full-resolution pixels."""
+        yx = detections[['y', 'x']].to_numpy(float)
+        if self.scale == 1:
+            return yx
+        # pixel centres, as rescale() maps them
+        return (yx + 0.5) * self.scale - 0.5
+
+    def compute_all_metrics(self) -> Dict:
+        """
+        Compute detection and identity metrics.
+
+        Detections are matched to true organisms frame by frame as in CLEAR MOT: a
+        match from the previous frame is kept while it is within max_distance, and
+        the rest are assigned by minimum total distance. An identity switch is a true
+        organism matched to a different track than it was last matched to. IDF1 comes
+        from the best one-to-one assignment of whole tracks to true organisms.
+
+        Returns:
+            Dictionary of metrics
+        """
+        linked = 'particle' in self.trajectories.columns
+        detections = self.trajectories.groupby('frame')
+        truth = self.truth.groupby('frame')
+        frames = sorted(set(truth.groups) | set(detections.groups))
+
+        tp_count = fp = fn = switches = 0
+        distances = []
+        last_match = {}   # true id -> track id it was last matched to
+        pair_frames = {}  # (true id, track id) -> frames they are within max_distance
+        for frame in frames:
+            t = truth.get_group(frame) if frame in truth.groups else self.truth.iloc[:0]
+            d = (detections.get_group(frame) if frame in detections.groups
+                 else self.trajectories.iloc[:0])
+            true_ids = t['particle'].to_numpy()
+            track_ids = d['particle'].to_numpy() if linked else np.arange(len(d))
+            cost = np.linalg.norm(t[['y', 'x']].to_numpy(float)[:, None] - self._positions(d)[None],
+                                  axis=2)
+            close = cost <= self.max_distance
+
+            if linked:
+                for i, j in zip(*np.nonzero(close)):
+                    key = (true_ids[i], track_ids[j])
+                    pair_frames[key] = pair_frames.get(key, 0) + 1
+
+            # keep matches from the previous frame that are still close
+            rows, cols = [], []
+            if linked:
+                column = {track: j for j, track in enumerate(track_ids)}
+                for i, true_id in enumerate(true_ids):
+                    j = column.get(last_match.get(true_id))
+                    if j is not None and close[i, j]:
+                        rows.append(i)
+                        cols.append(j)
+            free_rows = np.setdiff1d(np.arange(len(t)), rows)
+            free_cols = np.setdiff1d(np.arange(len(d)), cols)
+            if len(free_rows) and len(free_cols):
+                sub = np.where(close[np.ix_(free_rows, free_cols)],
+                               cost[np.ix_(free_rows, free_cols)], 1e9)
+                r, c = linear_sum_assignment(sub)
+                keep = sub[r, c] <= self.max_distance
+                rows.extend(free_rows[r[keep]])
+                cols.extend(free_cols[c[keep]])
+
+            for i, j in zip(rows, cols):
+                if linked:
+                    previous = last_match.get(true_ids[i])
+                    if previous is not None and previous != track_ids[j]:
+                        switches += 1
+                    last_match[true_ids[i]] = track_ids[j]
+                distances.append(cost[i, j])
+            tp_count += len(rows)
+            fp += len(d) - len(rows)
+            fn += len(t) - len(rows)
+
+        num_truth = len(self.truth)
+        num_detections = len(self.trajectories)
+        self.metrics = {
+            'true_positives': tp_count,
+            'false_positives': fp,
+            'false_negatives': fn,
+            'precision': tp_count / num_detections if num_detections else 0,
+            'recall': tp_count / num_truth if num_truth else 0,
+            'localization_error': float(np.mean(distances)) if distances else None,
+        }
+        if linked:
+            self.metrics['id_switches'] = switches
+            self.metrics['mota'] = 1 - (fn + fp + switches) / num_truth if num_truth else 0
+            self.metrics['idf1'] = self._idf1(pair_frames, num_truth, num_detections)
+            self.metrics['num_tracks'] = self.trajectories['particle'].nunique()
+            self.metrics['num_true_tracks'] = self.truth['particle'].nunique()
+        return {'metrics': self.metrics}
+
+    @staticmethod
+    def _idf1(pair_frames: Dict, num_truth: int, num_detections: int) -> float:
+        """IDF1 = 2 IDTP / (true positions + detections) for the assignment of
+        tracks to true organisms that maximizes IDTP."""
+        if not pair_frames or not num_truth + num_detections:
+            return 0.0
+        true_ids = sorted({k[0] for k in pair_frames})
+        track_ids = sorted({k[1] for k in pair_frames})
+        row = {v: i for i, v in enumerate(true_ids)}
+        col = {v: i for i, v in enumerate(track_ids)}
+        overlap = np.zeros((len(true_ids), len(track_ids)))
+        for (true_id, track_id), n in pair_frames.items():
+            overlap[row[true_id], col[track_id]] = n
+        r, c = linear_sum_assignment(overlap, maximize=True)
+        return 2 * overlap[r, c].sum() / (num_truth + num_detections)
+
+    def print_summary(self) -> None:
+        """Print a human-readable summary of metrics."""
+        if not self.metrics:
+            self.compute_all_metrics()
+
+        m = self.metrics
+
         print("\n" + "="*60)
+        print("GROUND-TRUTH ACCURACY")
+        print("="*60)
+        print(f"  Precision: {m['precision']:.2%}")
+        print(f"  Recall: {m['recall']:.2%}")
+        if m['localization_error'] is not None:
+            print(f"  Localization error: {m['localization_error']:.2f} pixels")
+        if 'mota' in m:
+            print(f"  ID switches: {m['id_switches']}")
+            print(f"  MOTA: {m['mota']:.3f}")
+            print(f"  IDF1: {m['idf1']:.3f}")
+            print(f"  Tracks: {m['num_tracks']} (true: {m['num_true_tracks']})")
+        print("="*60)
+
+
+def convert_to_python_types(obj):
+    """Convert numpy types in nested dicts and lists to Python types for JSON serialization."""
+    if isinstance(obj, dict):
+        return {k: convert_to_python_types(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [convert_to_python_types(v) for v in obj]
+    elif isinstance(obj, (np.integer, np.floating)):
+        return obj.item()
+    elif isinstance(obj, np.ndarray):
+        return obj.tolist()
+    else:
+        return obj
 
 
 def test_parameters(video_path: str,
@@ -615,7 +884,10 @@ def test_parameters(video_path: str,
                    output_dir: str = "./tracking_results",
                    max_frames: Optional[int] = None,
                    run_version: Optional[str] = None,
-                   downsample_factor: int = 1) -> Dict:
+                   downsample_factor: int = 1,
+                   truth: Optional[str] = None,
+                   match_distance: Optional[float] = None,
+                   cache_dir: Optional[str] = None) -> Dict:
     """
     Test a set of tracking parameters and return quality metrics.
     
@@ -632,9 +904,15 @@ def test_parameters(video_path: str,
         output_dir: Directory for outputs
         max_frames: Maximum number of frames to process (None = all)
         run_version: Version string for this run (None = timestamp)
+        truth: Ground-truth CSV (frame, particle, y, x at full resolution), e.g. from
+            testing/benchmarks/synthetic.py; adds results['accuracy']
+        match_distance: Max distance in full-resolution pixels for a detection to match
+            a true organism (None = diameter * downsample_factor / 2)
+        cache_dir: Frame cache directory; the video is decoded and downsampled once and
+            every later run with the same video and downsample_factor maps those frames
         
     Returns:
-        Dictionary with score and metrics
+        Dictionary with score and metrics (plus accuracy, if truth is given, and runtime)
     """
     # Create output directory
     output_path = Path(output_dir)
@@ -662,15 +940,17 @@ def test_parameters(video_path: str,
     
     # Initialize tracker with pre-computed backgrounds
     tracker = MiracidiaTracker(video_path, max_frames=max_frames, downsample_factor=downsample_factor,
-                               backgrounds_dir="./backgrounds")
+                               backgrounds_dir="./backgrounds", cache_dir=cache_dir)
     tracker.load_video()
     
     # Detect features
+    start = time.perf_counter()
     features = tracker.detect_features(
         diameter=diameter,
         minmass=minmass,
         separation=separation
     )
+    runtime = {'detect_s': round(time.perf_counter() - start, 3)}
     
     if len(features) == 0:
         return {
@@ -686,15 +966,30 @@ def test_parameters(video_path: str,
         }
     
     # Link trajectories
+    start = time.perf_counter()
     trajectories = tracker.link_trajectories(
         search_range=search_range,
         memory=memory
     )
+    runtime['link_s'] = round(time.perf_counter() - start, 3)
     
     # Evaluate quality
     evaluator = TrackingEvaluator(trajectories)
     results = evaluator.compute_all_metrics()
     evaluator.print_summary()
+    results['runtime'] = runtime
+    
+    # Score against known trajectories if we have them
+    if truth is not None:
+        true_positions = pd.read_csv(truth)
+        if max_frames is not None:
+            true_positions = true_positions[true_positions['frame'] < max_frames]
+        if match_distance is None:
+            match_distance = diameter * downsample_factor / 2
+        accuracy = GroundTruthEvaluator(trajectories, true_positions, match_distance,
+                                        scale=downsample_factor)
+        results['accuracy'] = accuracy.compute_all_metrics()['metrics']
+        accuracy.print_summary()
     
     # Add parameters to results
     results['parameters'] = {
@@ -716,18 +1011,6 @@ def test_parameters(video_path: str,
     results['max_frames_used'] = max_frames
     
     # Convert numpy types to Python types for JSON serialization
-    def convert_to_python_types(obj):
-        if isinstance(obj, dict):
-            return {k: convert_to_python_types(v) for k, v in obj.items()}
-        elif isinstance(obj, list):
-            return [convert_to_python_types(v) for v in obj]
-        elif isinstance(obj, (np.integer, np.floating)):
-            return obj.item()
-        elif isinstance(obj, np.ndarray):
-            return obj.tolist()
-        else:
-            return obj
-    
     results = convert_to_python_types(results)
     
     with open(results_file, 'w') as f:
@@ -782,17 +1065,619 @@ def save_trajectory_plots(trajectories: pd.DataFrame,
     print(f"Trajectory plot saved to: {plot_file}")
 
 
+# Parameters test_parameters() uses when a sweep does not vary or fix them
+SWEEP_DEFAULTS = {
+    'diameter': 11,
+    'minmass': 100,
+    'separation': None,
+    'search_range': 5,
+    'memory': 3,
+}
+
+
+class SweepDatabase:
+    """
+    Sweep results in a SQLite file, one row per evaluated combination.
+    
+    Rows are keyed by the preprocessing settings plus the combination's parameters, so an
+    interrupted sweep (or a wider one over the same clip) skips everything already evaluated.
+    Only the process running the sweep writes to it; workers hand their results back.
+    """
+    
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, settings TEXT, parameters TEXT, "
+            "score REAL, result TEXT, finished TEXT)"
+        )
+        self.connection.commit()
+    
+    @staticmethod
+    def key(settings: Dict, parameters: Dict) -> str:
+        return json.dumps({'settings': settings, 'parameters': parameters}, sort_keys=True)
+    
+    def done(self) -> set:
+        """Keys of every combination already evaluated."""
+        return {row[0] for row in self.connection.execute("SELECT key FROM results")}
+    
+    def add(self, settings: Dict, parameters: Dict, result: Dict) -> None:
+        """Record one combination's result (committed immediately)."""
+        self.connection.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)",
+            (self.key(settings, parameters), json.dumps(settings, sort_keys=True),
+             json.dumps(parameters, sort_keys=True), result.get('score', 0),
+             json.dumps(convert_to_python_types(result)), datetime.now().isoformat())
+        )
+        self.connection.commit()
+    
+    def results(self, settings: Dict, parameters: Optional[list] = None) -> pd.DataFrame:
+        """
+        Results recorded with these settings (only those for the given parameter dicts, if
+        any), one row per combination: its parameters, score, metrics, accuracy (if scored
+        against ground truth) and runtime.
+        """
+        wanted = None if parameters is None else {self.key(settings, p) for p in parameters}
+        rows = []
+        for key, params, result in self.connection.execute(
+                "SELECT key, parameters, result FROM results WHERE settings = ?",
+                (json.dumps(settings, sort_keys=True),)):
+            if wanted is not None and key not in wanted:
+                continue
+            result = json.loads(result)
+            rows.append({**json.loads(params), 'score': result.get('score', 0),
+                         **result.get('metrics', {}), **result.get('accuracy', {}),
+                         **result.get('runtime', {}),
+                         **({'error': result['error']} if 'error' in result else {})})
+        return pd.DataFrame(rows)
+    
+    def close(self) -> None:
+        self.connection.close()
+
+
+def preprocess_video(video_path: str,
+                     output_dir: str,
+                     max_frames: Optional[int] = None,
+                     downsample_factor: int = 1,
+                     cache_dir: Optional[str] = "./frame_cache",
+                     backgrounds_dir: Optional[str] = "./backgrounds",
+                     chunk_size: int = 25) -> Tuple[Path, Dict]:
+    """
+    Decode, downsample and background-subtract a clip once for a whole sweep.
+    
+    The frames are exactly those detect_features() would locate in, saved as a uint8
+    .npy in output_dir that sweep workers memory-map. A file made earlier with the same
+    settings is reused.
+    
+    Returns:
+        Path of the .npy and the settings it was made with
+    """
+    tracker = MiracidiaTracker(video_path, max_frames=max_frames, downsample_factor=downsample_factor,
+                               backgrounds_dir=backgrounds_dir, cache_dir=cache_dir)
+    settings = {
+        'video': fingerprint(video_path),
+        'max_frames': max_frames,
+        'downsample_factor': downsample_factor,
+        'chunk_size': chunk_size,
+        'backgrounds': tracker.backgrounds_metadata,
+    }
+    digest = hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+    path = Path(output_dir) / f"preprocessed_{digest}.npy"
+    if path.exists():
+        return path, settings
+    
+    tracker.load_video()
+    total = tracker.total_frames if max_frames is None else min(max_frames, tracker.total_frames)
+    path.parent.mkdir(exist_ok=True, parents=True)
+    # written under a temporary name so a concurrent sweep never maps a partial file
+    tmp = path.with_name(f"{path.stem}.{os.getpid()}.tmp.npy")
+    
+    # each frame goes straight into the memory-mapped file, so the clip is never held twice
+    array = None
+    n = 0
+    for n, (_, frame) in enumerate(tracker.processed_frames(chunk_size=chunk_size), 1):
+        if array is None:
+            array = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.uint8,
+                                              shape=(total,) + frame.shape)
+        array[n - 1] = frame
+    if array is None:
+        raise IOError(f"No frames decoded from {video_path}")
+    array.flush()
+    if n < total:
+        # the container over-reported its frame count; keep what decoded
+        decoded = np.array(array[:n])
+        del array
+        np.save(tmp, decoded)
+    else:
+        del array
+    os.replace(tmp, path)
+    print(f"Preprocessed {n} frames into {path}")
+    return path, settings
+
+
+# State of a sweep worker process, set once by _init_sweep_worker
+_SWEEP = {}
+
+
+def _init_sweep_worker(frames_path, truth, match_distance, downsample_factor, output_dir, save_plots):
+    tp.quiet()
+    _SWEEP.update(
+        frames=np.load(frames_path, mmap_mode='r'),
+        truth=truth,
+        match_distance=match_distance,
+        downsample_factor=downsample_factor,
+        output_dir=Path(output_dir),
+        save_plots=save_plots,
+    )
+
+
+# Parameters that change what tp.locate finds. Combinations that share them are one
+# detection group: tp.locate keeps features with mass > minmass after refining them,
+# so every minmass in a group is a filter on a single locate at the group's lowest one.
+DETECTION_PARAMETERS = ('diameter', 'separation')
+
+
+def detection_groups(combinations: list) -> list:
+    """Split combinations into lists that differ only in minmass and linking parameters."""
+    groups = {}
+    for parameters in combinations:
+        key = tuple(parameters[p] for p in DETECTION_PARAMETERS)
+        groups.setdefault(key, []).append(parameters)
+    return list(groups.values())
+
+
+def _locate_group(group: list) -> Tuple[list, list]:
+    """
+    Locate once for a detection group.
+    
+    Returns (results, links): failed results for the whole group if locate raised, else no
+    results and one (parameters, features, runtime) argument tuple per combination for
+    _link_combination, with the features already cut to that combination's minmass.
+    """
+    try:
+        start = time.perf_counter()
+        first = group[0]
+        features = locate_frames(enumerate(_SWEEP['frames']), first['diameter'],
+                                 min(p['minmass'] for p in group), first['separation'],
+                                 progress=False)
+        detect_s = round(time.perf_counter() - start, 3)
+    except Exception as e:
+        # reported, but not recorded, so the group is retried on the next run
+        return [(p, {'score': 0.0, 'error': str(e), 'failed': True}) for p in group], []
+    
+    links = []
+    for parameters in group:
+        if len(features):
+            subset = features[features['mass'] > parameters['minmass']].reset_index(drop=True)
+        else:
+            subset = features
+        links.append((parameters, subset, {'detect_s': detect_s, 'detect_shared_by': len(group)}))
+    return [], links
+
+
+def _link_combination(parameters: Dict, features: pd.DataFrame, runtime: Dict) -> list:
+    """Link and score one combination of a located group; returns [(parameters, result)]."""
+    try:
+        result = _score_combination(parameters, features)
+        result['runtime'] = {**runtime, **result.get('runtime', {})}
+    except Exception as e:
+        result = {'score': 0.0, 'error': str(e), 'failed': True}
+    return [(parameters, result)]
+
+
+def _evaluate_group(group: list) -> list:
+    """Locate once for a detection group, then link and score each of its combinations."""
+    results, links = _locate_group(group)
+    for args in links:
+        results += _link_combination(*args)
+    return results
+
+
+def _pool_results(pool, groups: list):
+    """
+    Evaluate groups on pool, yielding lists of (parameters, result) as they finish.
+    
+    Each group's locate is one task; as soon as it is done, every combination of the group
+    is linked and scored as a task of its own, so a grid with few diameters still keeps all
+    workers busy.
+    """
+    finished = queue.Queue()
+    
+    def submit(function, args, located=False):
+        pool.apply_async(function, args,
+                         callback=lambda r: finished.put(r if located else (r, [])),
+                         error_callback=finished.put)
+    
+    for group in groups:
+        submit(_locate_group, (group,), located=True)
+    pending = len(groups)
+    while pending:
+        item = finished.get()
+        pending -= 1
+        if isinstance(item, BaseException):
+            raise item
+        results, links = item
+        for args in links:
+            submit(_link_combination, args)
+            pending += 1
+        if results:
+            yield results
+
+
+def _score_combination(parameters: Dict, features: pd.DataFrame) -> Dict:
+    """Link and score one combination's features."""
+    if len(features) == 0:
+        return {'score': 0.0, 'error': 'No features detected'}
+    
+    start = time.perf_counter()
+    try:
+        trajectories = tp.link(features, search_range=parameters['search_range'],
+                               memory=parameters['memory'])
+    except tp.linking.SubnetOversizeException as e:
+        # search_range too large for this density: a result, not a failure to retry
+        return {'score': 0.0, 'error': f"Linking failed: {e}"}
+    runtime = {'link_s': round(time.perf_counter() - start, 3)}
+    
+    result = TrackingEvaluator(trajectories).compute_all_metrics()
+    result['runtime'] = runtime
+    truth = _SWEEP['truth']
+    if truth is not None:
+        match_distance = _SWEEP['match_distance'] or parameters['diameter'] * _SWEEP['downsample_factor'] / 2
+        accuracy = GroundTruthEvaluator(trajectories, truth, match_distance,
+                                        scale=_SWEEP['downsample_factor'])
+        result['accuracy'] = accuracy.compute_all_metrics()['metrics']
+    if _SWEEP['save_plots']:
+        save_trajectory_plots(trajectories, _SWEEP['output_dir'], parameters['diameter'],
+                              parameters['minmass'])
+    return convert_to_python_types(result)
+
+
+def _record_results(db: SweepDatabase, settings: Dict, results, total: int) -> None:
+    n = 0
+    for group in results:
+        for parameters, result in group:
+            n += 1
+            if result.get('failed'):
+                print(f"[{n}/{total}] {parameters}: ERROR: {result['error']}")
+                continue
+            db.add(settings, parameters, result)
+            print(f"[{n}/{total}] {parameters}: score={result['score']:.2f}")
+
+
+def run_sweep(video_path: str,
+              grid: Optional[Dict[str, list]] = None,
+              output_dir: str = "./tracking_results",
+              max_frames: Optional[int] = None,
+              downsample_factor: int = 1,
+              processes: Optional[int] = None,
+              truth: Optional[str] = None,
+              match_distance: Optional[float] = None,
+              fixed: Optional[Dict] = None,
+              save_plots: bool = False,
+              db_path: Optional[str] = None,
+              cache_dir: Optional[str] = "./frame_cache",
+              backgrounds_dir: Optional[str] = "./backgrounds",
+              combinations: Optional[list] = None) -> pd.DataFrame:
+    """
+    Evaluate every combination of a parameter grid (or a list of combinations) in parallel.
+    
+    The clip is decoded and background-subtracted once (preprocess_video), then combinations
+    are spread over a pool of worker processes that memory-map the preprocessed frames and
+    locate, link and score in them. Combinations that differ only in minmass and linking
+    parameters share one locate (see detection_groups), so a grid over N minmass values
+    costs about one locate per diameter instead of N; their linking then runs as separate
+    tasks across the pool. Each result is written to a SQLite
+    database as soon as it arrives, and combinations already in the database are skipped, so
+    an interrupted sweep picks up where it stopped when run again.
+    
+    Args:
+        video_path: Path to test video
+        grid: Values to try for any of diameter, minmass, separation, search_range, memory
+            (e.g. {'diameter': [5, 7], 'minmass': [30, 50]})
+        output_dir: Directory for the database, preprocessed frames and plots
+        max_frames: Maximum number of frames to process (None = all)
+        downsample_factor: Factor to downsample frames by
+        processes: Worker processes (None = the cores available to this job)
+        truth: Ground-truth CSV; adds accuracy columns (see GroundTruthEvaluator)
+        match_distance: Max distance in full-resolution pixels for a ground-truth match
+            (None = diameter * downsample_factor / 2)
+        fixed: Values for the parameters not in grid (defaults: SWEEP_DEFAULTS)
+        save_plots: Save a trajectory plot for every combination
+        db_path: SQLite results database (None = output_dir/sweep.sqlite)
+        cache_dir: Frame cache directory (see MiracidiaTracker)
+        backgrounds_dir: Pre-computed backgrounds (see generate_backgrounds.py)
+        combinations: Parameter dicts to evaluate instead of a grid (missing parameters
+            come from fixed and SWEEP_DEFAULTS)
+        
+    Returns:
+        DataFrame with one row per combination, sorted by score
+    """
+    output_path = Path(output_dir)
+    output_path.mkdir(exist_ok=True, parents=True)
+    frames_path, settings = preprocess_video(video_path, output_dir, max_frames, downsample_factor,
+                                             cache_dir, backgrounds_dir)
+    
+    base = {**SWEEP_DEFAULTS, **(fixed or {})}
+    if combinations is None:
+        names = list(grid)
+        combinations = [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+    combinations = [{**base, **c} for c in combinations]
+    
+    db = SweepDatabase(db_path or output_path / "sweep.sqlite")
+    done = db.done()
+    todo = [c for c in combinations if db.key(settings, c) not in done]
+    print(f"Sweep: {len(combinations)} combinations, {len(combinations) - len(todo)} already done")
+    
+    true_positions = None
+    if truth is not None:
+        true_positions = pd.read_csv(truth)
+        if max_frames is not None:
+            true_positions = true_positions[true_positions['frame'] < max_frames]
+    initargs = (frames_path, true_positions, match_distance, downsample_factor, output_path, save_plots)
+    
+    groups = detection_groups(todo)
+    if processes is None:
+        processes = available_cores()
+    processes = max(1, min(processes, len(todo)))
+    if processes == 1:
+        _init_sweep_worker(*initargs)
+        _record_results(db, settings, map(_evaluate_group, groups), len(todo))
+    else:
+        with get_context().Pool(processes, initializer=_init_sweep_worker, initargs=initargs) as pool:
+            _record_results(db, settings, _pool_results(pool, groups), len(todo))
+    
+    results_df = db.results(settings, combinations)
+    db.close()
+    if len(results_df) == 0:
+        return results_df
+    return results_df.sort_values('score', ascending=False).reset_index(drop=True)
+
+
+# Ranges searched by the adaptive optimizers, at full resolution
+SEARCH_SPACE = {
+    'diameter': (9, 41),
+    'minmass': (100, 3000),
+    'search_range': (5, 60),
+    'memory': (1, 30),
+}
+INTEGER_PARAMETERS = ('diameter', 'memory')
+LOG_PARAMETERS = ('minmass',)  # searched on a log scale
+
+# (max_frames, downsample_factor) of each successive-halving rung, cheapest first
+RUNGS = ((75, 4), (150, 2), (300, 1))
+
+
+def scale_parameters(parameters: Dict, factor: int) -> Dict:
+    """
+    Convert full-resolution parameters to a clip downsampled by factor.
+    
+    Lengths shrink by factor (diameter stays odd and at least 3), and minmass by factor**2,
+    since a feature's integrated brightness covers factor**2 fewer pixels. memory is in frames
+    and does not change.
+    """
+    scaled = dict(parameters)
+    if 'diameter' in scaled:
+        scaled['diameter'] = max(3, int(round(scaled['diameter'] / factor)) // 2 * 2 + 1)
+    if 'minmass' in scaled:
+        scaled['minmass'] = round(scaled['minmass'] / factor ** 2, 2)
+    for length in ('search_range', 'separation'):
+        if scaled.get(length) is not None:
+            scaled[length] = round(scaled[length] / factor, 2)
+    return scaled
+
+
+def _from_unit(u: np.ndarray, space: Dict) -> Dict:
+    """Parameters for a point of the unit cube over space."""
+    parameters = {}
+    for x, (name, (low, high)) in zip(u, space.items()):
+        if name in LOG_PARAMETERS:
+            value = float(np.exp(np.log(low) + x * (np.log(high) - np.log(low))))
+        else:
+            value = low + x * (high - low)
+        if name == 'diameter':
+            value = int(round(value)) // 2 * 2 + 1
+        elif name in INTEGER_PARAMETERS:
+            value = int(round(value))
+        else:
+            value = round(float(value), 2)
+        parameters[name] = value
+    return parameters
+
+
+def _to_unit(parameters: Dict, space: Dict) -> np.ndarray:
+    u = []
+    for name, (low, high) in space.items():
+        if name in LOG_PARAMETERS:
+            u.append((np.log(parameters[name]) - np.log(low)) / (np.log(high) - np.log(low)))
+        else:
+            u.append((parameters[name] - low) / (high - low))
+    return np.clip(u, 0, 1)
+
+
+def sample_space(space: Dict, n: int, seed: int = 0) -> list:
+    """n distinct random parameter sets from space (Latin hypercube, so every range is covered)."""
+    rng = np.random.default_rng(seed)
+    u = (np.array([rng.permutation(n) for _ in space]).T + rng.random((n, len(space)))) / n
+    samples = []
+    for point in u:
+        parameters = _from_unit(point, space)
+        if parameters not in samples:
+            samples.append(parameters)
+    return samples
+
+
+def _find_result(results: pd.DataFrame, parameters: Dict) -> Optional[Dict]:
+    """The row of a run_sweep result for one combination (None if it failed)."""
+    for row in results.to_dict('records'):
+        if all(row[p] == v or (v is None and pd.isna(row[p]))
+               for p, v in parameters.items() if p in SWEEP_DEFAULTS):
+            return row
+    return None
+
+
+def successive_halving(video_path: str,
+                       candidates: list,
+                       rungs=RUNGS,
+                       eta: int = 3,
+                       objective: str = 'score',
+                       output_dir: str = "./tracking_results",
+                       **sweep_kwargs) -> pd.DataFrame:
+    """
+    Evaluate candidates on a cheap clip and promote only the best to costlier ones.
+    
+    Every candidate runs on the first rung (a short, downsampled clip); the best 1/eta of
+    them move on to the next rung, and so on, so only a handful reach the longest clip at
+    full resolution. Candidates are given at full resolution and converted for each rung
+    with scale_parameters. Each rung is a run_sweep, so rungs run in parallel and an
+    interrupted search resumes from its database.
+    
+    Args:
+        video_path: Path to test video
+        candidates: Full-resolution parameter dicts (e.g. from sample_space); parameters they
+            leave out come from sweep_kwargs['fixed'] (also full resolution) and SWEEP_DEFAULTS
+        rungs: (max_frames, downsample_factor) of each rung, cheapest first
+        eta: Fraction of candidates (1/eta) promoted from each rung
+        objective: Result column to maximize ('score', or e.g. 'idf1' with truth)
+        output_dir: Directory for outputs
+        **sweep_kwargs: Passed to run_sweep (processes, truth, fixed, ...)
+        
+    Returns:
+        DataFrame with every evaluation (full-resolution parameters plus rung, max_frames and
+        downsample_factor), best candidates of the last rung first
+    """
+    base = {**SWEEP_DEFAULTS, **(sweep_kwargs.pop('fixed', None) or {})}
+    candidates = [{**base, **c} for c in candidates]
+    evaluations = []
+    for rung, (max_frames, factor) in enumerate(rungs):
+        print(f"\n{'='*60}")
+        print(f"RUNG {rung}: {len(candidates)} candidates, {max_frames} frames at {factor}x downsampling")
+        print(f"{'='*60}")
+        scaled = [scale_parameters(c, factor) for c in candidates]
+        results = run_sweep(video_path, output_dir=output_dir, max_frames=max_frames,
+                            downsample_factor=factor, combinations=scaled, **sweep_kwargs)
+        rows = []
+        for candidate, s in zip(candidates, scaled):
+            row = _find_result(results, s) or {objective: np.nan}
+            rows.append({**candidate, **{k: v for k, v in row.items() if k not in candidate},
+                         'rung': rung, 'max_frames': max_frames, 'downsample_factor': factor})
+        rung_df = pd.DataFrame(rows).sort_values(objective, ascending=False, na_position='last')
+        evaluations.append(rung_df)
+        if rung < len(rungs) - 1:
+            keep = max(1, int(np.ceil(len(candidates) / eta)))
+            candidates = [{p: r[p] for p in SWEEP_DEFAULTS} for r in rung_df.head(keep).to_dict('records')]
+    
+    history = pd.concat(evaluations, ignore_index=True)
+    return history.sort_values(['rung', objective], ascending=False).reset_index(drop=True)
+
+
+def _expected_improvement(X: np.ndarray, y: np.ndarray, candidates: np.ndarray,
+                          length_scale: float = 0.25, noise: float = 1e-2) -> np.ndarray:
+    """Expected improvement over max(y) at candidates, under a Gaussian-process surrogate
+    (RBF kernel on the unit cube) fitted to the observations X, y."""
+    from scipy.linalg import cho_factor, cho_solve
+    from scipy.stats import norm
+    
+    def kernel(a, b):
+        d2 = ((a[:, None, :] - b[None, :, :]) ** 2).sum(axis=2)
+        return np.exp(-d2 / (2 * length_scale ** 2))
+    
+    std = y.std() or 1.0
+    yn = (y - y.mean()) / std
+    factor = cho_factor(kernel(X, X) + noise * np.eye(len(X)))
+    cross = kernel(candidates, X)
+    mean = cross @ cho_solve(factor, yn)
+    var = 1 - np.einsum('ij,ji->i', cross, cho_solve(factor, cross.T))
+    sd = np.sqrt(np.clip(var, 1e-12, None))
+    z = (mean - yn.max()) / sd
+    return (mean - yn.max()) * norm.cdf(z) + sd * norm.pdf(z)
+
+
+def bayesian_search(video_path: str,
+                    space: Optional[Dict] = None,
+                    initial: int = 8,
+                    iterations: int = 4,
+                    batch: Optional[int] = None,
+                    objective: str = 'score',
+                    max_frames: Optional[int] = 75,
+                    downsample_factor: int = 4,
+                    seed: int = 0,
+                    **sweep_kwargs) -> pd.DataFrame:
+    """
+    Search continuous parameters with a Gaussian-process surrogate.
+    
+    Starts from a Latin-hypercube sample of space, then each iteration fits a Gaussian
+    process to every result so far and evaluates the batch of untried points with the
+    highest expected improvement. Batches run in parallel through run_sweep. Parameters are
+    given and returned at full resolution and scaled to downsample_factor for evaluation.
+    
+    Args:
+        video_path: Path to test video
+        space: {name: (low, high)} to search (default: SEARCH_SPACE); other parameters come
+            from sweep_kwargs['fixed'] (at full resolution) and SWEEP_DEFAULTS
+        initial: Number of random starting points
+        iterations: Number of surrogate-guided batches
+        batch: Points per batch (None = the cores available to this job)
+        objective: Result column to maximize ('score', or e.g. 'idf1' with truth)
+        max_frames: Clip length to evaluate on
+        downsample_factor: Factor to downsample frames by
+        seed: Random seed
+        **sweep_kwargs: Passed to run_sweep (processes, truth, fixed, ...)
+        
+    Returns:
+        DataFrame with every evaluated point (full-resolution parameters), best first
+    """
+    space = space or SEARCH_SPACE
+    base = {**SWEEP_DEFAULTS, **(sweep_kwargs.pop('fixed', None) or {})}
+    if batch is None:
+        batch = sweep_kwargs.get('processes') or available_cores()
+    rng = np.random.default_rng(seed)
+    
+    def evaluate(points):
+        points = [{**base, **p} for p in points]
+        scaled = [scale_parameters(p, downsample_factor) for p in points]
+        results = run_sweep(video_path, max_frames=max_frames, downsample_factor=downsample_factor,
+                            combinations=scaled, **sweep_kwargs)
+        rows = []
+        for point, s in zip(points, scaled):
+            row = _find_result(results, s)
+            if row is not None:
+                rows.append({**row, **point})
+        return rows
+    
+    rows = evaluate(sample_space(space, initial, seed))
+    for iteration in range(iterations):
+        tried = [{name: r[name] for name in space} for r in rows]
+        X = np.array([_to_unit(p, space) for p in tried])
+        y = np.nan_to_num(np.array([r[objective] for r in rows], float))
+        pool = [_from_unit(u, space) for u in rng.random((2000, len(space)))]
+        pool = [p for p in {json.dumps(p, sort_keys=True): p for p in pool}.values() if p not in tried]
+        ei = _expected_improvement(X, y, np.array([_to_unit(p, space) for p in pool]))
+        proposals = [pool[i] for i in np.argsort(ei)[::-1][:batch]]
+        print(f"\nIteration {iteration + 1}/{iterations}: best {objective} so far {y.max():.3f}, "
+              f"trying {len(proposals)} points")
+        rows += evaluate(proposals)
+    
+    return pd.DataFrame(rows).sort_values(objective, ascending=False).reset_index(drop=True)
+
+
 def batch_parameter_search(video_path: str,
                            diameter_range: list = [7, 9, 11, 13, 15],
                            minmass_range: list = [50, 100, 200, 300, 500],
                            output_dir: str = "./batch_results",
                            max_frames: Optional[int] = None,
                            run_version: Optional[str] = None,
-                           downsample_factor: int = 1) -> pd.DataFrame:
+                           downsample_factor: int = 1,
+                           truth: Optional[str] = None,
+                           cache_dir: Optional[str] = "./frame_cache",
+                           processes: Optional[int] = None) -> pd.DataFrame:
     """
     Test multiple parameter combinations and return results.
     
-    This is useful for an initial broad search.
+    This is useful for an initial broad search. Combinations run in parallel with
+    run_sweep(), and results are kept in output_dir/sweep.sqlite, so rerunning an
+    interrupted search only evaluates what is missing.
     
     Args:
         video_path: Path to test video
@@ -801,6 +1686,9 @@ def batch_parameter_search(video_path: str,
         output_dir: Directory for outputs
         max_frames: Maximum number of frames to process
         run_version: Version string for this batch run
+        truth: Ground-truth CSV; adds precision, recall, MOTA and IDF1 columns
+        cache_dir: Frame cache directory, so the video is decoded once for all combinations
+        processes: Worker processes (None = the cores available to this job)
         
     Returns:
         DataFrame with all results sorted by score
@@ -808,52 +1696,20 @@ def batch_parameter_search(video_path: str,
     if run_version is None:
         run_version = datetime.now().strftime("%Y%m%d_%H%M%S")
     
-    results_list = []
-    
-    total_tests = len(diameter_range) * len(minmass_range)
-    test_num = 0
-    
-    for diameter in diameter_range:
-        for minmass in minmass_range:
-            test_num += 1
-            print(f"\n{'='*60}")
-            print(f"TEST {test_num}/{total_tests}: diameter={diameter}, minmass={minmass}")
-            print(f"{'='*60}")
-            
-            try:
-                result = test_parameters(
-                    video_path=video_path,
-                    diameter=diameter,
-                    minmass=minmass,
-                    output_dir=output_dir,
-                    save_plots=False,  # Save plots only for best
-                    max_frames=max_frames,
-                    run_version=f"{run_version}_batch",
-                    downsample_factor=downsample_factor
-                )
-                
-                results_list.append({
-                    'diameter': diameter,
-                    'minmass': minmass,
-                    'score': result['score'],
-                    'num_tracks': result['metrics'].get('num_tracks', 0),
-                    'track_length_mean': result['metrics'].get('track_length_mean', 0),
-                    'long_track_ratio': result['metrics'].get('long_track_ratio', 0),
-                    'noise_ratio': result['metrics'].get('noise_ratio', 0)
-                })
-                
-            except Exception as e:
-                print(f"ERROR: Test failed: {e}")
-                results_list.append({
-                    'diameter': diameter,
-                    'minmass': minmass,
-                    'score': 0,
-                    'error': str(e)
-                })
-    
-    # Create results DataFrame
-    results_df = pd.DataFrame(results_list)
-    results_df = results_df.sort_values('score', ascending=False)
+    results_df = run_sweep(
+        video_path=video_path,
+        grid={'diameter': diameter_range, 'minmass': minmass_range},
+        output_dir=output_dir,
+        max_frames=max_frames,
+        downsample_factor=downsample_factor,
+        processes=processes,
+        truth=truth,
+        cache_dir=cache_dir
+    )
+    columns = ['diameter', 'minmass', 'score', 'num_tracks', 'track_length_mean', 'long_track_ratio',
+               'noise_ratio', 'precision', 'recall', 'mota', 'idf1', 'id_switches', 'detect_s', 'link_s',
+               'error']
+    results_df = results_df[[c for c in columns if c in results_df.columns]]
     
     # Save results
     output_path = Path(output_dir)
@@ -882,6 +1738,23 @@ if __name__ == "__main__":
     parser.add_argument("--memory", type=int, default=3, help="Linking memory")
     parser.add_argument("--output", default="./tracking_results", help="Output directory")
     parser.add_argument("--batch", action="store_true", help="Run batch parameter search")
+    parser.add_argument("--search", choices=["halving", "bayes"], default=None,
+                        help="Adaptive search over SEARCH_SPACE instead of a single test: successive "
+                             "halving over short, downsampled clips up to full resolution, or a "
+                             "Gaussian-process search on a 75-frame, 4x-downsampled clip")
+    parser.add_argument("--candidates", type=int, default=27,
+                        help="Starting candidates for --search halving (random points for bayes)")
+    parser.add_argument("--iterations", type=int, default=4,
+                        help="Surrogate-guided batches for --search bayes")
+    parser.add_argument("--objective", default="score",
+                        help="Result column to maximize in --search (e.g. idf1 with --truth)")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Worker processes for --batch and --search (default: all available cores)")
+    parser.add_argument("--truth", default=None,
+                        help="Ground-truth CSV of a synthetic video (adds accuracy metrics)")
+    parser.add_argument("--cache", default=None,
+                        help="Frame cache directory shared between runs (default: none; "
+                             "./frame_cache for --batch)")
     
     args = parser.parse_args()
     
@@ -889,8 +1762,25 @@ if __name__ == "__main__":
         # Run batch search
         results = batch_parameter_search(
             video_path=args.video,
-            output_dir=args.output
+            output_dir=args.output,
+            truth=args.truth,
+            cache_dir=args.cache or "./frame_cache",
+            processes=args.processes
         )
+    elif args.search:
+        search_kwargs = dict(objective=args.objective, output_dir=args.output, processes=args.processes,
+                             truth=args.truth, cache_dir=args.cache or "./frame_cache")
+        if args.search == "halving":
+            results = successive_halving(args.video, sample_space(SEARCH_SPACE, args.candidates),
+                                         **search_kwargs)
+        else:
+            results = bayesian_search(args.video, initial=args.candidates, iterations=args.iterations,
+                                      **search_kwargs)
+        results_file = Path(args.output) / f"{args.search}_search_results.csv"
+        results.to_csv(results_file, index=False)
+        print(f"\nBEST PARAMETERS (full resolution):")
+        print(results.head(5)[list(SWEEP_DEFAULTS) + [args.objective]].to_string(index=False))
+        print(f"\nFull results saved to: {results_file}")
     else:
         # Run single test
         results = test_parameters(
@@ -900,7 +1790,9 @@ if __name__ == "__main__":
             separation=args.separation,
             search_range=args.search_range,
             memory=args.memory,
-            output_dir=args.output
+            output_dir=args.output,
+            truth=args.truth,
+            cache_dir=args.cache
         )
         
         print(f"\n{'='*60}")
@@ -0,0 +1,155 @@
+"""
+Tracking accuracy against ground truth, per detection engine and parameter set.
+
+Synthesizes a video with synthetic.py (or takes a clip and its _truth.csv),
+background-subtracts it once with the chunk engine, then for every engine in
+utils/detection.py and every diameter x minmass x search_range combination
+locates, links with tp.link and scores the tracks with
+GroundTruthEvaluator from testing/agent-testing/optimze_tracking.py:
+detection precision and recall, localization error, identity switches,
+MOTA and IDF1. Locate and link times are reported alongside, so a faster
+mode can be accepted or rejected on what it costs in accuracy.
+
+Every result is appended to a JSON-lines report with the git commit.
+
+Usage:
+    python accuracy_benchmark.py --frames 100 --particles 20 --diameter 23 --minmass 550 1000
+    python accuracy_benchmark.py --engines trackpy pyramid --factor 4 --preset planaria --diameter 83
+    python accuracy_benchmark.py --video clip.mp4 --truth clip_truth.csv --diameter 23
+"""
+
+import argparse
+import itertools
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import trackpy as tp
+
+from synthetic import PRESETS, synthesize
+from pipeline_benchmark import commit
+
+REPO = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(REPO / "utils"))
+sys.path.insert(0, str(REPO / "testing" / "agent-testing"))
+from background import make_background
+from detection import ENGINES
+from frames import VideoFrames
+from optimze_tracking import GroundTruthEvaluator
+from preprocess import subtract_absdiff
+
+tp.quiet()
+
+
+def subtracted_frames(video, stop, chunk):
+    engine = make_background("chunk", chunk)
+    return [subtract_absdiff(frame, background, np.empty_like(frame))
+            for _, frame, background in engine.apply(VideoFrames(video, stop=stop))]
+
+
+def evaluate(frames, truth, engine, diameter, minmass, search_range, memory,
+             match_distance, **kwargs):
+    """Locate, link and score one configuration; return one record."""
+    locate = ENGINES[engine]
+    start = time.perf_counter()
+    features = []
+    for i, frame in enumerate(frames):
+        f = locate(frame, diameter=diameter, minmass=minmass, **kwargs)
+        features.append(f.assign(frame=i))
+    features = pd.concat(features, ignore_index=True)
+    locate_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if len(features):
+        tracks = tp.link(features, search_range=search_range, memory=memory)
+    else:
+        tracks = features.assign(particle=pd.Series(dtype=int))
+    link_s = time.perf_counter() - start
+
+    metrics = GroundTruthEvaluator(tracks, truth, match_distance).compute_all_metrics()["metrics"]
+    return {"engine": engine, "diameter": diameter, "minmass": minmass,
+            "search_range": search_range, "memory": memory, **kwargs,
+            "locate_ms": round(locate_s / len(frames) * 1000, 2),
+            "link_s": round(link_s, 3),
+            **{k: round(v, 4) if isinstance(v, float) else v
+               for k, v in metrics.items()}}
+
+
+def run(args, workdir):
+    if args.video:
+        video, truth = args.video, pd.read_csv(args.truth)
+    else:
+        preset = PRESETS[args.preset]
+        video = Path(workdir, f"{args.preset}_accuracy.mp4")
+        truth = synthesize(video, args.frames, args.particles, args.height,
+                           args.width, args.size or preset["size"],
+                           preset["motion"], preset["brightness"],
+                           preset["level"], seed=args.seed)
+    truth = truth[truth["frame"] < args.frames]
+    frames = subtracted_frames(video, args.frames, args.chunk)
+
+    records = []
+    for engine, diameter, minmass, search_range in itertools.product(
+            args.engines, args.diameter, args.minmass, args.search_range):
+        kwargs = {"factor": args.factor} if engine == "pyramid" else {}
+        match_distance = args.match_distance or diameter / 2
+        record = evaluate(frames, truth, engine, diameter, minmass, search_range,
+                          args.memory, match_distance, **kwargs)
+        records.append(record)
+        print(f"{engine:<10} d={diameter:<4} m={minmass:<7g} sr={search_range:<5g} "
+              f"{record['locate_ms']:>8.2f} ms/frame  recall {record['recall']:.3f}  "
+              f"precision {record['precision']:.3f}  MOTA {record['mota']:.3f}  "
+              f"IDF1 {record['idf1']:.3f}  switches {record['id_switches']}")
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score tracking against ground truth.")
+    parser.add_argument("--video", default=None,
+                        help="Clip to score (default: a synthetic video).")
+    parser.add_argument("--truth", default=None,
+                        help="Ground-truth CSV for --video (frame, particle, y, x).")
+    parser.add_argument("--preset", choices=list(PRESETS), default="miracidia")
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--particles", type=int, default=20)
+    parser.add_argument("--height", type=int, default=918)
+    parser.add_argument("--width", type=int, default=1374)
+    parser.add_argument("--size", type=int, default=None,
+                        help="Organism diameter (default: the preset's).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engines", nargs="+", choices=list(ENGINES),
+                        default=["trackpy"])
+    parser.add_argument("--diameter", type=int, nargs="+", default=[23])
+    parser.add_argument("--minmass", type=float, nargs="+", default=[550])
+    parser.add_argument("--search-range", type=float, nargs="+", default=[10])
+    parser.add_argument("--memory", type=int, default=3)
+    parser.add_argument("--factor", type=int, default=4,
+                        help="Downsampling factor for the pyramid engine.")
+    parser.add_argument("--chunk", type=int, default=25,
+                        help="Frames per background chunk.")
+    parser.add_argument("--match-distance", type=float, default=None,
+                        help="Max distance for a detection to match a true "
+                        "organism (default: diameter / 2).")
+    parser.add_argument("--report", default="accuracy_benchmark.jsonl",
+                        help="JSON-lines report to append to.")
+    args = parser.parse_args()
+    if args.video and not args.truth:
+        parser.error("--video needs --truth")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        records = run(args, workdir)
+
+    run_info = {"commit": commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "video": args.video or args.preset, "frames": args.frames}
+    with open(args.report, "a") as f:
+        for record in records:
+            f.write(json.dumps({**run_info, **record}) + "\n")
+    print(f"Wrote {len(records)} results to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Check and time the background engines in utils/background.py.
+
+First checks on short random clips that every engine yields, for each frame,
+the same background as a brute-force reference:
+- chunk / chunk-median: np.amax / np.median over the frame's aligned chunk;
+- max / median / percentile: np.amax / np.percentile(method="nearest") over
+  the frame's centred window, clamped to the clip.
+
+Then streams random uint8 frames through each engine and reports milliseconds
+per frame, so the sliding-window engines can be compared against the chunked
+np.amax background that tracking.py has always used. Exits non-zero on any
+mismatch.
+
+Usage:
+    python background_benchmark.py --height 918 --width 1374 --frames 200
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "utils"))
+from background import BACKGROUNDS, make_background
+
+
+def reference(frames, mode, window, percentile=50):
+    """Brute-force background for every frame of frames."""
+    n = len(frames)
+    for t in range(n):
+        if mode.startswith("chunk"):
+            s = t - t % window
+            stack = frames[s:s + window]
+        else:
+            s = min(max(t - window // 2, 0), max(n - window, 0))
+            stack = frames[s:s + window]
+        if mode == "chunk-median":
+            yield np.median(stack, axis=0).astype(np.uint8)
+        elif mode in ("chunk", "max"):
+            yield np.amax(stack, axis=0)
+        else:
+            q = 50 if mode == "median" else percentile
+            yield np.percentile(stack, q, axis=0, method="nearest")
+
+
+def check(height=16, width=24):
+    rng = np.random.default_rng(0)
+    for n in (3, 24, 25, 61):
+        frames = rng.integers(0, 256, (n, height, width), np.uint8)
+        for mode in BACKGROUNDS:
+            for window in (1, 4, 5, 25):
+                percentile = 90 if mode == "percentile" else 50
+                engine = make_background(mode, window, percentile)
+                # engines reuse their frame and background buffers, so each
+                # is compared as it is yielded
+                out = engine.apply(iter(frames))
+                refs = reference(frames, mode, window, percentile)
+                seen = 0
+                for (t, frame, background), ref in zip(out, refs):
+                    if t != seen:
+                        sys.exit(f"{mode} (window={window}, {n} frames) "
+                                 f"yielded frame {t} in place of {seen}")
+                    seen += 1
+                    if not np.array_equal(frame, frames[t]):
+                        sys.exit(f"{mode} (window={window}, {n} frames) "
+                                 f"yielded the wrong frame {t}")
+                    if not np.array_equal(background, ref):
+                        sys.exit(f"{mode} (window={window}, {n} frames) "
+                                 f"background mismatch at frame {t}")
+                if seen != n or next(out, None) is not None:
+                    sys.exit(f"{mode} (window={window}, {n} frames) "
+                             f"yielded {seen} frames")
+    print("All background engines match their brute-force references.")
+
+
+def time_engine(frames, mode, window):
+    engine = make_background(mode, window)
+    start = time.perf_counter()
+    n = 0
+    for _ in engine.apply(iter(frames)):
+        n += 1
+    elapsed = time.perf_counter() - start
+    return elapsed / n * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark background engines.")
+    parser.add_argument("--height", type=int, default=918)
+    parser.add_argument("--width", type=int, default=1374)
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--windows", type=int, nargs="+", default=[5, 25, 75])
+    parser.add_argument("--modes", nargs="+", default=["chunk", "max", "median"])
+    args = parser.parse_args()
+
+    check()
+
+    rng = np.random.default_rng(0)
+    frames = rng.integers(0, 256, (args.frames, args.height, args.width), np.uint8)
+
+    print(f"{args.frames} frames of {args.height}x{args.width}")
+    print(f"{'mode':<8} {'window':>6} {'ms/frame':>10}")
+    for window in args.windows:
+        for mode in args.modes:
+            ms = time_engine(frames, mode, window)
+            print(f"{mode:<8} {window:>6} {ms:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Compare the ffmpeg luma decoder with the cv2 decoder in utils/frames.py.
+
+Decodes the same frames with both backends and reports per-frame pixel
+differences and decode throughput. ffmpeg's gray output and cv2's
+BGR2GRAY differ by rounding and YUV range conversion only, so the maximum
+difference should stay within a couple of grey levels. Exits non-zero if it
+exceeds --tolerance.
+
+Then checks, for each decoder, that reading the frames as --shards
+consecutive ranges (as tracking.py --shard and checkpoint resume do) and as
+a strided range returns exactly the frames of the single full read, and
+that each ffmpeg range starts on the same frame as cv2's. Exits non-zero on
+any mismatch.
+
+Usage:
+    python decode_compat.py video.mp4 --frames 200
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "utils"))
+from frames import open_video
+
+
+def decode(video, decoder, frames):
+    start = time.perf_counter()
+    out = [frame.copy() for frame in open_video(video, decoder, stop=frames)]
+    return out, time.perf_counter() - start
+
+
+def check_shards(video, shards, ref, luma, tolerance):
+    full = {"cv2": ref, "ffmpeg": luma}
+    bounds = np.linspace(0, len(ref), shards + 1).astype(int)
+    for decoder, expected in full.items():
+        pieces = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            piece = [frame.copy() for frame in
+                     open_video(video, decoder, start=start, stop=stop)]
+            if len(piece) != stop - start:
+                sys.exit(f"{decoder}: frames {start}-{stop} gave {len(piece)} frames")
+            pieces += piece
+        for i, (a, b) in enumerate(zip(pieces, expected)):
+            if not np.array_equal(a, b):
+                sys.exit(f"{decoder}: frame {i} read in shards differs from "
+                         f"the full read")
+        strided = [frame.copy() for frame in
+                   open_video(video, decoder, start=3, stop=len(ref), step=4)]
+        if len(strided) != len(range(3, len(ref), 4)):
+            sys.exit(f"{decoder}: a strided read gave {len(strided)} frames")
+        for i, frame in zip(range(3, len(ref), 4), strided):
+            if not np.array_equal(frame, expected[i]):
+                sys.exit(f"{decoder}: frame {i} of a strided read differs "
+                         f"from the full read")
+
+    # the ffmpeg range must start on cv2's frame, not one either side
+    for start in bounds[1:-1]:
+        first = next(iter(open_video(video, "ffmpeg", start=start, stop=start + 1)))
+        errors = {i: np.abs(ref[i].astype(np.int16) - first).max()
+                  for i in range(max(start - 1, 0), min(start + 2, len(ref)))}
+        if errors[start] > tolerance or errors[start] > min(errors.values()):
+            sys.exit(f"ffmpeg started frame {start} on another frame: "
+                     f"max differences {errors}")
+    print(f"{shards} shards and a strided read match the full read for both decoders.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare cv2 and ffmpeg decoding.")
+    parser.add_argument("video", help="Path to the video.")
+    parser.add_argument("--frames", type=int, default=100)
+    parser.add_argument("--tolerance", type=int, default=3,
+                        help="Maximum allowed per-pixel difference.")
+    parser.add_argument("--shards", type=int, default=4,
+                        help="Ranges the frames are split into for the "
+                        "shard check.")
+    args = parser.parse_args()
+
+    ref, ref_time = decode(args.video, "cv2", args.frames)
+    luma, luma_time = decode(args.video, "ffmpeg", args.frames)
+
+    if len(ref) != len(luma):
+        sys.exit(f"Frame count mismatch: cv2 {len(ref)}, ffmpeg {len(luma)}")
+
+    diffs = np.array([np.abs(a.astype(np.int16) - b).max() for a, b in zip(ref, luma)])
+    means = np.array([np.abs(a.astype(np.int16) - b).mean() for a, b in zip(ref, luma)])
+
+    print(f"{len(ref)} frames of {ref[0].shape[0]}x{ref[0].shape[1]}")
+    print(f"cv2:    {len(ref) / ref_time:8.1f} frames/s")
+    print(f"ffmpeg: {len(luma) / luma_time:8.1f} frames/s")
+    print(f"max abs difference:  {diffs.max()}")
+    print(f"mean abs difference: {means.mean():.3f}")
+
+    if diffs.max() > args.tolerance:
+        sys.exit(f"Decoders differ by more than {args.tolerance} grey levels.")
+
+    check_shards(args.video, args.shards, ref, luma, args.tolerance)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Pin the vectorized TrackingEvaluator metrics in testing/agent-testing/optimze_tracking.py.
+
+Checks on random trajectories (tracks of every length, frame gaps,
+stationary and moving organisms, rows in shuffled order) that the track
+length, movement and motion metrics match the original per-particle loops,
+kept here as the reference. Counts must be equal; means, medians and
+standard deviations may only differ by floating-point rounding.
+
+Then reports the time to compute all metrics both ways. Exits non-zero on
+any mismatch.
+
+Usage:
+    python evaluator_check.py --tracks 20000 --frames 300
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "testing" / "agent-testing"))
+from optimze_tracking import TrackingEvaluator
+
+
+class ReferenceEvaluator(TrackingEvaluator):
+    """TrackingEvaluator with the original per-particle loops."""
+
+    def _compute_track_lengths(self):
+        track_lengths = self.trajectories.groupby('particle').size()
+
+        self.metrics['track_length_mean'] = track_lengths.mean()
+        self.metrics['track_length_median'] = track_lengths.median()
+        self.metrics['track_length_std'] = track_lengths.std()
+        self.metrics['track_length_max'] = track_lengths.max()
+
+        self.metrics['very_short_tracks'] = (track_lengths < 5).sum()
+        self.metrics['short_tracks'] = ((track_lengths >= 5) & (track_lengths < 20)).sum()
+        self.metrics['medium_tracks'] = ((track_lengths >= 20) & (track_lengths < 40)).sum()
+        self.metrics['long_tracks'] = (track_lengths >= 40).sum()
+
+        moving_long_tracks = 0
+        stationary_long_tracks = 0
+
+        for particle_id in self.trajectories['particle'].unique():
+            track = self.trajectories[self.trajectories['particle'] == particle_id].sort_values('frame')
+            track_length = len(track)
+
+            if track_length >= 40:
+                start_x, start_y = track.iloc[0]['x'], track.iloc[0]['y']
+                end_x, end_y = track.iloc[-1]['x'], track.iloc[-1]['y']
+                total_displacement = np.sqrt((end_x - start_x)**2 + (end_y - start_y)**2)
+
+                if track_length > 1:
+                    dx = track['x'].diff()
+                    dy = track['y'].diff()
+                    displacements = np.sqrt(dx**2 + dy**2)
+                    mean_velocity = displacements.mean()
+                else:
+                    mean_velocity = 0
+
+                if total_displacement > 10 or mean_velocity > 0.5:
+                    moving_long_tracks += 1
+                else:
+                    stationary_long_tracks += 1
+
+        self.metrics['long_tracks_moving'] = moving_long_tracks
+        self.metrics['long_tracks_stationary'] = stationary_long_tracks
+
+        total_tracks = len(track_lengths)
+        self.metrics['long_track_ratio'] = self.metrics['long_tracks'] / total_tracks if total_tracks > 0 else 0
+        self.metrics['moving_long_track_ratio'] = moving_long_tracks / total_tracks if total_tracks > 0 else 0
+        self.metrics['noise_ratio'] = self.metrics['very_short_tracks'] / total_tracks if total_tracks > 0 else 0
+
+    def _compute_motion_metrics(self):
+        motion_scores = []
+        velocity_list = []
+        acceleration_list = []
+
+        for particle_id in self.trajectories['particle'].unique():
+            track = self.trajectories[self.trajectories['particle'] == particle_id].sort_values('frame')
+
+            if len(track) < 3:
+                continue
+
+            dx = track['x'].diff()
+            dy = track['y'].diff()
+            displacements = np.sqrt(dx**2 + dy**2)
+
+            velocities = displacements / track['frame'].diff()
+            velocities = velocities[~np.isnan(velocities)]
+
+            if len(velocities) > 0:
+                velocity_list.extend(velocities.tolist())
+                motion_scores.append(velocities.std())
+                if len(velocities) > 1:
+                    accelerations = np.abs(velocities.diff())
+                    acceleration_list.extend(accelerations[~np.isnan(accelerations)].tolist())
+
+        if motion_scores:
+            self.metrics['motion_smoothness_mean'] = np.mean(motion_scores)
+            self.metrics['motion_smoothness_std'] = np.std(motion_scores)
+        else:
+            self.metrics['motion_smoothness_mean'] = 0
+            self.metrics['motion_smoothness_std'] = 0
+
+        if velocity_list:
+            self.metrics['velocity_mean'] = np.mean(velocity_list)
+            self.metrics['velocity_median'] = np.median(velocity_list)
+            self.metrics['velocity_std'] = np.std(velocity_list)
+            self.metrics['velocity_max'] = np.max(velocity_list)
+            self.metrics['unrealistic_velocities'] = np.sum(np.array(velocity_list) > 50)
+        else:
+            self.metrics['velocity_mean'] = 0
+            self.metrics['velocity_median'] = 0
+            self.metrics['velocity_std'] = 0
+            self.metrics['velocity_max'] = 0
+            self.metrics['unrealistic_velocities'] = 0
+
+        if acceleration_list:
+            self.metrics['acceleration_mean'] = np.mean(acceleration_list)
+        else:
+            self.metrics['acceleration_mean'] = 0
+
+
+def trajectories(tracks, frames, seed=0):
+    """Random linked trajectories in the layout tp.link returns."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for particle in rng.permutation(tracks) * 3:
+        length = int(rng.choice([1, 2, 3, 4, rng.integers(5, 40), rng.integers(40, frames)]))
+        start = int(rng.integers(0, frames - length + 1))
+        # memory: drop some frames from the middle of longer tracks
+        frame = np.arange(start, start + length)
+        if length > 5:
+            frame = np.sort(rng.choice(frame, size=length - length // 6, replace=False))
+        speed = rng.choice([0.0, 0.05, 0.3, 2.0, 8.0, 60.0])
+        steps = rng.normal(0, speed, (len(frame), 2)) + rng.normal(0, 0.2, (len(frame), 2))
+        yx = rng.uniform(0, 1000, 2) + np.cumsum(steps, axis=0)
+        rows.append(pd.DataFrame({'y': yx[:, 0], 'x': yx[:, 1], 'mass': 500.0,
+                                  'frame': frame, 'particle': particle}))
+    df = pd.concat(rows, ignore_index=True)
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def check(trials=5):
+    for seed in range(trials):
+        df = trajectories(300, 120, seed)
+        ref = ReferenceEvaluator(df).compute_all_metrics()
+        out = TrackingEvaluator(df).compute_all_metrics()
+        for key, expected in ref['metrics'].items():
+            value = out['metrics'][key]
+            if isinstance(expected, (int, np.integer)):
+                same = value == expected
+            else:
+                same = np.isclose(value, expected, rtol=1e-12, atol=0, equal_nan=True)
+            if not same:
+                sys.exit(f"{key} differs (seed {seed}): {value!r} != {expected!r}")
+        if out['score'] != ref['score']:
+            sys.exit(f"score differs (seed {seed}): {out['score']} != {ref['score']}")
+    print("Vectorized metrics match the per-particle loops.")
+
+
+def benchmark(tracks, frames):
+    df = trajectories(tracks, frames, seed=1)
+    print(f"{len(df)} rows in {tracks} tracks")
+    for name, evaluator in (('per-particle loops', ReferenceEvaluator),
+                            ('vectorized', TrackingEvaluator)):
+        start = time.perf_counter()
+        evaluator(df).compute_all_metrics()
+        print(f"{name:<20} {time.perf_counter() - start:8.3f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and time TrackingEvaluator.")
+    parser.add_argument("--tracks", type=int, default=5000)
+    parser.add_argument("--frames", type=int, default=300)
+    args = parser.parse_args()
+
+    check()
+    benchmark(args.tracks, args.frames)
+
+
+if __name__ == "__main__":
+    main()
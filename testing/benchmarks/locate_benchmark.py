@@ -0,0 +1,112 @@
+"""
+Compare detection engines in utils/detection.py against tp.locate.
+
+Runs every engine on the same background-subtracted frames and reports
+ms/frame, number of detections and agreement with tp.locate: the fraction
+of trackpy features with an engine feature within half a diameter (recall)
+and vice versa (precision), and the mean distance between matched
+features in pixels (error). Frames are either synthetic Gaussian blobs on
+noise or a real clip, background-subtracted with the chunk engine.
+
+Usage:
+    python locate_benchmark.py --diameter 23 --minmass 550
+    python locate_benchmark.py --video clip.mp4 --frames 50 --diameter 23 --minmass 550
+    python locate_benchmark.py --diameter 95 --minmass 50000 --particles 10 --factor 4
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import trackpy as tp
+from scipy.spatial import cKDTree
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "utils"))
+from background import make_background
+from detection import ENGINES
+from frames import VideoFrames
+from preprocess import subtract_absdiff
+
+
+def synthetic_frames(n, height, width, particles, sigma, brightness=120, noise=3, seed=0):
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:height, :width]
+    for _ in range(n):
+        img = rng.normal(0, noise, (height, width))
+        for y, x in rng.uniform([10, 10], [height - 10, width - 10], (particles, 2)):
+            r2 = (yy - y) ** 2 + (xx - x) ** 2
+            img += brightness * np.exp(-r2 / (2 * sigma ** 2))
+        yield np.clip(img, 0, 255).astype(np.uint8)
+
+
+def video_frames(video, n, chunk):
+    engine = make_background("chunk", chunk)
+    for _, frame, background in engine.apply(VideoFrames(video, stop=n)):
+        yield subtract_absdiff(frame, background, np.empty_like(frame))
+
+
+def agreement(reference, features, radius):
+    if len(reference) == 0 or len(features) == 0:
+        return 0, 0, np.nan
+    ref = cKDTree(reference[["y", "x"]].to_numpy())
+    found = cKDTree(features[["y", "x"]].to_numpy())
+    distance = found.query(ref.data, distance_upper_bound=radius)[0]
+    matched = np.isfinite(distance)
+    recall = np.mean(matched)
+    precision = np.mean(np.isfinite(ref.query(found.data, distance_upper_bound=radius)[0]))
+    error = distance[matched].mean() if matched.any() else np.nan
+    return recall, precision, error
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark detection engines.")
+    parser.add_argument("--video", default=None, help="Real clip (default: synthetic frames).")
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument("--height", type=int, default=918)
+    parser.add_argument("--width", type=int, default=1374)
+    parser.add_argument("--particles", type=int, default=50)
+    parser.add_argument("--diameter", type=int, default=11)
+    parser.add_argument("--minmass", type=float, default=100)
+    parser.add_argument("--cc-minmass", type=float, default=None,
+                        help="minmass for the cc engine (default: --minmass).")
+    parser.add_argument("--factor", type=int, default=4,
+                        help="Downsampling factor for the pyramid engine.")
+    parser.add_argument("--chunk", type=int, default=25)
+    args = parser.parse_args()
+
+    if args.video:
+        frames = list(video_frames(args.video, args.frames, args.chunk))
+    else:
+        frames = list(synthetic_frames(args.frames, args.height, args.width,
+                                       args.particles, args.diameter / 4))
+
+    minmass = {"cc": args.cc_minmass if args.cc_minmass is not None else args.minmass}
+    engines = {name: (locate, {}) for name, locate in ENGINES.items()}
+    engines["pyramid"] = (ENGINES["pyramid"], {"factor": args.factor, "refine": True})
+    engines["pyramid-coarse"] = (ENGINES["pyramid"],
+                                 {"factor": args.factor, "refine": False})
+    results = {}
+    for name, (locate, kwargs) in engines.items():
+        start = time.perf_counter()
+        features = [locate(f, diameter=args.diameter,
+                           minmass=minmass.get(name, args.minmass), **kwargs)
+                    for f in frames]
+        elapsed = time.perf_counter() - start
+        results[name] = (features, elapsed / len(frames) * 1000)
+
+    reference = results["trackpy"][0]
+    print(f"{len(frames)} frames of {frames[0].shape[0]}x{frames[0].shape[1]}")
+    print(f"{'engine':<15} {'ms/frame':>10} {'features':>10} {'recall':>8} "
+          f"{'precision':>10} {'error':>8}")
+    for name, (features, ms) in results.items():
+        scores = [agreement(r, f, args.diameter / 2) for r, f in zip(reference, features)]
+        recall, precision, error = np.nanmean(scores, axis=0)
+        total = sum(len(f) for f in features)
+        print(f"{name:<15} {ms:>10.2f} {total:>10} {recall:>8.3f} "
+              f"{precision:>10.3f} {error:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""
+End-to-end throughput of the tracking pipeline on a synthetic video.
+
+Synthesizes a video with synthetic.py, then runs the pipeline scripts the
+way the Snakefile does: tracking.py, link_trajectories.py on the
+experiment directory, and split_wells.py on the linked tracks with a 2x2
+well grid. Each script is timed end to end, and tracking.py's per-stage
+metrics (decode, background, subtract, locate, write, merge) are included.
+
+Every result is appended to a JSON-lines report with the git commit, so
+runs on different commits can be compared; --compare prints the change
+against an earlier report for the same configuration. The report is
+written in --output, where the video and outputs are kept, or next to
+this script if the run is in a temporary directory. Unrecognized options
+go to tracking.py; its --format also picks the store that is moved and
+linked.
+
+Usage:
+    python pipeline_benchmark.py --preset miracidia --frames 300 --particles 20
+    python pipeline_benchmark.py --preset planaria --report bench.jsonl --compare old.jsonl
+    python pipeline_benchmark.py --output runs/parquet --format parquet
+"""
+
+import argparse
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import yaml
+
+from synthetic import MOTIONS, PRESETS, synthesize
+
+REPO = Path(__file__).resolve().parents[2]
+UTILS = REPO / "utils"
+sys.path.insert(0, str(UTILS))
+from writers import WRITERS
+
+
+def run(script, *args):
+    """Run a pipeline script and return its wall time in seconds."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, str(UTILS / script), *map(str, args)],
+                   check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO,
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(workdir, config, track_args=(), format="hdf5"):
+    """Run the pipeline on a synthetic video in workdir; return one record
+    per script and per tracking stage. format is tracking.py's --format
+    (see writers.WRITERS)."""
+    name = f"{config['profile']}_benchmark"
+    experiment = Path(workdir, name)
+    experiment.mkdir(parents=True)
+    video = experiment / f"{name}.mp4"
+    synthesize(video, config["frames"], config["particles"], config["height"],
+               config["width"], config["size"], config["motion"],
+               config["brightness"], config["level"], seed=config["seed"])
+    frames = config["frames"]
+
+    records = []
+    output = experiment / name
+    wall = run("tracking.py", video, output, "--profile", config["profile"],
+               "--processes", config["processes"], *track_args)
+    records.append({"stage": "tracking.py", "wall_s": wall})
+    for line in open(output / f"{name}.metrics.jsonl"):
+        stage = json.loads(line)
+        if stage["stage"] != "children":
+            records.append({"stage": f"tracking.py:{stage['stage']}",
+                            "wall_s": stage["wall_s"],
+                            "peak_rss_mb": stage["peak_rss_mb"]})
+    shutil.move(str(output / f"{name}{WRITERS[format].suffix}"), str(experiment))
+
+    wall = run("link_trajectories.py", experiment, f"--{format}",
+               "--profile", config["profile"])
+    records.append({"stage": "link_trajectories.py", "wall_s": wall})
+
+    wells = experiment / "wells.yml"
+    with open(wells, "w") as f:
+        yaml.safe_dump({
+            "input_path": str(experiment / f"{name}_tracks.feather"),
+            "output_path": str(experiment / f"{name}_wells.csv"),
+            "outer_bounds": [0, config["width"], 0, config["height"]],
+            "v_lines": [config["width"] / 2],
+            "h_lines": [config["height"] / 2],
+            "visualize": False,
+        }, f)
+    wall = run("split_wells.py", wells)
+    records.append({"stage": "split_wells.py", "wall_s": wall})
+
+    for record in records:
+        record["wall_s"] = round(record["wall_s"], 3)
+        record["fps"] = round(frames / record["wall_s"], 2) if record["wall_s"] else None
+    return records
+
+
+def load_report(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare(records, previous):
+    """Print each stage's wall time against the latest earlier record of the
+    same configuration and stage."""
+    config = records[0]["config"]
+    before = {r["stage"]: r for r in previous if r["config"] == config}
+    print(f"{'stage':<32} {'before (s)':>11} {'now (s)':>9} {'change':>8}")
+    for record in records:
+        old = before.get(record["stage"])
+        if old is None or not old["wall_s"]:
+            continue
+        change = record["wall_s"] / old["wall_s"] - 1
+        print(f"{record['stage']:<32} {old['wall_s']:>11.3f} "
+              f"{record['wall_s']:>9.3f} {change:>+8.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline end to end.")
+    parser.add_argument("--preset", choices=list(PRESETS), default="miracidia",
+                        help="Organism preset and tracking profile.")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--particles", type=int, default=20)
+    parser.add_argument("--height", type=int, default=918)
+    parser.add_argument("--width", type=int, default=1374)
+    parser.add_argument("--size", type=int, default=None,
+                        help="Organism diameter (default: the preset's).")
+    parser.add_argument("--motion", choices=list(MOTIONS), default=None,
+                        help="Motion model (default: the preset's).")
+    parser.add_argument("--processes", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", default="pipeline_benchmark.jsonl",
+                        help="JSON-lines report to append to, relative to "
+                        "--output (default: next to this script).")
+    parser.add_argument("--compare", default=None,
+                        help="Earlier report to compare against.")
+    parser.add_argument("--output", "--keep", dest="output", default=None,
+                        help="Keep the video, outputs and report in this "
+                        "directory.")
+    args, track_args = parser.parse_known_args()
+
+    # tracking.py's --format decides which store is moved and linked
+    formats = argparse.ArgumentParser(add_help=False)
+    formats.add_argument("--format", default="hdf5")
+    format = formats.parse_known_args(track_args)[0].format
+    if format not in WRITERS:
+        parser.error(f"--format must be one of: {', '.join(WRITERS)}")
+    report = Path(args.output or Path(__file__).resolve().parent, args.report)
+
+    preset = PRESETS[args.preset]
+    config = {
+        "profile": args.preset,
+        "frames": args.frames,
+        "particles": args.particles,
+        "height": args.height,
+        "width": args.width,
+        "size": args.size or preset["size"],
+        "motion": args.motion or preset["motion"],
+        "brightness": preset["brightness"],
+        "level": preset["level"],
+        "processes": args.processes,
+        "seed": args.seed,
+        "tracking": track_args,
+    }
+
+    if args.output:
+        records = benchmark(args.output, config, track_args, format)
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            records = benchmark(workdir, config, track_args, format)
+
+    run_info = {"commit": commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "config": config}
+    records = [{**run_info, **record} for record in records]
+    with open(report, "a") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+    print(f"{args.frames} frames of {args.width}x{args.height}, "
+          f"{args.particles} {config['motion']}s of {config['size']} px")
+    print(f"{'stage':<32} {'wall (s)':>9} {'frames/s':>9}")
+    for record in records:
+        fps = f"{record['fps']:.1f}" if record["fps"] else "-"
+        print(f"{record['stage']:<32} {record['wall_s']:>9.3f} {fps:>9}")
+    print(f"Appended {len(records)} records to {report}")
+    if args.compare:
+        compare(records, load_report(args.compare))
+
+
+if __name__ == "__main__":
+    main()
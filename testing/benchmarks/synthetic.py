@@ -0,0 +1,184 @@
+"""
+Synthetic InVision-like videos with known ground truth.
+
+Gaussian organisms move over a noisy, slightly uneven background and are
+written to an mp4 with cv2. Like the real videos, miracidia are dark on a
+bright field (tracking.py finds them after max-projection background
+subtraction) and planaria are bright on a dark one (located on the raw
+frames). The true centre of every
+organism in every frame is returned (and can be saved as CSV), so tracking
+and linking can be scored without a lab video.
+
+Motion models (see MOTIONS):
+    swimmer   fast, near-straight runs with gradual turns (miracidia)
+    crawler   slow, smooth gliding (planaria)
+    brownian  random steps with no persistence
+
+Usage:
+    python synthetic.py clip.mp4 --frames 300 --particles 20 --motion swimmer
+"""
+
+import argparse
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pandas as pd
+
+# speed in pixels/frame and the std of the heading change per frame (rad)
+MOTIONS = {
+    "swimmer": {"speed": 6.0, "turn": 0.15},
+    "crawler": {"speed": 0.8, "turn": 0.03},
+    "brownian": {"speed": 2.0, "turn": np.pi},
+}
+
+# settings that resemble each organism in tracking.py's profiles;
+# brightness is the organism's contrast against a background of level
+PRESETS = {
+    "miracidia": {"motion": "swimmer", "size": 23, "level": 180,
+                  "brightness": -90},
+    "planaria": {"motion": "crawler", "size": 83, "level": 30,
+                 "brightness": 120},
+}
+
+
+def trajectories(frames, particles, height, width, motion="swimmer",
+                 margin=10, seed=0):
+    """True positions, as a (frames, particles, 2) array of (y, x).
+
+    Organisms reflect off a band of margin pixels at the frame edges.
+    """
+    rng = np.random.default_rng(seed)
+    speed, turn = MOTIONS[motion]["speed"], MOTIONS[motion]["turn"]
+    low = np.array([margin, margin], float)
+    high = np.array([height - 1 - margin, width - 1 - margin], float)
+    pos = rng.uniform(low, high, (particles, 2))
+    heading = rng.uniform(0, 2 * np.pi, particles)
+    speeds = speed * rng.uniform(0.7, 1.3, particles)
+
+    out = np.empty((frames, particles, 2))
+    for t in range(frames):
+        out[t] = pos
+        heading += rng.normal(0, turn, particles)
+        step = np.column_stack([np.sin(heading), np.cos(heading)])
+        pos = pos + speeds[:, None] * step
+        # reflect off the walls
+        for axis in range(2):
+            below = pos[:, axis] < low[axis]
+            above = pos[:, axis] > high[axis]
+            pos[below, axis] = 2 * low[axis] - pos[below, axis]
+            pos[above, axis] = 2 * high[axis] - pos[above, axis]
+            if axis == 0:
+                heading[below | above] = np.pi - heading[below | above]
+            else:
+                heading[below | above] = -heading[below | above]
+    return out
+
+
+def render(positions, height, width, size, brightness=90, noise=3,
+           level=30, seed=0):
+    """Yield uint8 greyscale frames with a Gaussian blob at each position.
+
+    size is the organism diameter in pixels (about 4 sigma); a negative
+    brightness draws organisms darker than the background.
+    """
+    rng = np.random.default_rng(seed + 1)
+    sigma = size / 4
+    half = int(np.ceil(3 * sigma))
+    yy, xx = np.mgrid[:height, :width]
+    # a gentle vignette, so backgrounds are not perfectly flat
+    base = level * (1 - 0.2 * (((yy - height / 2) / height) ** 2
+                               + ((xx - width / 2) / width) ** 2))
+    frame = np.empty((height, width), np.float32)
+    for points in positions:
+        frame[:] = base
+        frame += rng.normal(0, noise, (height, width)).astype(np.float32)
+        for y, x in points:
+            y0, y1 = max(int(y) - half, 0), min(int(y) + half + 1, height)
+            x0, x1 = max(int(x) - half, 0), min(int(x) + half + 1, width)
+            dy = (np.arange(y0, y1) - y) ** 2
+            dx = (np.arange(x0, x1) - x) ** 2
+            frame[y0:y1, x0:x1] += brightness * np.exp(
+                -(dy[:, None] + dx[None, :]) / (2 * sigma ** 2))
+        yield np.clip(frame, 0, 255).astype(np.uint8)
+
+
+def write_video(path, frames, fps=10):
+    """Write greyscale frames to path (mp4v), returning the frame count."""
+    writer = None
+    n = 0
+    for frame in frames:
+        if writer is None:
+            size = (frame.shape[1], frame.shape[0])
+            writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"),
+                                     fps, size)
+            if not writer.isOpened():
+                raise IOError(f"Cannot write video file: {path}")
+        writer.write(cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR))
+        n += 1
+    if writer is not None:
+        writer.release()
+    return n
+
+
+def truth_table(positions):
+    """Ground truth as a DataFrame with frame, particle, y and x."""
+    frames, particles, _ = positions.shape
+    return pd.DataFrame({
+        "frame": np.repeat(np.arange(frames), particles),
+        "particle": np.tile(np.arange(particles), frames),
+        "y": positions[:, :, 0].ravel(),
+        "x": positions[:, :, 1].ravel(),
+    })
+
+
+def synthesize(path, frames=300, particles=20, height=918, width=1374,
+               size=23, motion="swimmer", brightness=-90, level=180, noise=3,
+               fps=10, seed=0):
+    """Write a synthetic video to path and its ground truth next to it
+    (<stem>_truth.csv). Returns the ground truth DataFrame."""
+    path = Path(path)
+    positions = trajectories(frames, particles, height, width, motion,
+                             margin=size, seed=seed)
+    write_video(path, render(positions, height, width, size, brightness,
+                             noise, level, seed), fps)
+    truth = truth_table(positions)
+    truth.to_csv(path.with_name(path.stem + "_truth.csv"), index=False)
+    return truth
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic video.")
+    parser.add_argument("video", help="Output .mp4")
+    parser.add_argument("--preset", choices=list(PRESETS), default=None,
+                        help="Organism preset; sets --motion, --size, "
+                        "--brightness and --level unless they are given.")
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument("--particles", type=int, default=20)
+    parser.add_argument("--height", type=int, default=918)
+    parser.add_argument("--width", type=int, default=1374)
+    parser.add_argument("--size", type=int, default=None,
+                        help="Organism diameter in pixels.")
+    parser.add_argument("--motion", choices=list(MOTIONS), default=None)
+    parser.add_argument("--brightness", type=float, default=None,
+                        help="Organism contrast; negative = dark organisms.")
+    parser.add_argument("--level", type=float, default=None,
+                        help="Background grey level.")
+    parser.add_argument("--noise", type=float, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    preset = dict(PRESETS.get(args.preset, PRESETS["miracidia"]))
+    for key in ("motion", "size", "brightness", "level"):
+        if getattr(args, key) is not None:
+            preset[key] = getattr(args, key)
+    truth = synthesize(args.video, args.frames, args.particles, args.height,
+                       args.width, preset["size"], preset["motion"],
+                       preset["brightness"], preset["level"], args.noise,
+                       seed=args.seed)
+    print(f"Wrote {args.frames} frames with {args.particles} organisms to "
+          f"{args.video} ({len(truth)} ground-truth positions).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Compare the detection writers in utils/writers.py.
+
+Writes the same synthetic feature tables (trackpy columns, a few hundred
+features per frame) through every writer, one put() per frame as
+tracking.py does, then reads them back with read_features. Reports write
+and read throughput in frames/s and rows/s and the size on disk, and
+checks that every format reads back the same features.
+
+Usage:
+    python writer_benchmark.py --frames 2000 --features 200
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "utils"))
+from writers import WRITERS, open_writer, read_features
+
+
+def synthetic_features(frames, features, seed=0):
+    rng = np.random.default_rng(seed)
+    for frame in range(frames):
+        n = rng.poisson(features)
+        yield pd.DataFrame({
+            "y": rng.uniform(0, 1836, n),
+            "x": rng.uniform(0, 2748, n),
+            "mass": rng.gamma(2, 300, n),
+            "size": rng.uniform(2, 6, n),
+            "ecc": rng.uniform(0, 1, n),
+            "signal": rng.uniform(10, 200, n),
+            "raw_mass": rng.gamma(2, 3000, n),
+            "ep": rng.uniform(0, 0.5, n),
+            "frame": frame,
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark detection writers.")
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--features", type=int, default=200,
+                        help="Mean features per frame.")
+    args = parser.parse_args()
+
+    tables = list(synthetic_features(args.frames, args.features))
+    rows = sum(len(t) for t in tables)
+    print(f"{args.frames} frames, {rows} rows")
+    print(f"{'format':<10} {'write fps':>10} {'write rows/s':>13} "
+          f"{'read rows/s':>12} {'MB':>8}")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in WRITERS:
+            start = time.perf_counter()
+            with open_writer(tmp, name, name) as writer:
+                for table in tables:
+                    writer.put(table.copy())
+            written = time.perf_counter() - start
+            path = writer.path
+
+            start = time.perf_counter()
+            features = read_features(path)
+            read = time.perf_counter() - start
+
+            results[name] = features
+            mb = path.stat().st_size / 1e6
+            print(f"{name:<10} {args.frames / written:>10.0f} {rows / written:>13.0f} "
+                  f"{rows / read:>12.0f} {mb:>8.2f}")
+
+    reference = results["hdf5"].sort_values(["frame", "y", "x"], ignore_index=True)
+    for name, features in results.items():
+        features = features.sort_values(["frame", "y", "x"], ignore_index=True)
+        pd.testing.assert_frame_equal(reference, features[reference.columns],
+                                      check_dtype=False, rtol=1e-6)
+    print("All formats read back the same features.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import numpy as np
+
+########################################################################
+####                                                                ####
+####                      background estimation                     ####
+####                                                                ####
+########################################################################
+
+# Every engine consumes a stream of greyscale frames and yields
+# (frame_no, frame, background) for each input frame, in order. The frame
+# and background arrays are views into buffers owned by the engine and are
+# only valid until the next item is requested; copy them if they need to
+# outlive the iteration.
+
+
+class ChunkBackground:
+    """Max (or median) projection over consecutive, non-overlapping chunks
+    of frames.
+
+    This is the original "blocky" background used by tracking.py: every frame
+    in [k * window, (k + 1) * window) shares the max projection of that chunk.
+    Chunk boundaries are aligned to multiples of window in the global frame
+    numbering, so a stream that starts at offset produces the same
+    backgrounds as the full video. With statistic="median" each chunk gets
+    its per-pixel median instead, truncated to uint8 (the optimizer's
+    original median background).
+    """
+
+    def __init__(self, window=25, statistic="max"):
+        if statistic not in ("max", "median"):
+            raise ValueError(
+                f"Unknown chunk statistic '{statistic}'. Choose from: max, median"
+            )
+        self.window = window
+        self.statistic = statistic
+
+    def padded(self, start, stop, length):
+        """Frames to read so [start, stop) gets the same backgrounds as the
+        full video of length frames: the enclosing whole chunks."""
+        w = self.window
+        return start - start % w, min(-(-stop // w) * w, length)
+
+    def apply(self, frames, offset=0):
+        buffer = None
+        background = None
+        n = 0
+        start = offset
+        for frame in frames:
+            if buffer is None:
+                buffer = np.empty((self.window,) + frame.shape, np.uint8)
+                background = np.empty(frame.shape, np.uint8)
+            buffer[n] = frame
+            n += 1
+            if (start + n) % self.window == 0:
+                yield from self._flush(buffer[:n], background, start,
+                                       self.statistic)
+                start += n
+                n = 0
+        if n > 0:
+            yield from self._flush(buffer[:n], background, start, self.statistic)
+
+    @staticmethod
+    def _flush(chunk, background, start, statistic="max"):
+        if statistic == "median":
+            background[:] = np.median(chunk, axis=0).astype(np.uint8)
+        else:
+            np.amax(chunk, axis=0, out=background)
+        for j in range(len(chunk)):
+            yield start + j, chunk[j], background
+
+
+class SlidingBackground:
+    """Base class for backgrounds computed over a centred sliding window.
+
+    The background for frame t is computed from frames [s, s + window), where
+    s = t - window // 2, clamped so the window stays inside the stream. Only
+    the last window frames are kept in memory.
+    """
+
+    def __init__(self, window=25):
+        self.window = window
+
+    def padded(self, start, stop, length):
+        """Frames to read so [start, stop) gets the same backgrounds as the
+        full video of length frames: half a window either side, and a
+        whole window at either end of the video, where windows are clamped."""
+        w = self.window
+        return (max(min(start - w // 2, length - w), 0),
+                min(max(stop + w - 1 - w // 2, w), length))
+
+    def apply(self, frames, offset=0):
+        w = self.window
+        lookahead = w - 1 - w // 2
+        pending = 0
+        e = -1
+        for e, frame in enumerate(frames):
+            if e == 0:
+                self._ring = np.empty((w,) + frame.shape, np.uint8)
+                self._background = np.empty(frame.shape, np.uint8)
+                self._start(frame)
+            self._push(e, frame)
+            self._ring[e % w] = frame
+            # frames whose window ends at e can be emitted now
+            while max(w - 1, pending + lookahead) <= e:
+                s = max(0, pending - w // 2)
+                self._compute(s, e, self._background)
+                yield offset + pending, self._ring[pending % w], self._background
+                pending += 1
+
+        # the stream ended: the remaining frames share the last full window
+        n = e + 1
+        s = max(0, n - w)
+        if pending < n:
+            self._compute(s, n - 1, self._background)
+        while pending < n:
+            yield offset + pending, self._ring[pending % w], self._background
+            pending += 1
+
+    def _start(self, frame):
+        pass
+
+    def _push(self, e, frame):
+        pass
+
+    def _compute(self, s, e, out):
+        raise NotImplementedError
+
+
+class SlidingMaxBackground(SlidingBackground):
+    """Sliding-window max with O(1) amortized work per frame and pixel.
+
+    Uses the van Herk/Gil-Werman decomposition: the stream is split into
+    blocks of window frames, and the max over any window [s, s + window) is
+    the max of the suffix max of s within its block and the prefix max of the
+    window's last frame within the next block. Suffix maxima are computed
+    once per completed block and the prefix max is a running maximum, so each
+    frame costs a constant number of np.maximum calls regardless of window.
+    """
+
+    def _start(self, frame):
+        self._suffix = np.empty_like(self._ring)
+        self._prefix = np.empty(frame.shape, np.uint8)
+
+    def _push(self, e, frame):
+        w = self.window
+        if e % w == 0:
+            if e > 0:
+                # the ring holds exactly the block that just finished
+                self._suffix[w - 1] = self._ring[w - 1]
+                for j in range(w - 2, -1, -1):
+                    np.maximum(self._ring[j], self._suffix[j + 1],
+                               out=self._suffix[j])
+            self._prefix[:] = frame
+        else:
+            np.maximum(self._prefix, frame, out=self._prefix)
+
+    def _compute(self, s, e, out):
+        if s % self.window == 0:
+            out[:] = self._prefix
+        else:
+            np.maximum(self._suffix[s % self.window], self._prefix, out=out)
+
+
+class SlidingPercentileBackground(SlidingBackground):
+    """Sliding-window percentile (median by default) background.
+
+    Percentiles have no constant-time sliding update, so each background is a
+    partial sort of the window, O(window) per pixel.
+    """
+
+    def __init__(self, window=25, percentile=50):
+        super().__init__(window)
+        self.percentile = percentile
+
+    def _compute(self, s, e, out):
+        n = e - s + 1
+        if n == self.window:
+            stack = self._ring
+        else:
+            stack = self._ring[:n]
+        out[:] = np.percentile(stack, self.percentile, axis=0,
+                               method="nearest")
+
+
+BACKGROUNDS = {
+    "chunk": ChunkBackground,
+    "chunk-median": ChunkBackground,
+    "max": SlidingMaxBackground,
+    "median": SlidingPercentileBackground,
+    "percentile": SlidingPercentileBackground,
+}
+
+
+def make_background(mode="chunk", window=25, percentile=50):
+    """Return a background engine by name (see BACKGROUNDS)."""
+    if mode not in BACKGROUNDS:
+        raise ValueError(
+            f"Unknown background mode '{mode}'. "
+            f"Choose from: {', '.join(BACKGROUNDS)}"
+        )
+    if mode == "percentile":
+        return SlidingPercentileBackground(window, percentile)
+    if mode == "chunk-median":
+        return ChunkBackground(window, "median")
+    return BACKGROUNDS[mode](window)
@@ -11,6 +11,9 @@ from skimage import exposure
 import os
 from tqdm import tqdm
 
+import metrics
+from frames import prefetch
+
 
 def cat_stores(left, right, output, length, skip, annotate, resize, rescale):
 
@@ -40,64 +43,72 @@ def cat_stores(left, right, output, length, skip, annotate, resize, rescale):
             chunksize=1000,
         )
 
-        for i in range(0, length, skip):
-            left_frame, (frame_number, frame_timestamp) = left.get_image(
-                frame_number=None, frame_index=i
-            )
-            right_frame, (frame_number, frame_timestamp) = right.get_image(
-                frame_number=None, frame_index=i
-            )
-            if rescale:
-                rescaled_left = exposure.rescale_intensity(
-                    left_frame, (0, np.amax(right_frame))
-                )
-                merged_array = np.uint16(np.hstack((rescaled_left, right_frame)))
-            else:
-                merged_array = np.uint16(np.hstack((left_frame, right_frame)))
-
-            if resize and annotate:
-                res = cv2.resize(
-                    merged_array, dsize=(800, 267), interpolation=cv2.INTER_LINEAR
-                )
-                hours, remainder = divmod(i, 3600)
-                minutes, seconds = divmod(remainder, 60)
-                time_str = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-                cv2.putText(
-                    res,
-                    f"t = {time_str}",
-                    (25, 200),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    1,
-                    (0, 0, 0),
-                    2,
-                    1,
-                )
-            elif resize and not annotate:
-                res = cv2.resize(
-                    merged_array, dsize=(800, 267), interpolation=cv2.INTER_LINEAR
-                )
-            elif annotate and not resize:
-                res = merged_array
-                hours, remainder = divmod(i, 3600)
-                minutes, seconds = divmod(remainder, 60)
-                time_str = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-                cv2.putText(
-                    merged_array,
-                    f"t = {time_str}",
-                    (25, 200),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    1,
-                    (0, 0, 0),
-                    2,
-                    1,
-                )
-            else:
-                res = merged_array
-
-            merged_store.add_image(res, i, time.time())
+        def read_pairs():
+            for i in range(0, length, skip):
+                left_frame, _ = left.get_image(frame_number=None, frame_index=i)
+                right_frame, _ = right.get_image(frame_number=None, frame_index=i)
+                yield i, left_frame, right_frame
+
+        # read the next pair of frames while the current one is merged/written
+        pairs = metrics.timed("decode", prefetch(read_pairs()))
+        for i, left_frame, right_frame in pairs:
+            with metrics.stage("merge"):
+                if rescale:
+                    rescaled_left = exposure.rescale_intensity(
+                        left_frame, (0, np.amax(right_frame))
+                    )
+                    merged_array = np.uint16(np.hstack((rescaled_left, right_frame)))
+                else:
+                    merged_array = np.uint16(np.hstack((left_frame, right_frame)))
+
+                if resize and annotate:
+                    res = cv2.resize(
+                        merged_array, dsize=(800, 267), interpolation=cv2.INTER_LINEAR
+                    )
+                    hours, remainder = divmod(i, 3600)
+                    minutes, seconds = divmod(remainder, 60)
+                    time_str = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+                    cv2.putText(
+                        res,
+                        f"t = {time_str}",
+                        (25, 200),
+                        cv2.FONT_HERSHEY_SIMPLEX,
+                        1,
+                        (0, 0, 0),
+                        2,
+                        1,
+                    )
+                elif resize and not annotate:
+                    res = cv2.resize(
+                        merged_array, dsize=(800, 267), interpolation=cv2.INTER_LINEAR
+                    )
+                elif annotate and not resize:
+                    res = merged_array
+                    hours, remainder = divmod(i, 3600)
+                    minutes, seconds = divmod(remainder, 60)
+                    time_str = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+                    cv2.putText(
+                        merged_array,
+                        f"t = {time_str}",
+                        (25, 200),
+                        cv2.FONT_HERSHEY_SIMPLEX,
+                        1,
+                        (0, 0, 0),
+                        2,
+                        1,
+                    )
+                else:
+                    res = merged_array
+            metrics.count("merge")
+
+            with metrics.stage("write"):
+                merged_store.add_image(res, i, time.time())
 
             pbar.update(1)
 
+    metrics.write(Path(output).with_name(Path(output).name + ".metrics.jsonl"),
+                  length=length, skip=skip)
+
 
 if __name__ == "__main__":
 
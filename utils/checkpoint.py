@@ -0,0 +1,117 @@
+import json
+import os
+import shutil
+from pathlib import Path
+
+from writers import WRITERS, copy_features
+
+########################################################################
+####                                                                ####
+####                        checkpoint / resume                     ####
+####                                                                ####
+########################################################################
+
+# Detections are committed in segments of consecutive frames. Each segment
+# is written to a temporary file, renamed into place once it is complete and
+# then recorded in manifest.json, so after a kill the manifest only lists
+# segments that are whole on disk. A rerun with the same settings resumes
+# after the last committed segment; when every frame is done, the segments
+# are copied frame by frame into the final output and removed.
+
+
+class Checkpoint:
+    """Segment store for a resumable tracking run.
+
+    Call resume() first to find where to start, then use as a context
+    manager around locate_stream: it takes put() like any writer, and
+    starts a new segment whenever a frame crosses a multiple of segment.
+    commit(stop) closes the current segment at frame stop; a
+    segment that is still open when an exception leaves the context is
+    dropped.
+
+    Args:
+        directory: Where segments and the manifest are kept.
+        settings: JSON-serializable description of the run. A manifest
+            written with different settings is discarded.
+        format: Writer used for the segments (see WRITERS).
+        segment: Frames per segment.
+        start: First frame of the run.
+    """
+
+    def __init__(self, directory, settings, format="hdf5", segment=1000,
+                 start=0):
+        self.directory = Path(directory)
+        self.settings = settings
+        self.format = format
+        self.segment = segment
+        self.start = start
+        self.manifest = self.directory / "manifest.json"
+        self.segments = []
+
+    def resume(self):
+        """Load the manifest and return the first frame still to process."""
+        if self.manifest.exists():
+            with open(self.manifest) as f:
+                manifest = json.load(f)
+            if manifest["settings"] == self.settings:
+                self.segments = manifest["segments"]
+            else:
+                print("Settings changed since the last run; starting over.")
+                shutil.rmtree(self.directory)
+        os.makedirs(self.directory, exist_ok=True)
+        for stale in self.directory.glob("*.tmp"):
+            os.remove(stale)
+        return self.segments[-1]["stop"] if self.segments else self.start
+
+    def __enter__(self):
+        self._start = self.segments[-1]["stop"] if self.segments else self.start
+        self._writer = None
+        return self
+
+    def __exit__(self, *exc):
+        if self._writer is not None:
+            # an unfinished segment: throw it away, it is redone on resume
+            self._writer.__exit__(*exc)
+            os.remove(self._writer.path)
+            self._writer = None
+
+    def put(self, features):
+        frame = int(features["frame"].iloc[0])
+        if frame >= self._start + self.segment:
+            self.commit(frame - frame % self.segment)
+        if self._writer is None:
+            writer = WRITERS[self.format]
+            path = self.directory / f"{self._start:09d}{writer.suffix}.tmp"
+            self._writer = writer(path).__enter__()
+            self._rows = 0
+        self._writer.put(features)
+        self._rows += len(features)
+
+    def commit(self, stop):
+        """Record frames [start, stop) as done, with whatever was put."""
+        entry = {"start": self._start, "stop": stop, "file": None, "rows": 0}
+        if self._writer is not None:
+            self._writer.__exit__(None, None, None)
+            done = self._writer.path.with_suffix("")
+            os.replace(self._writer.path, done)
+            entry.update(file=done.name, rows=self._rows)
+            self._writer = None
+        self.segments.append(entry)
+        tmp = self.manifest.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump({"settings": self.settings, "segments": self.segments},
+                      f, indent=1)
+        os.replace(tmp, self.manifest)
+        self._start = stop
+
+    def finalize(self, path):
+        """Copy every segment, in frame order, into the output at path and
+        clean up. The output only appears under its name once complete."""
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp")
+        with WRITERS[self.format](tmp) as s:
+            for entry in self.segments:
+                if entry["file"] is not None:
+                    copy_features(self.directory / entry["file"], s)
+        os.replace(tmp, path)
+        shutil.rmtree(self.directory)
@@ -0,0 +1,293 @@
+import cv2
+import numpy as np
+import pandas as pd
+import trackpy as tp
+
+########################################################################
+####                                                                ####
+####                        detection engines                       ####
+####                                                                ####
+########################################################################
+
+# Every engine takes a background-subtracted uint8 frame plus trackpy-style
+# keyword arguments and returns a DataFrame with trackpy's locate columns,
+# so linking works unchanged whichever engine produced the features.
+
+COLUMNS = ["y", "x", "mass", "size", "ecc", "signal", "raw_mass", "ep"]
+
+
+def locate_cc(image, diameter, minmass=0, maxsize=None, threshold=None,
+              topn=None, min_area=1, **kwargs):
+    """Locate bright blobs by thresholding and connected-component labeling.
+
+    Much cheaper than tp.locate for small, high-contrast organisms on a
+    background-subtracted frame: there is no bandpass filter and no iterative
+    refinement. All features are measured in one vectorized pass over the
+    foreground pixels.
+
+    Args:
+        image: Background-subtracted uint8 frame.
+        diameter: Unused for detection; accepted for API compatibility.
+        minmass: Minimum summed intensity of a component. Note that this is
+            the raw intensity above threshold, not trackpy's bandpassed mass,
+            so it needs its own calibration.
+        maxsize: Maximum radius of gyration.
+        threshold: Foreground threshold. None = mean + 4 std of the frame.
+        topn: Keep only the topn components by mass.
+        min_area: Minimum component area in pixels.
+        **kwargs: Other tp.locate arguments, ignored.
+
+    Returns:
+        DataFrame with columns y, x, mass, size, ecc, signal, raw_mass, ep.
+        mass and raw_mass are the same; ep is NaN.
+    """
+    if threshold is None:
+        mean, std = cv2.meanStdDev(image)
+        threshold = float(mean[0, 0] + 4 * std[0, 0])
+    _, binary = cv2.threshold(image, threshold, 255, cv2.THRESH_BINARY)
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(
+        binary, connectivity=8, ltype=cv2.CV_32S
+    )
+    if n <= 1:
+        return pd.DataFrame(columns=COLUMNS, dtype=np.float64)
+
+    # intensity-weighted moments of every component in a single pass
+    idx = np.flatnonzero(labels)
+    label = labels.ravel()[idx]
+    weight = image.ravel()[idx].astype(np.float64)
+    y, x = np.divmod(idx, image.shape[1])
+
+    mass = np.bincount(label, weight, minlength=n)[1:]
+    cx = np.bincount(label, weight * x, minlength=n)[1:] / mass
+    cy = np.bincount(label, weight * y, minlength=n)[1:] / mass
+    dx = x - cx[label - 1]
+    dy = y - cy[label - 1]
+    mxx = np.bincount(label, weight * dx * dx, minlength=n)[1:] / mass
+    myy = np.bincount(label, weight * dy * dy, minlength=n)[1:] / mass
+    mxy = np.bincount(label, weight * dx * dy, minlength=n)[1:] / mass
+
+    signal = np.zeros(n, np.float64)
+    np.maximum.at(signal, label, weight)
+
+    size = np.sqrt(mxx + myy)
+    ecc = np.sqrt((mxx - myy) ** 2 + 4 * mxy ** 2) / (mxx + myy + 1e-6)
+
+    features = pd.DataFrame({
+        "y": cy,
+        "x": cx,
+        "mass": mass,
+        "size": size,
+        "ecc": ecc,
+        "signal": signal[1:],
+        "raw_mass": mass,
+        "ep": np.nan,
+    })
+
+    keep = (features["mass"] >= minmass) & (stats[1:, cv2.CC_STAT_AREA] >= min_area)
+    if maxsize is not None:
+        keep &= features["size"] <= maxsize
+    features = features[keep]
+    if topn is not None and len(features) > topn:
+        features = features.nlargest(topn, "mass")
+    return features.reset_index(drop=True)
+
+
+def tile_max(image, tile):
+    """Max of every tile x tile block of image (edge tiles may be smaller)."""
+    rows = np.arange(0, image.shape[0], tile)
+    cols = np.arange(0, image.shape[1], tile)
+    return np.maximum.reduceat(np.maximum.reduceat(image, rows, axis=0),
+                               cols, axis=1)
+
+
+# noise standard deviations above the median that a tile must reach
+GATE_SIGMAS = 10
+
+
+def noise_gate(image, sigmas=GATE_SIGMAS):
+    """A level that background noise in image stays under.
+
+    The noise is estimated robustly from a subsample of the frame, as the
+    median plus sigmas standard deviations taken from the median absolute
+    deviation (1.4826 MAD). Organism pixels shift neither until they cover
+    half the frame, unlike a high percentile, which lands on organisms once
+    they cover more than 100 - percentile % of it.
+    """
+    sample = image[::4, ::4].astype(np.float32)
+    median = float(np.median(sample))
+    mad = float(np.median(np.abs(sample - median)))
+    return median + sigmas * 1.4826 * mad + 1
+
+
+def locate_tiles(image, diameter, tile=256, gate=None, engine="trackpy",
+                 **kwargs):
+    """Run a detection engine only where something is moving.
+
+    The background-subtracted frame is split into tile x tile blocks and a
+    block is active if its max exceeds gate. Adjacent active tiles are
+    grouped, and the engine runs once per group on the group's bounding box
+    plus a halo of one diameter, so features on tile borders are seen whole.
+    A feature is kept only by the group that owns the tile containing its
+    centre, so there are no duplicates where boxes overlap. Cost scales
+    with the area the organisms occupy rather than the sensor area.
+
+    Args:
+        image: Background-subtracted uint8 frame.
+        diameter: Feature diameter, passed on to the engine.
+        tile: Tile edge length in pixels.
+        gate: Minimum tile max for a tile to be searched. None = the
+            frame's noise_gate(), which holds however much of the frame the
+            organisms cover.
+        engine: Name of the engine to run on active regions.
+        **kwargs: Passed on to the engine.
+
+    Returns:
+        DataFrame in full-frame coordinates with the engine's columns.
+    """
+    locate = ENGINES[engine]
+    maxima = tile_max(image, tile)
+    if gate is None:
+        gate = noise_gate(image)
+
+    active = (maxima > gate).astype(np.uint8)
+    n, groups, stats, _ = cv2.connectedComponentsWithStats(active, connectivity=8)
+    halo = int(diameter)
+    height, width = image.shape
+
+    found = []
+    for g in range(1, n):
+        left, top, w, h = stats[g, :4]
+        y0 = max(top * tile - halo, 0)
+        x0 = max(left * tile - halo, 0)
+        y1 = min((top + h) * tile + halo, height)
+        x1 = min((left + w) * tile + halo, width)
+        features = locate(image[y0:y1, x0:x1], diameter=diameter, **kwargs)
+        if len(features) == 0:
+            continue
+        features["y"] += y0
+        features["x"] += x0
+        ty = np.clip(features["y"].to_numpy() // tile, 0, groups.shape[0] - 1)
+        tx = np.clip(features["x"].to_numpy() // tile, 0, groups.shape[1] - 1)
+        found.append(features[groups[ty.astype(int), tx.astype(int)] == g])
+
+    if not found:
+        return pd.DataFrame(columns=COLUMNS, dtype=np.float64)
+    return pd.concat(found, ignore_index=True)
+
+
+# tp.locate arguments measured in pixels, rescaled along with diameter
+LENGTHS = ("noise_size", "smoothing_size", "separation", "maxsize")
+# below this diameter a blob is too few pixels to locate reliably
+MIN_COARSE = 7
+
+
+def refine_windows(image, y, x, diameter, reach, noise_size=1,
+                   smoothing_size=None, threshold=None):
+    """Re-centre features near (y, x) as tp.locate would, on the bandpassed
+    full-resolution frame, bandpassing only a window around each feature.
+
+    reach is how far (in pixels) a position may be from the true centre; the
+    window leaves room for that, the feature's radius and the bandpass
+    kernels, so inside it the filtered frame matches a full-frame bandpass.
+    """
+    diameter = int(diameter)
+    radius = diameter // 2
+    smoothing_size = smoothing_size or diameter
+    height, width = image.shape
+    reach = int(np.ceil(reach))
+    half = radius + reach + int(smoothing_size) // 2 + 4 * int(noise_size)
+    y, x = y.copy(), x.copy()
+    for k, (cy, cx) in enumerate(zip(np.round(y).astype(int), np.round(x).astype(int))):
+        y0, y1 = max(cy - half, 0), min(cy + half + 1, height)
+        x0, x1 = max(cx - half, 0), min(cx + half + 1, width)
+        if min(y1 - y0, x1 - x0) <= diameter:
+            continue
+        window = image[y0:y1, x0:x1]
+        filtered = tp.bandpass(window, noise_size, smoothing_size, threshold)
+        # start, like tp.locate, from the filtered maximum: refine_com stops
+        # within 0.6 px, so where it starts shifts the result
+        ry = slice(max(cy - y0 - reach, radius), min(cy - y0 + reach + 1, y1 - y0 - radius))
+        rx = slice(max(cx - x0 - reach, radius), min(cx - x0 + reach + 1, x1 - x0 - radius))
+        peak = np.unravel_index(np.argmax(filtered[ry, rx]), filtered[ry, rx].shape)
+        coords = np.array([[ry.start + peak[0], rx.start + peak[1]]])
+        refined = tp.refine_com(window, filtered, radius, coords,
+                                characterize=False)
+        y[k] = refined["y"].iloc[0] + y0
+        x[k] = refined["x"].iloc[0] + x0
+    return y, x
+
+
+def locate_pyramid(image, diameter, minmass=0, factor=4, refine=False,
+                   engine="trackpy", **kwargs):
+    """Detect on a downsampled frame, optionally refining at full resolution.
+
+    For large organisms tp.locate spends most of its time convolving with
+    diameter-sized kernels. Here the frame is shrunk by factor with
+    cv2.INTER_AREA (a box average, so a blob keeps its mean intensity), the
+    engine runs with diameter, minmass and the other length arguments
+    scaled to match, and each hit is mapped back to full-frame coordinates.
+    With refine, every hit is then re-centred at full resolution as
+    tp.locate does, on a bandpassed window around it (refine_windows). mass
+    and size are the coarse measurements rescaled to full resolution, so
+    they stay comparable with tp.locate's bandpassed mass and minmass keeps its meaning.
+
+    Args:
+        image: Background-subtracted uint8 frame.
+        diameter: Feature diameter at full resolution.
+        minmass: Minimum mass at full resolution.
+        factor: Downsampling factor. It is capped so the coarse diameter
+            stays at least MIN_COARSE pixels; features smaller than that
+            are located at full resolution.
+        refine: Refine positions at full resolution.
+        engine: Name of the engine to run on the downsampled frame.
+        **kwargs: Passed on to the engine; lengths are rescaled.
+
+    Returns:
+        DataFrame in full-frame coordinates with trackpy's locate columns.
+    """
+    factor = min(factor, int(diameter) // MIN_COARSE)
+    if factor <= 1:
+        return ENGINES[engine](image, diameter=diameter, minmass=minmass,
+                               **kwargs)
+    height, width = image.shape
+    small = cv2.resize(image, (max(width // factor, 1), max(height // factor, 1)),
+                       interpolation=cv2.INTER_AREA)
+    # trackpy needs an odd diameter
+    coarse = int(diameter / factor) // 2 * 2 + 1
+    bandpass = {key: kwargs.get(key)
+                for key in ("noise_size", "smoothing_size", "threshold")
+                if kwargs.get(key) is not None}
+    for key in LENGTHS:
+        if kwargs.get(key) is not None:
+            kwargs[key] = kwargs[key] / factor
+    features = ENGINES[engine](small, diameter=coarse,
+                               minmass=minmass / factor ** 2, **kwargs)
+    if len(features) == 0:
+        return pd.DataFrame(columns=COLUMNS, dtype=np.float64)
+
+    # pixel centres: small pixel i covers full pixels [i * f, (i + 1) * f)
+    scale_x = width / small.shape[1]
+    scale_y = height / small.shape[0]
+    y = (features["y"].to_numpy() + 0.5) * scale_y - 0.5
+    x = (features["x"].to_numpy() + 0.5) * scale_x - 0.5
+
+    if refine:
+        y, x = refine_windows(image, y, x, diameter, factor, **bandpass)
+
+    features = features.reset_index(drop=True)
+    features["y"] = y
+    features["x"] = x
+    for key in ("mass", "raw_mass"):
+        if key in features:
+            features[key] *= scale_x * scale_y
+    if "size" in features:
+        features["size"] *= factor
+    return features
+
+
+ENGINES = {
+    "trackpy": tp.locate,
+    "cc": locate_cc,
+    "tiles": locate_tiles,
+    "pyramid": locate_pyramid,
+}
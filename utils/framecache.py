@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from frames import open_video
+
+########################################################################
+####                                                                ####
+####                       decoded-frame cache                      ####
+####                                                                ####
+########################################################################
+
+# Parameter sweeps decode, downsample and crop the same clip for every
+# combination they test. The cache does that once per video and keeps the
+# result as a (frames, height, width) uint8 .npy file; later runs, and
+# worker processes given the path, map it read-only with np.load(...,
+# mmap_mode="r"), so the pages are shared through the OS page cache instead
+# of being copied. Entries are keyed by a fingerprint of the video's
+# contents plus the downsampling and crop, and hold frames 0..stop. Files
+# are written under a temporary name and renamed into place, so a reader
+# never sees a partial entry; the least recently used entries are removed
+# when the cache would grow past its size budget.
+
+# bytes read from each end of the video for its fingerprint
+_SAMPLE = 1 << 20
+
+
+def _area(frame, factor):
+    return cv2.resize(frame, (frame.shape[1] // factor, frame.shape[0] // factor),
+                      interpolation=cv2.INTER_AREA)
+
+
+def _gaussian(frame, factor):
+    # what testing/agent-testing has always used, so cached frames match its
+    # pre-computed backgrounds exactly
+    from skimage.transform import rescale
+    return rescale(frame, 1.0 / factor, anti_aliasing=True,
+                   preserve_range=True).astype(np.uint8)
+
+
+DOWNSAMPLERS = {
+    "area": _area,
+    "gaussian": _gaussian,
+}
+
+
+def fingerprint(video):
+    """Hash of a video's size and first and last MiB: cheap to compute,
+    unchanged when the file is moved or copied, changed when it is rewritten."""
+    size = os.path.getsize(video)
+    digest = hashlib.sha1(str(size).encode())
+    with open(video, "rb") as f:
+        digest.update(f.read(_SAMPLE))
+        if size > _SAMPLE:
+            f.seek(max(size - _SAMPLE, _SAMPLE))
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+class FrameCache:
+    """Decoded greyscale frames, memory-mapped from .npy files in directory.
+
+    Args:
+        directory: Where entries are kept (created if needed).
+        budget_mb: Total size the cache may grow to, in MiB.
+        decoder: Frame source used to fill entries (see DECODERS).
+    """
+
+    def __init__(self, directory, budget_mb=20480, decoder="cv2"):
+        self.directory = Path(directory)
+        self.budget = budget_mb * 2 ** 20
+        self.decoder = decoder
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, video, downsample=1, method="gaussian", crop=None):
+        """Name of the entry for video decoded with these settings.
+
+        The decoder is part of the key: cv2 and the ffmpeg pipe convert to
+        grey differently, so their frames differ by a few grey levels.
+        """
+        settings = dict(video=fingerprint(video), decoder=self.decoder,
+                        downsample=downsample,
+                        method=method if downsample > 1 else None,
+                        crop=list(crop) if crop is not None else None)
+        return hashlib.sha1(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:16]
+
+    def load(self, video, stop=None, downsample=1, method="gaussian", crop=None):
+        """Frames 0..stop of video (all frames if stop is None) as a
+        read-only memory-mapped array, decoding them first on a miss.
+
+        crop (x0, x1, y0, y1) is applied at full resolution, before
+        downsampling. If the entry would not fit in the budget, the frames
+        are decoded into memory and returned uncached.
+        """
+        if method not in DOWNSAMPLERS:
+            raise ValueError(
+                f"Unknown downsampling method '{method}'. "
+                f"Choose from: {', '.join(DOWNSAMPLERS)}"
+            )
+        key = self.key(video, downsample, method, crop)
+        path = self.directory / f"{key}.npy"
+        meta = self.directory / f"{key}.json"
+        source = open_video(video, self.decoder, stop=stop, crop=crop)
+        if path.exists() and meta.exists():
+            with open(meta) as f:
+                info = json.load(f)
+            # an entry for more frames (or for the whole video) also serves this read
+            if info["frames"] >= len(source) or info["complete"]:
+                os.utime(path)
+                return np.load(path, mmap_mode="r")[:len(source)]
+
+        frames = self._decode(source, downsample, method)
+        first = next(frames, None)
+        if first is None:
+            raise IOError(f"No frames decoded from {video}")
+        size = len(source) * first.size
+        if not self._make_room(size):
+            print(f"Not caching {video}: {size / 2 ** 20:.0f} MiB is over the "
+                  f"{self.budget / 2 ** 20:.0f} MiB budget.")
+            # copies, since the ffmpeg decoder recycles its buffers
+            return np.stack([first.copy()] + [frame.copy() for frame in frames])
+
+        print(f"Caching {len(source)} frames of {video} in {path}")
+        tmp = path.with_name(f"{key}.{os.getpid()}.tmp.npy")
+        array = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.uint8,
+                                          shape=(len(source),) + first.shape)
+        array[0] = first
+        n = 1
+        for n, frame in enumerate(frames, 2):
+            array[n - 1] = frame
+        array.flush()
+        if n < len(source):
+            # the container over-reported its frame count; keep what decoded
+            decoded = np.array(array[:n])
+            del array
+            np.save(tmp, decoded)
+        else:
+            del array
+        os.replace(tmp, path)
+        with open(meta, "w") as f:
+            json.dump({"video": str(video), "frames": n,
+                       "complete": n < len(source) or len(source) >= source.frame_count,
+                       "downsample": downsample, "method": method,
+                       "crop": list(crop) if crop is not None else None}, f)
+        return np.load(path, mmap_mode="r")
+
+    def _decode(self, source, downsample, method):
+        for frame in source:
+            yield DOWNSAMPLERS[method](frame, downsample) if downsample > 1 else frame
+
+    def _make_room(self, size):
+        """Remove least recently used entries until size more bytes fit in
+        the budget; False if they never would."""
+        if size > self.budget:
+            return False
+        entries = sorted(self.directory.glob("*.npy"), key=lambda p: p.stat().st_mtime)
+        entries = [p for p in entries if not p.name.endswith(".tmp.npy")]
+        used = sum(p.stat().st_size for p in entries)
+        while entries and used + size > self.budget:
+            oldest = entries.pop(0)
+            used -= oldest.stat().st_size
+            oldest.unlink()
+            oldest.with_suffix(".json").unlink(missing_ok=True)
+        return True
@@ -0,0 +1,309 @@
+import queue
+import subprocess
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+########################################################################
+####                                                                ####
+####                          frame sources                         ####
+####                                                                ####
+########################################################################
+
+_DONE = object()
+
+
+class _Raised:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+def prefetch(iterable, maxsize=8):
+    """Iterate over iterable on a background thread, up to maxsize items ahead.
+
+    Decoding (cv2, imgstore) releases the GIL, so the producer runs while the
+    consumer is busy with the previous item. Exceptions raised by the producer
+    are re-raised in the consumer. Items must not share buffers, since the
+    producer keeps working while the consumer holds them.
+    """
+    if maxsize <= 0:
+        yield from iterable
+        return
+
+    q = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def fill():
+        it = iter(iterable)
+        try:
+            for item in it:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as e:
+            put(_Raised(e))
+        finally:
+            if hasattr(it, "close"):
+                it.close()
+
+    thread = threading.Thread(target=fill, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = q.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Raised):
+                raise item.exc
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class VideoFrames:
+    """Greyscale frames from a video, decoded ahead on a background thread.
+
+    Iterating yields frames start, start + step, ... up to stop (or the end of
+    the video). Skipped frames are grabbed but not converted, and the capture
+    is only positioned once, at start, so strided and range reads stay
+    sequential.
+
+    Args:
+        video: Path to the video.
+        start, stop, step: Frame range, as for range(). stop=None reads to the
+            end of the video.
+        prefetch: Number of frames decoded ahead (0 = decode in the caller).
+        code: cv2 colour conversion applied to each decoded frame.
+        crop: (x0, x1, y0, y1) box to cut from each frame before it is
+            converted; shape is the cropped shape.
+    """
+
+    def __init__(self, video, start=0, stop=None, step=1, prefetch=8,
+                 code=cv2.COLOR_BGR2GRAY, crop=None):
+        self.video = str(video)
+        cap = cv2.VideoCapture(self.video)
+        if not cap.isOpened():
+            raise IOError(f"Cannot open video file: {self.video}")
+        self.frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
+        self.shape = (int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                      int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)))
+        cap.release()
+        if crop is not None:
+            x0, x1, y0, y1 = crop
+            self.shape = (y1 - y0, x1 - x0)
+
+        self.start = start
+        self.stop = self.frame_count if stop is None else min(stop, self.frame_count)
+        self.step = step
+        self.prefetch = prefetch
+        self.code = code
+        self.crop = crop
+
+    def __len__(self):
+        return len(range(self.start, self.stop, self.step))
+
+    @property
+    def frame_numbers(self):
+        return range(self.start, self.stop, self.step)
+
+    def __iter__(self):
+        return prefetch(self._decode(), self.prefetch)
+
+    def _decode(self):
+        cap = cv2.VideoCapture(self.video)
+        if self.crop is not None:
+            x0, x1, y0, y1 = self.crop
+            region = (slice(y0, y1), slice(x0, x1))
+        else:
+            region = (slice(None), slice(None))
+        try:
+            if self.start > 0:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, self.start)
+            for _ in self.frame_numbers:
+                ret, frame = cap.read()
+                if not ret:
+                    return
+                yield cv2.cvtColor(frame[region], self.code)
+                for _ in range(self.step - 1):
+                    if not cap.grab():
+                        return
+        finally:
+            cap.release()
+
+
+class FrameReader:
+    """Greyscale frames by index, decoded sequentially whenever the access
+    pattern allows it.
+
+    reader[i] (or reader.read(i)) returns frame i. The capture stays open
+    and remembers its position, so reading i, i + 1, ... is plain sequential
+    decoding, and a short jump forward (up to max_skip frames) grabs the
+    frames in between. Only a jump backwards or further ahead repositions
+    the capture, which on long-GOP files means decoding from the previous
+    keyframe. The last `cache` frames read are kept, least recently used
+    first out, so going back to a recent frame decodes nothing. Returned
+    frames are the cached arrays; copy one before modifying it.
+
+    Args:
+        video: Path to the video.
+        cache: Number of decoded frames kept.
+        max_skip: Longest forward jump made by grabbing instead of seeking.
+        code: cv2 colour conversion applied to each decoded frame.
+    """
+
+    def __init__(self, video, cache=32, max_skip=64, code=cv2.COLOR_BGR2GRAY):
+        self.video = str(video)
+        self.cap = cv2.VideoCapture(self.video)
+        if not self.cap.isOpened():
+            raise IOError(f"Cannot open video file: {self.video}")
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.cache = cache
+        self.max_skip = max_skip
+        self.code = code
+        self.seeks = 0
+        self.decoded = 0
+        self._frames = OrderedDict()
+        self._position = 0
+
+    def __len__(self):
+        return self.frame_count
+
+    def __getitem__(self, index):
+        frame = self.read(index)
+        if frame is None:
+            raise IndexError(f"Frame {index} could not be read from {self.video}")
+        return frame
+
+    def read(self, index):
+        """Frame index, or None if it cannot be decoded."""
+        if index in self._frames:
+            self._frames.move_to_end(index)
+            return self._frames[index]
+        if index < self._position or index - self._position > self.max_skip:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+            self._position = index
+            self.seeks += 1
+        while self._position < index:
+            if not self.cap.grab():
+                return self._lost()
+            self._position += 1
+        ret, frame = self.cap.read()
+        if not ret:
+            return self._lost()
+        self._position += 1
+        self.decoded += 1
+
+        frame = cv2.cvtColor(frame, self.code)
+        self._frames[index] = frame
+        while len(self._frames) > self.cache:
+            self._frames.popitem(last=False)
+        return frame
+
+    def _lost(self):
+        # the position after a failed read is unknown; seek on the next one
+        self._position = float("inf")
+        return None
+
+    def close(self):
+        self.cap.release()
+        self._frames.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FFmpegFrames(VideoFrames):
+    """Luma frames piped from a local ffmpeg process.
+
+    ffmpeg converts straight to 8-bit grey (-pix_fmt gray), so no 3-channel
+    BGR frame is ever materialized and no cvtColor is needed: a third of the
+    memory traffic of the cv2 path. Frames are read into a small pool of
+    preallocated buffers that is recycled, so a yielded frame is only valid
+    until prefetch + 1 further frames have been read; copy it to keep it.
+
+    Takes the same arguments as VideoFrames (code is ignored) plus the
+    ffmpeg executable to run. crop is done by ffmpeg, so only the cropped
+    pixels are ever piped.
+    """
+
+    def __init__(self, video, start=0, stop=None, step=1, prefetch=8,
+                 crop=None, ffmpeg="ffmpeg", **kwargs):
+        super().__init__(video, start, stop, step, prefetch, crop=crop)
+        self.ffmpeg = ffmpeg
+
+    def command(self):
+        cmd = [self.ffmpeg, "-nostdin", "-v", "error", "-i", self.video]
+        filters = []
+        # frames are picked by decoded index, as cv2 counts them: a seek
+        # by start / fps can land a frame off with variable frame rates or
+        # odd timebases. Frames before start are decoded but never piped.
+        if self.start > 0:
+            filters.append(f"select=gte(n\\,{self.start})"
+                           f"*not(mod(n-{self.start}\\,{self.step}))")
+        elif self.step > 1:
+            filters.append(f"select=not(mod(n\\,{self.step}))")
+        if self.crop is not None:
+            x0, x1, y0, y1 = self.crop
+            filters.append(f"crop={x1 - x0}:{y1 - y0}:{x0}:{y0}:exact=1")
+        if filters:
+            cmd += ["-vf", ",".join(filters)]
+        cmd += ["-frames:v", str(len(self)), "-fps_mode", "passthrough",
+                "-f", "rawvideo", "-pix_fmt", "gray", "-"]
+        return cmd
+
+    def _decode(self):
+        buffers = np.empty((self.prefetch + 2,) + self.shape, np.uint8)
+        proc = subprocess.Popen(self.command(), stdout=subprocess.PIPE)
+        try:
+            for k in range(len(self)):
+                frame = buffers[k % len(buffers)]
+                if not _read_exactly(proc.stdout, frame):
+                    return
+                yield frame
+        finally:
+            proc.stdout.close()
+            proc.kill()
+            proc.wait()
+
+
+def _read_exactly(stream, buffer):
+    view = memoryview(buffer).cast("B")
+    filled = 0
+    while filled < len(view):
+        n = stream.readinto(view[filled:])
+        if not n:
+            return False
+        filled += n
+    return True
+
+
+DECODERS = {
+    "cv2": VideoFrames,
+    "ffmpeg": FFmpegFrames,
+}
+
+
+def open_video(video, decoder="cv2", **kwargs):
+    """Return a frame source for video using the named decoder (see DECODERS)."""
+    if decoder not in DECODERS:
+        raise ValueError(
+            f"Unknown decoder '{decoder}'. Choose from: {', '.join(DECODERS)}"
+        )
+    return DECODERS[decoder](video, **kwargs)
@@ -9,82 +9,149 @@ import argparse
 import gzip
 import pickle
 import glob
-
-
-def merge_data(hdf5s, input):
-
-    all_data = []
-    i = 0
+import itertools
+import os
+from collections import deque
+from functools import partial
+from multiprocessing import get_context
+
+import metrics
+from parallel import available_cores
+from profiles import PROFILES, get_profile
+from writers import (SINKS, ParquetWriter, describe_features, read_batch,
+                     read_features, writer_for)
+
+
+def merge_data(stores, input, output=None, frames_per_batch=1000, processes=None):
+    """Concatenate the detections of stores, in the order given, into one
+    table with consecutive frame numbers and write it to output.
+
+    Each store is read a batch of frames at a time and every batch goes
+    straight to the output, so memory use depends on the batch size, not
+    on the number or length of the videos. With several processes, stores
+    are described and batches read on worker processes, up to two batches
+    per process ahead of the writer; offsets come from the descriptions
+    and batches are written in store and frame order, so the output does
+    not depend on the number of processes.
+
+    The format is taken from the suffix of output (see writers.SINKS); the
+    default is input/<input>_tracks.feather. The output only appears under
+    its name once every store has been copied. Returns its path.
+    """
+    if output is None:
+        output = Path(input, Path(input).stem + "_tracks.feather")
+    output = Path(output)
+    sink = writer_for(output, SINKS)
+    processes = processes or available_cores()
+
+    pool = get_context().Pool(processes) if processes > 1 else None
+    try:
+        with metrics.stage("merge"):
+            describe = partial(describe_features, frames_per_batch=frames_per_batch)
+            summaries = pool.map(describe, stores) if pool else list(map(describe, stores))
+            offsets = frame_offsets(stores, summaries)
+
+        tasks = [(file, batch, offset)
+                 for file, summary, offset in zip(stores, summaries, offsets)
+                 if offset is not None
+                 for batch in summary["batches"]]
+        if not tasks:
+            raise ValueError(f"No detections in any of {len(stores)} stores.")
+
+        rows = 0
+        tmp = output.with_name(output.name + ".tmp")
+        kwargs = {"frames_per_group": 1} if sink is ParquetWriter else {}
+        print(f"Writing {output.name}.")
+        with sink(tmp, **kwargs) as s:
+            batches = read_ahead(tasks, pool, 2 * processes)
+            while True:
+                with metrics.stage("merge"):
+                    batch = next(batches, None)
+                if batch is None:
+                    break
+                metrics.count("merge", batch["frame"].nunique())
+                with metrics.stage("write"):
+                    s.put(batch)
+                rows += len(batch)
+        os.replace(tmp, output)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    print(f"{rows} rows in merged data frame.")
+
+    return output
+
+
+def frame_offsets(stores, summaries):
+    """Number added to each store's frames so that the stores follow each
+    other: the frames of every earlier non-empty store, counted up to its
+    last frame. None for stores with no detections, which are skipped."""
+
+    offsets = []
     total_records = 0
-    for file, i in zip(hdf5s, range(len(hdf5s))):
-        with tp.PandasHDFStore(file, mode="r") as hdf5:
-            print(f"Getting data from {Path(file).stem}")
-            try:
-                all_results = hdf5.dump()
-                if i == 0:
-                    records = int(all_results["frame"].max())
-                    total_records = records
-                    print(f"{records} frames in {Path(file).stem}")
-                else:
-                    new_records = int(all_results["frame"].max())
-                    total_records = total_records + new_records + 1
-                    all_results["frame"] += total_records - new_records
-                    print(
-                        f"{new_records} frames in {Path(file).stem}. {total_records} total records"
-                    )
-                all_data.append(all_results)
-            except ValueError as e:
-                if "No objects to concatenate" in str(e):
-                    print(f"Skipping empty file: {Path(file).stem}")
-                    if i == 0:
-                        total_records = (
-                            -1
-                        )  # Reset to -1 so next non-empty file starts at 0
-                    continue
-                else:
-                    raise e
-            i += 1
-
-    all_data = pd.concat(all_data)
-    all_records = int(len(all_data["frame"]))
-    print(f"{all_records} rows in merged data frame.")
-
-    if "particle" in all_data.columns:
-        all_data = all_data.drop(columns=["particle"])
-
-    feather_path = Path(input, Path(input).stem + "_tracks.feather")
-    print("Writing feather file.")
-    all_data.reset_index(drop=True, inplace=True)
-    all_data.to_feather(feather_path)
-
-    return all_data
-
-
-def generate_tracks(df, input):
-
-    if "miracidia" in input:
-        search_range = 45
-        memory = 25
-        adaptive_stop = 15
-    elif "mosquito" in input:
-        search_range = 750
-        memory = 100
-        adaptive_stop = 100
-    elif "planaria" in input:
-        search_range = 750
-        memory = 100
-        adaptive_stop = 50
+    for file, summary in zip(stores, summaries):
+        print(f"Getting data from {Path(file).stem}")
+        records = summary["last_frame"]
+        if records is None:
+            print(f"Skipping empty file: {Path(file).stem}")
+            offsets.append(None)
+            continue
+        offsets.append(total_records)
+        total_records += records + 1
+        print(f"{records} frames, {summary['rows']} rows in {Path(file).stem}. "
+              f"{total_records - 1} total records")
+
+    return offsets
+
+
+def offset_batch(file, batch, offset):
+    """Read one batch of a store and move it to the merged frame numbers."""
+    features = read_batch(file, batch)
+    features["frame"] += offset
+    if "particle" in features.columns:
+        features = features.drop(columns=["particle"])
+    return features
+
+
+def read_ahead(tasks, pool, ahead):
+    """Yield offset_batch(*task) for each task in order, with up to ahead
+    tasks running on pool (in this process if pool is None)."""
+    if pool is None:
+        for task in tasks:
+            yield offset_batch(*task)
+        return
+    tasks = iter(tasks)
+    pending = deque(pool.apply_async(offset_batch, task)
+                    for task in itertools.islice(tasks, ahead))
+    while pending:
+        batch = pending.popleft().get()
+        task = next(tasks, None)
+        if task is not None:
+            pending.append(pool.apply_async(offset_batch, task))
+        yield batch
+
+
+def generate_tracks(df, input, profile):
+
+    linking = profile["linking"]
 
     print("Linking particles.")
-    t = tp.link(
-        df, search_range=search_range, memory=memory, adaptive_stop=adaptive_stop
-    )
+    with metrics.stage("link"):
+        t = tp.link(
+            df,
+            search_range=linking["search_range"],
+            memory=linking["memory"],
+            adaptive_stop=linking["adaptive_stop"],
+        )
+    metrics.count("link", df["frame"].nunique())
     feather_path = Path(input, Path(input).stem + "_tracks.feather")
     print("Writing feather file.")
-    t.reset_index(drop=True, inplace=True)
-    t.to_feather(feather_path)
+    with metrics.stage("write"):
+        t.reset_index(drop=True, inplace=True)
+        t.to_feather(feather_path)
     print("Filtering stubs.")
-    t1 = tp.filter_stubs(t, 200)
+    with metrics.stage("filter"):
+        t1 = tp.filter_stubs(t, linking["stub_length"])
 
     return t1
 
@@ -93,32 +160,67 @@ def plot_tracks(tracks, input):
 
     print("Plotting trajectories.")
     save_path = Path(input, Path(input).stem + ".pdf")
-    fig = plt.figure()
-    ax = plt.gca()
-    tp.plot_traj(tracks, ax=ax)
-    fig.savefig(save_path)
+    with metrics.stage("plot"):
+        fig = plt.figure()
+        ax = plt.gca()
+        tp.plot_traj(tracks, ax=ax)
+        fig.savefig(save_path)
 
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="Track objects in an InVision video.")
     parser.add_argument(
-        "input", type=str, help="Path to input directory containing .pkl.gz or .hdf5"
+        "input",
+        type=str,
+        help="Path to input directory containing .pkl.gz, .hdf5 or .parquet",
     )
     parser.add_argument("--pickle", action="store_true")
     parser.add_argument("--hdf5", action="store_true")
+    parser.add_argument("--parquet", action="store_true")
+    parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        help="Species profile with the linking parameters (default: the "
+        "profile whose match strings are in the input path).",
+    )
+    parser.add_argument(
+        "--profiles",
+        type=str,
+        default=str(PROFILES),
+        help="Profile registry (default: profiles.yml next to this script).",
+    )
+    parser.add_argument(
+        "-p",
+        "--processes",
+        type=int,
+        default=None,
+        help="Processes reading .hdf5/.parquet stores for the merge (default: "
+        "cores allocated by SLURM, else all available cores).",
+    )
 
     args = parser.parse_args()
+    profile = get_profile(args.profile, args.profiles, hint=args.input)
 
     if args.pickle:
         pkl_file = glob.glob(f"{args.input}/*.pkl.gz")
         df = pd.read_pickle(pkl_file[0])
 
-        tracks = generate_tracks(df, args.input)
+        tracks = generate_tracks(df, args.input, profile)
         plot_tracks(tracks, args.input)
 
-    elif args.hdf5:
-        hdf5_files = glob.glob(f"{args.input}/*.hdf5")
-        merged = merge_data(sorted(hdf5_files), args.input)
-        tracks = generate_tracks(merged, args.input)
+    elif args.hdf5 or args.parquet:
+        suffix = "hdf5" if args.hdf5 else "parquet"
+        stores = glob.glob(f"{args.input}/*.{suffix}")
+        merged = read_features(
+            merge_data(sorted(stores), args.input, processes=args.processes)
+        )
+        tracks = generate_tracks(merged, args.input, profile)
         plot_tracks(tracks, args.input)
+
+    metrics.write(
+        Path(args.input, Path(args.input).stem + ".metrics.jsonl"),
+        input=args.input,
+        profile=profile["name"],
+    )
@@ -0,0 +1,44 @@
+import argparse
+import os
+from pathlib import Path
+
+from writers import copy_features, writer_for
+
+########################################################################
+####                                                                ####
+####                          shard merging                         ####
+####                                                                ####
+########################################################################
+
+# tracking.py --shard writes each frame range of a video to its own output,
+# already numbered with global frame numbers. Merging is a copy, frame by
+# frame, in shard order, so the result is the same file a single job over
+# the whole video would have written.
+
+
+def merge_shards(shards, output):
+    """Copy the detections of shards, in the order given, into output.
+
+    The format is taken from the suffix of output. The output only appears
+    under its name once every shard has been copied.
+    """
+    output = Path(output)
+    tmp = output.with_name(output.name + ".tmp")
+    with writer_for(output)(tmp) as s:
+        for shard in shards:
+            print(f"Merging {Path(shard).name}")
+            copy_features(shard, s)
+    os.replace(tmp, output)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Merge per-shard detections from tracking.py --shard.")
+    parser.add_argument("output", type=str,
+                        help="Merged .hdf5 or .parquet file to write.")
+    parser.add_argument("shards", type=str, nargs="+",
+                        help="Shard outputs, in shard order.")
+    args = parser.parse_args()
+
+    merge_shards(args.shards, args.output)
@@ -0,0 +1,149 @@
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+########################################################################
+####                                                                ####
+####                          instrumentation                       ####
+####                                                                ####
+########################################################################
+
+# Scripts time their stages with stage() (a block) and timed() (a stream of
+# frames), then write() one JSON line per stage next to their outputs.
+# Stages nest, and time is charged to the innermost one only: with
+# timed("subtract", timed("decode", frames)) the subtract stage's time does
+# not include the time spent waiting for decoded frames. CPU time is the
+# whole process's, so it includes helper threads (prefetch) running during
+# the stage; locate workers are separate processes and show up in the
+# final "children" record instead.
+#
+# Peak RSS is per stage as well: on Linux the process's high-water mark is
+# reset whenever the innermost stage changes, so each stage records the
+# largest RSS reached while it ran. Elsewhere only the lifetime peak
+# (ru_maxrss) is available, and a stage reports the largest RSS the process
+# had reached by its end.
+
+
+def _reset_peak():
+    """Reset the kernel's RSS high-water mark (VmHWM); False if unsupported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+PER_STAGE_PEAK = _reset_peak()
+
+
+def _rss_mb():
+    if PER_STAGE_PEAK:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    # ru_maxrss is in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Recorder:
+    """Accumulates wall time, CPU time, frames and peak RSS per stage."""
+
+    def __init__(self):
+        self.stages = {}
+        self._stack = []
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+
+    def _charge(self):
+        wall, cpu = time.perf_counter(), time.process_time()
+        if self._stack:
+            s = self.stages[self._stack[-1]]
+            s["wall_s"] += wall - self._wall
+            s["cpu_s"] += cpu - self._cpu
+            s["peak_rss_mb"] = max(s["peak_rss_mb"], _rss_mb())
+        if PER_STAGE_PEAK:
+            _reset_peak()
+        self._wall, self._cpu = wall, cpu
+
+    def _enter(self, name):
+        self._charge()
+        self.stages.setdefault(name, {"wall_s": 0.0, "cpu_s": 0.0,
+                                      "frames": 0, "peak_rss_mb": 0.0})
+        self._stack.append(name)
+
+    def _exit(self):
+        self._charge()
+        self._stack.pop()
+
+    @contextmanager
+    def stage(self, name):
+        """Charge the time spent in the block to stage name."""
+        self._enter(name)
+        try:
+            yield
+        finally:
+            self._exit()
+
+    def timed(self, name, iterable):
+        """Yield from iterable, charging the time spent producing each item
+        to stage name and counting the items as its frames."""
+        it = iter(iterable)
+        while True:
+            self._enter(name)
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                self._exit()
+            self.count(name)
+            yield item
+
+    def count(self, name, frames=1):
+        """Add frames to stage name's frame count."""
+        self.stages.setdefault(name, {"wall_s": 0.0, "cpu_s": 0.0,
+                                      "frames": 0, "peak_rss_mb": 0.0})
+        self.stages[name]["frames"] += frames
+
+    def records(self):
+        """One dict per stage, in the order stages were first entered."""
+        records = []
+        for name, s in self.stages.items():
+            fps = s["frames"] / s["wall_s"] if s["frames"] and s["wall_s"] else None
+            records.append(dict(stage=name, wall_s=round(s["wall_s"], 3),
+                                cpu_s=round(s["cpu_s"], 3), frames=s["frames"],
+                                fps=round(fps, 2) if fps else None,
+                                peak_rss_mb=round(s["peak_rss_mb"], 1)))
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        records.append(dict(stage="children",
+                            cpu_s=round(children.ru_utime + children.ru_stime, 3),
+                            peak_rss_mb=round(children.ru_maxrss / 1024, 1)))
+        return records
+
+    def write(self, path, **info):
+        """Append every stage's record to the JSON-lines file at path.
+
+        Each line also carries the script, host, SLURM job, time and info.
+        """
+        run = dict(script=os.path.basename(sys.argv[0]),
+                   host=platform.node(),
+                   job=os.environ.get("SLURM_JOB_ID"),
+                   time=time.strftime("%Y-%m-%dT%H:%M:%S"), **info)
+        with open(path, "a") as f:
+            for record in self.records():
+                f.write(json.dumps({**run, **record}) + "\n")
+        print(f"Wrote metrics to {path}")
+
+
+# the process-wide recorder used by the pipeline scripts
+RECORDER = Recorder()
+stage = RECORDER.stage
+timed = RECORDER.timed
+count = RECORDER.count
+write = RECORDER.write
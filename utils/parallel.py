@@ -0,0 +1,208 @@
+import os
+import queue
+from collections import deque
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import trackpy as tp
+
+import metrics
+
+########################################################################
+####                                                                ####
+####                   multi-process detection                      ####
+####                                                                ####
+########################################################################
+
+# The calling process decodes and preprocesses frames into a ring of slots
+# in shared memory. Worker processes attach to the same block and run locate
+# on a slot without copying it; only the (small) feature tables travel back
+# through a queue. Results are reassembled in frame order before they reach
+# the output store.
+
+
+def available_cores():
+    """Cores granted to this job (SLURM allocation, else CPU affinity)."""
+    slurm = os.environ.get("SLURM_CPUS_PER_TASK")
+    if slurm:
+        return int(slurm)
+    return len(os.sched_getaffinity(0))
+
+
+# Workers are started from a clean server process rather than forked from
+# this one: by the time they start, the prefetch thread is decoding, and a
+# fork would copy any lock it (or OpenCV) holds in the locked state.
+START_METHOD = "forkserver"
+# seconds between checks that every worker is still alive while waiting
+POLL_S = 1.0
+
+
+def _locate_worker(shm_name, shape, tasks, results, locate, kwargs):
+    shm = SharedMemory(name=shm_name)
+    ring = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            slot, frame_no = task
+            try:
+                features = locate(ring[slot], **kwargs)
+            except Exception as e:
+                results.put((slot, frame_no, e))
+                break
+            results.put((slot, frame_no, features))
+    finally:
+        del ring
+        shm.close()
+
+
+class RingLocator:
+    """Locate features with N worker processes reading a shared frame ring.
+
+    Use as a context manager. put() copies a frame into a free slot (waiting
+    for a worker to release one if the ring is full) and returns any results
+    that are ready, in frame order. finish() drains the remaining results.
+    """
+
+    def __init__(self, frame_shape, workers, slots=None, locate=tp.locate,
+                 **kwargs):
+        self.workers = workers
+        self.slots = slots or 2 * workers
+        self.shape = (self.slots,) + tuple(frame_shape)
+        self.locate = locate
+        self.kwargs = kwargs
+
+    def __enter__(self):
+        ctx = get_context(START_METHOD)
+        nbytes = int(np.prod(self.shape))
+        self._shm = SharedMemory(create=True, size=nbytes)
+        self._ring = np.ndarray(self.shape, dtype=np.uint8, buffer=self._shm.buf)
+        self._tasks = ctx.Queue()
+        self._results = ctx.Queue()
+        self._free = deque(range(self.slots))
+        self._done = {}
+        self._next = None
+        self._in_flight = 0
+        self._procs = [
+            ctx.Process(
+                target=_locate_worker,
+                args=(self._shm.name, self.shape, self._tasks, self._results,
+                      self.locate, self.kwargs),
+                daemon=True,
+            )
+            for _ in range(self.workers)
+        ]
+        for p in self._procs:
+            p.start()
+        return self
+
+    def __exit__(self, *exc):
+        for _ in self._procs:
+            self._tasks.put(None)
+        for p in self._procs:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+        del self._ring
+        self._shm.close()
+        self._shm.unlink()
+
+    def put(self, frame_no, frame):
+        if self._next is None:
+            self._next = frame_no
+        while not self._free:
+            self._collect(block=True)
+        slot = self._free.popleft()
+        self._ring[slot] = frame
+        self._tasks.put((slot, frame_no))
+        self._in_flight += 1
+        while self._collect(block=False):
+            pass
+        return self._ready()
+
+    def finish(self):
+        while self._in_flight:
+            self._collect(block=True)
+        return self._ready()
+
+    def _collect(self, block):
+        while True:
+            try:
+                slot, frame_no, features = self._results.get(
+                    block=block, timeout=POLL_S if block else None)
+                break
+            except queue.Empty:
+                if not block:
+                    return False
+                # a worker that was killed (e.g. out of memory) never answers
+                for p in self._procs:
+                    if not p.is_alive():
+                        raise RuntimeError(
+                            f"locate worker {p.pid} exited with code "
+                            f"{p.exitcode} with {self._in_flight} frames in flight")
+        if isinstance(features, Exception):
+            raise RuntimeError(f"locate failed on frame {frame_no}") from features
+        self._free.append(slot)
+        self._in_flight -= 1
+        self._done[frame_no] = features
+        return True
+
+    def _ready(self):
+        ready = []
+        while self._next in self._done:
+            ready.append((self._next, self._done.pop(self._next)))
+            self._next += 1
+        return ready
+
+
+def locate_stream(frames, store, processes=None, locate=tp.locate, slots=None,
+                  origin=(0, 0), **kwargs):
+    """Locate features in a stream of frames and write them to store in order.
+
+    frames yields (frame_no, frame) with consecutive frame numbers. locate is
+    any engine from detection.py. With more than one process, one core is
+    left for decoding and the rest run locate on a shared-memory ring of
+    preprocessed frames, with at most slots frames (default: two per worker).
+    origin is the (y, x) position of the frames in the full video frame, added
+    to every feature's coordinates.
+    """
+    if processes is None:
+        processes = available_cores()
+    workers = max(processes - 1, 1)
+
+    def write(frame_no, features):
+        features["frame"] = frame_no
+        if origin != (0, 0):
+            features["y"] += origin[0]
+            features["x"] += origin[1]
+        metrics.count("locate")
+        if len(features) > 0:
+            with metrics.stage("write"):
+                store.put(features)
+            metrics.count("write")
+
+    # time not spent producing frames or writing is charged to locate
+    with metrics.stage("locate"):
+        frames = iter(frames)
+        if processes <= 1:
+            for frame_no, frame in frames:
+                write(frame_no, locate(frame, **kwargs))
+            return
+
+        try:
+            frame_no, frame = next(frames)
+        except StopIteration:
+            return
+        if slots is not None:
+            slots = min(slots, 2 * workers)
+        with RingLocator(frame.shape, workers, slots, locate,
+                         **kwargs) as locator:
+            for item in locator.put(frame_no, frame):
+                write(*item)
+            for frame_no, frame in frames:
+                for item in locator.put(frame_no, frame):
+                    write(*item)
+            for item in locator.finish():
+                write(*item)
@@ -0,0 +1,64 @@
+import cv2
+import numpy as np
+
+########################################################################
+####                                                                ####
+####                  background subtraction kernels                ####
+####                                                                ####
+########################################################################
+
+# Kernels write |frame - background| into a preallocated uint8 buffer, so
+# the per-frame path allocates nothing. All take (frame, background, out)
+# plus optional threshold and mask and return out.
+
+
+def subtract_absdiff(frame, background, out, threshold=None, mask=None):
+    """Saturating absolute difference, like cv2.absdiff.
+
+    Args:
+        frame, background: uint8 images of the same shape.
+        out: uint8 buffer of the same shape to write into (may be frame).
+        threshold: Differences <= threshold are set to 0.
+        mask: uint8 image, 255 inside the region of interest and 0 outside.
+            Pixels outside are set to 0.
+    """
+    cv2.absdiff(frame, background, dst=out)
+    if threshold:
+        cv2.threshold(out, threshold, 0, cv2.THRESH_TOZERO, dst=out)
+    if mask is not None:
+        cv2.bitwise_and(out, mask, dst=out)
+    return out
+
+
+def subtract_legacy(frame, background, out, threshold=None, mask=None):
+    """The original tracking.py kernel, kept to reproduce old results.
+
+    np.absolute((frame - background).astype(np.int8)) wraps around in uint8
+    and then reinterprets as int8, so it only matches the true absolute
+    difference when that is below 128.
+    """
+    np.subtract(frame, background, out=out)
+    diff = out.view(np.int8)
+    np.absolute(diff, out=diff)
+    if threshold:
+        out[out <= threshold] = 0
+    if mask is not None:
+        np.bitwise_and(out, mask, out=out)
+    return out
+
+
+def subtract_reference(frame, background, threshold=None, mask=None):
+    """Slow, allocating reference for subtract_absdiff."""
+    diff = np.abs(frame.astype(np.int16) - background.astype(np.int16))
+    diff = np.clip(diff, 0, 255).astype(np.uint8)
+    if threshold:
+        diff[diff <= threshold] = 0
+    if mask is not None:
+        diff[mask == 0] = 0
+    return diff
+
+
+KERNELS = {
+    "absdiff": subtract_absdiff,
+    "legacy": subtract_legacy,
+}
@@ -0,0 +1,130 @@
+import copy
+from functools import lru_cache
+from pathlib import Path
+
+import yaml
+
+########################################################################
+####                                                                ####
+####                         species profiles                       ####
+####                                                                ####
+########################################################################
+
+# Every organism's detection, background, linking and performance settings
+# live in profiles.yml. A profile only lists what differs from DEFAULTS;
+# sections are merged key by key, so adding a knob here makes it available
+# to every profile without touching the registry.
+
+PROFILES = Path(__file__).with_name("profiles.yml")
+VERSION = 1
+
+DEFAULTS = {
+    "match": [],
+    "detection": {
+        "engine": "trackpy",
+        "tile": 256,
+        # tile max below which the tiles engine skips a tile; None = the
+        # frame's noise level (detection.noise_gate)
+        "gate": None,
+        # downsampling for the pyramid engine
+        "factor": 4,
+        "refine": False,
+        "kernel": "absdiff",
+        "threshold": None,
+        "locate": {},
+    },
+    "background": {
+        "mode": "chunk",
+        "chunk": 25,
+        "percentile": 50,
+    },
+    "roi": {
+        # [min_x, max_x, min_y, max_y] crop, [[x, y], ...] polygon to keep,
+        # and a split_wells.py config whose plate (and walls) are masked
+        "bounds": None,
+        "polygon": None,
+        "wells": None,
+        "wall": 0,
+    },
+    "linking": {
+        "search_range": None,
+        "memory": 0,
+        "adaptive_stop": None,
+        "stub_length": 200,
+    },
+    "performance": {
+        "decoder": "cv2",
+        "processes": None,
+        "segment": 1000,
+        # MB for decoded and queued frames and locate workers; None = no limit
+        "memory_mb": None,
+        # peak MB of one locate worker; None = estimated from the frame size
+        "worker_mb": None,
+    },
+}
+
+
+@lru_cache
+def load_profiles(path=PROFILES):
+    """Read a profile registry and merge every profile over DEFAULTS.
+
+    The registry is read once per path and process.
+    """
+    with open(path) as f:
+        registry = yaml.safe_load(f)
+    version = registry.get("version")
+    if version != VERSION:
+        raise ValueError(
+            f"{path} is profile version {version}; this code reads version "
+            f"{VERSION}."
+        )
+
+    profiles = {}
+    for name, profile in registry["profiles"].items():
+        unknown = set(profile) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(
+                f"Unknown section(s) in profile '{name}': {', '.join(unknown)}"
+            )
+        merged = copy.deepcopy(DEFAULTS)
+        for section, values in profile.items():
+            if isinstance(merged[section], dict):
+                merged[section].update(values)
+            else:
+                merged[section] = values
+        merged["name"] = name
+        merged["version"] = version
+        profiles[name] = merged
+    return profiles
+
+
+def get_profile(name=None, path=PROFILES, hint=None):
+    """Return a profile by name, or the one whose match strings are in hint.
+
+    Raises ValueError if the name is unknown, or if no name is given and
+    hint does not match exactly one profile.
+    """
+    profiles = load_profiles(Path(path))
+    if name is None:
+        matches = [p for p in profiles
+                   if any(m in str(hint) for m in profiles[p]["match"])]
+        if len(matches) != 1:
+            raise ValueError(
+                f"Cannot choose a profile from '{hint}' (matches: "
+                f"{', '.join(matches) or 'none'}). Pass one of: "
+                f"{', '.join(profiles)}"
+            )
+        name = matches[0]
+        print(f"Using the {name} profile.")
+    if name not in profiles:
+        raise ValueError(
+            f"Unknown profile '{name}'. Choose from: {', '.join(profiles)}"
+        )
+    return copy.deepcopy(profiles[name])
+
+
+def override(profile, section, **values):
+    """Set the given keys of profile[section], skipping values that are None
+    (an option that was not given on the command line)."""
+    profile[section].update({k: v for k, v in values.items() if v is not None})
+    return profile
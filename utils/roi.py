@@ -0,0 +1,115 @@
+import cv2
+import numpy as np
+import yaml
+
+########################################################################
+####                                                                ####
+####                        regions of interest                     ####
+####                                                                ####
+########################################################################
+
+# Frames are cropped to the plate as they are decoded, so everything
+# downstream (prefetch queue, background, subtraction, locate) only ever
+# touches the cropped pixels. Inside the crop, an optional mask zeroes
+# pixels that are off the plate or on the walls between wells. Feature
+# coordinates are shifted back to full-frame space before they are written.
+
+
+def read_wells(path):
+    """Read the plate geometry from a split_wells.py config file.
+
+    Only the geometry keys are used (outer_bounds, v_lines, h_lines,
+    h_slope, v_slope), with split_wells.py's defaults.
+    """
+    with open(path) as f:
+        config = yaml.safe_load(f)
+    v_slope = config.get("v_slope", "inf")
+    return {
+        "outer_bounds": config.get("outer_bounds"),
+        "v_lines": config.get("v_lines", []),
+        "h_lines": config.get("h_lines", []),
+        "h_slope": float(config.get("h_slope", 0.0)),
+        "v_slope": float("inf") if v_slope == "inf" else float(v_slope),
+    }
+
+
+def grid_mask(shape, outer_bounds=None, v_lines=(), h_lines=(), h_slope=0.0,
+              v_slope=float("inf"), wall=0):
+    """Mask of the pixels that split_wells.py would assign to a well.
+
+    Pixels outside outer_bounds ([min_x, max_x, min_y, max_y] in the same
+    sheared coordinates split_wells.py uses) are 0, and so are pixels within
+    wall / 2 of an internal grid line.
+    """
+    y, x = np.ogrid[:shape[0], :shape[1]]
+    # coordinates along the grid's axes, as in split_wells.get_cell
+    u = x if np.isinf(v_slope) else x - y / v_slope
+    v = y - h_slope * x
+    inside = np.ones(shape, bool)
+    if outer_bounds is not None:
+        min_x, max_x, min_y, max_y = outer_bounds
+        inside &= (u >= min_x) & (u <= max_x) & (v >= min_y) & (v <= max_y)
+    if wall > 0:
+        for line in v_lines:
+            inside &= np.abs(u - line) > wall / 2
+        for line in h_lines:
+            inside &= np.abs(v - line) > wall / 2
+    return inside.astype(np.uint8) * 255
+
+
+class Roi:
+    """A rectangular crop of each frame plus an optional mask inside it.
+
+    Args:
+        bounds: [min_x, max_x, min_y, max_y] crop in full-frame pixels. By
+            default, the bounding box of the mask (or the whole frame).
+        polygon: [[x, y], ...] outline of the region to keep.
+        wells: split_wells.py config whose outer bounds, and with wall > 0
+            whose grid lines, are masked.
+        wall: Width in pixels of the well walls to mask along grid lines.
+    """
+
+    def __init__(self, bounds=None, polygon=None, wells=None, wall=0):
+        self.bounds = bounds
+        self.polygon = polygon
+        self.wells = wells
+        self.wall = wall
+
+    @classmethod
+    def from_settings(cls, settings):
+        """Build a Roi from a profile's roi section, or None if it is empty."""
+        if not any(settings.get(k) for k in ("bounds", "polygon", "wells")):
+            return None
+        return cls(settings.get("bounds"), settings.get("polygon"),
+                   settings.get("wells"), settings.get("wall", 0))
+
+    def resolve(self, shape):
+        """Return the crop box (x0, x1, y0, y1) for full frames of shape and
+        the uint8 mask of the cropped frame (None if nothing is masked)."""
+        mask = None
+        if self.wells:
+            mask = grid_mask(shape, wall=self.wall, **read_wells(self.wells))
+        if self.polygon:
+            poly = np.zeros(shape, np.uint8)
+            cv2.fillPoly(poly, [np.asarray(self.polygon, np.int32)], 255)
+            mask = poly if mask is None else cv2.bitwise_and(mask, poly)
+
+        if self.bounds is not None:
+            x0, x1, y0, y1 = (int(round(b)) for b in self.bounds)
+        elif mask is not None:
+            x, y, w, h = cv2.boundingRect(mask)
+            x0, x1, y0, y1 = x, x + w, y, y + h
+        else:
+            x0, x1, y0, y1 = 0, shape[1], 0, shape[0]
+        x0, x1 = max(x0, 0), min(x1, shape[1])
+        y0, y1 = max(y0, 0), min(y1, shape[0])
+        if x1 <= x0 or y1 <= y0:
+            raise ValueError(f"The ROI is empty in a {shape[1]}x{shape[0]} "
+                             "frame.")
+
+        if mask is not None:
+            mask = np.ascontiguousarray(mask[y0:y1, x0:x1])
+            if mask.all():
+                # the crop already does all the work
+                mask = None
+        return (x0, x1, y0, y1), mask
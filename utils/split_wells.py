@@ -7,6 +7,8 @@ import yaml
 import argparse
 from typing import List, Tuple, Optional, Dict, Any
 
+import metrics
+
 
 def split_by_wells(
     df, h_lines, v_lines, outer_bounds=None, h_slope=0, v_slope=float("inf")
@@ -432,7 +434,8 @@ def main():
     # Load your particle tracking data (expecting a Feather file)
     print(f"Loading data from {input_path}...")
     try:
-        df = pd.read_feather(input_path)
+        with metrics.stage("read"):
+            df = pd.read_feather(input_path)
     except Exception as e:
         # Provide a helpful message if pyarrow/fastparquet isn't available or file is unreadable
         raise RuntimeError(
@@ -440,43 +443,52 @@ def main():
         )
 
     # Split the data by wells
-    well_dfs = split_by_wells(
-        df,
-        h_lines,
-        v_lines,
-        outer_bounds=outer_bounds,
-        h_slope=h_slope,
-        v_slope=v_slope,
-    )
-
-    # Visualize the wells if requested
-    if visualize:
-        # Create visualization output path by replacing .csv extension with .png
-        viz_output_path = os.path.splitext(output_path)[0] + ".png"
-
-        visualize_wells(
+    with metrics.stage("split"):
+        well_dfs = split_by_wells(
             df,
-            well_dfs,
             h_lines,
             v_lines,
             outer_bounds=outer_bounds,
             h_slope=h_slope,
             v_slope=v_slope,
-            output_path=viz_output_path,
         )
+    metrics.count("split", df["frame"].nunique())
+
+    # Visualize the wells if requested
+    if visualize:
+        # Create visualization output path by replacing .csv extension with .png
+        viz_output_path = os.path.splitext(output_path)[0] + ".png"
+
+        with metrics.stage("plot"):
+            visualize_wells(
+                df,
+                well_dfs,
+                h_lines,
+                v_lines,
+                outer_bounds=outer_bounds,
+                h_slope=h_slope,
+                v_slope=v_slope,
+                output_path=viz_output_path,
+            )
 
     # Collapse well_dfs into a single DataFrame with well information
-    collapsed_df = collapse_well_dfs(well_dfs)
+    with metrics.stage("merge"):
+        collapsed_df = collapse_well_dfs(well_dfs)
 
     # Report on the result
     print(f"Collapsed DataFrame shape: {collapsed_df.shape}")
     print(f"Number of unique wells: {collapsed_df['well_id'].nunique()}")
 
     # Save collapsed_df to CSV file
-    collapsed_df.to_csv(output_path, index=False)
+    with metrics.stage("write"):
+        collapsed_df.to_csv(output_path, index=False)
     print(f"DataFrame successfully saved to: {output_path}")
     print(f"File size: {os.path.getsize(output_path)/1024/1024:.2f} MB")
 
+    metrics.write(
+        os.path.splitext(output_path)[0] + ".metrics.jsonl", config=args.config
+    )
+
 
 if __name__ == "__main__":
     main()
@@ -11,6 +11,17 @@ from skimage.filters import gaussian
 from skimage.exposure import rescale_intensity, adjust_gamma
 import cv2
 
+from background import BACKGROUNDS, make_background
+import metrics
+from checkpoint import Checkpoint
+from detection import ENGINES
+from frames import DECODERS, open_video
+from parallel import available_cores, locate_stream
+from preprocess import KERNELS
+from profiles import PROFILES, get_profile, override
+from roi import Roi
+from writers import WRITERS, open_writer
+
 ########################################################################
 ####                                                                ####
 ####                             tracking                           ####
@@ -18,15 +29,18 @@ import cv2
 ########################################################################
 
 
-# convert RGB image to greyscale uint8
+# convert a cv2 (BGR) image to greyscale uint8
 def rgb2gray(frame):
-    gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
     return gray.astype(np.uint8)
 
 
-def process_frame(frame, background):
+def process_frame(frame, background, out=None, kernel="absdiff",
+                  threshold=None, mask=None):
     # gray = rgb2gray(frame)
-    sub = np.absolute((frame - background).astype(np.int8))
+    if out is None:
+        out = np.empty_like(frame)
+    sub = KERNELS[kernel](frame, background, out, threshold, mask)
     # rescale = rescale_intensity(sub, out_range=(0, 255))
     # inv = (255 - rescale).astype(np.uint8)
     # smooth = gaussian(sub, sigma=5, preserve_range=True)
@@ -34,77 +48,203 @@ def process_frame(frame, background):
     return sub
 
 
-def crop(frame, l, r, t, b):
+def subtract_frames(frames, background, output, base, kernel="absdiff",
+                    threshold=None, offset=0, mask=None):
+    """Background-subtract a stream of frames using a background engine.
+
+    background is any engine from background.py; it decides how many frames
+    are buffered to build each background. Every frame is subtracted into the
+    same output buffer, so each yielded frame must be consumed before the
+    next one is requested. offset is the frame number of the first frame;
+    pixels where mask is 0 are zeroed.
+    """
+    window = background.window
+    out = None
+    for i, frame, bg in metrics.timed("background",
+                                      background.apply(frames, offset)):
+        if out is None:
+            out = np.empty_like(frame)
+        if i % window == 0:
+            print(f"Processing frame {i}")
+            print(f"Regenerating background using {window} frames around {i}.")
+            save_path = Path(output, f"background_{window}.png")
+            cv2.imwrite(str(save_path), bg)
+        arr = process_frame(frame, bg, out, kernel, threshold, mask)
+        if i % 450 == 0:
+            save_path = Path(output, f"{base}_{i}.png")
+            cv2.imwrite(str(save_path), arr)
+        yield i, arr
+
+
+def shard_range(length, shard, shards, align=1):
+    """Frame range [start, stop) of shard (0-based) when length frames are
+    split into shards roughly equal parts whose boundaries fall on multiples
+    of align, so chunk backgrounds never straddle two shards."""
+    if not 0 <= shard < shards:
+        raise ValueError(f"Shard {shard} is not in [0, {shards}).")
+    bounds = [min(round(length * k / shards / align) * align, length)
+              for k in range(shards)] + [length]
+    return bounds[shard], bounds[shard + 1]
+
+
+def ring_slots(memory_mb, shape, reserved):
+    """Shared-memory ring slots that fit in memory_mb once reserved frames
+    (background window, prefetch queue) of this shape are accounted for."""
+    slots = int(memory_mb * 2**20 // np.prod(shape)) - reserved
+    if slots < 1:
+        raise ValueError(
+            f"A memory budget of {memory_mb} MB cannot hold {reserved + 1} "
+            f"frames of {shape[1]}x{shape[0]}."
+        )
+    return slots
 
-    cropped = frame[t:-b, l:-r]
 
-    return cropped
+# a locate worker peaks at about LOCATE_BYTES per frame pixel of float
+# temporaries (tp.locate and pyramid; tiles and cc need less), on top of
+# WORKER_MB for an interpreter with trackpy loaded
+LOCATE_BYTES = 24
+WORKER_MB = 150
 
 
-def track_batch(video, output):
+def plan_workers(memory_mb, shape, reserved, processes, worker_mb=None):
+    """Processes and ring slots whose frames and locate workers all fit in
+    memory_mb, with at most the given number of processes.
+
+    worker_mb is the peak memory of one locate worker (default: estimated
+    from the frame size). Every worker also adds two ring slots, and the
+    calling process needs as much as a worker besides its reserved frames.
+    """
+    frame_mb = np.prod(shape) / 2**20
+    if worker_mb is None:
+        worker_mb = WORKER_MB + LOCATE_BYTES * frame_mb
+    workers = int((memory_mb - worker_mb - reserved * frame_mb)
+                  // (worker_mb + 2 * frame_mb))
+    if workers < 1:
+        raise ValueError(
+            f"A memory budget of {memory_mb} MB cannot hold a locate worker "
+            f"of {worker_mb:.0f} MB and {reserved + 2} frames of "
+            f"{shape[1]}x{shape[0]}."
+        )
+    if processes > workers + 1:
+        print(f"Limiting to {workers} locate workers to fit in {memory_mb} MB.")
+        processes = workers + 1
+    # whatever the workers leave over goes to the ring
+    used = worker_mb * max(processes - 1, 1)
+    return processes, ring_slots(memory_mb - used, shape, reserved)
+
+
+def track_batch(video, output, profile, format="hdf5", start=0, stop=None,
+                shard=None, shards=1):
+    """Detect features in video and write them to output.
+
+    profile is a species profile (see profiles.py) that supplies every
+    detection, background and performance setting.
+    """
     base = Path(output).stem
     os.makedirs(output, exist_ok=True)
 
-    worm_vid = cv2.VideoCapture(video)
-    num_frames = int(worm_vid.get(cv2.CAP_PROP_FRAME_COUNT))
-
-    ret, frame = worm_vid.read()
-    if ret == True:
-        frame_shape = frame.shape
-
-    # Reset the video capture to the first frame
-    worm_vid.set(cv2.CAP_PROP_POS_FRAMES, 0)
-
-    worm_arr = np.zeros((num_frames, frame_shape[0], frame_shape[1]), np.uint8)
-    for i in range(num_frames):
-
-        if i % 50 == 0:
-            print(f"Loading frame {i} to memory.")
-        ret, frame = worm_vid.read()
-        if not ret:
-            break
-        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
-        worm_arr[i] = frame
-
-    if "planaria" not in output:
-        i = 0
-        chunk = 25
-        for frame in worm_arr:
-            if i % chunk == 0:
-                print(f"Processing frame {i}")
-                print(
-                    f"Regenerating background using frames {i} to {i+chunk}.")
-                background = np.amax(worm_arr[i: i + chunk, :, :], axis=0)
-                save_path = Path(output, f"background_{chunk}.png")
-                cv2.imwrite(str(save_path), background)
-            arr = process_frame(frame, background)
-            worm_arr[i] = arr
-            if i % 450 == 0:
-                save_path = Path(output, f"{base}_{i}.png")
-                cv2.imwrite(str(save_path), arr)
-            i += 1
-        if "miracidia" in output:
-            diameter = 23
-            minmass = 550
-            noise_size = 1
-            topn = None
-            with tp.PandasHDFStoreBig(Path(output, f"{base}.hdf5")) as s:
-                tp.batch(worm_arr, diameter=diameter, minmass=minmass,
-                         topn=topn, noise_size=noise_size, output=s)
-        elif "mosquito" in output:
-            diameter = 95
-            minmass = 50000
-            with tp.PandasHDFStoreBig(Path(output, f"{base}.hdf5")) as s:
-                tp.batch(worm_arr, diameter=diameter,
-                         minmass=minmass, output=s)
-        else:
-            print("Something went wrong.")
+    detection = profile["detection"]
+    background = profile["background"]
+    performance = profile["performance"]
+    chunk = background["chunk"]
+    kernel = detection["kernel"]
+    engine = detection["engine"]
+    decoder = performance["decoder"]
+    segment = performance["segment"]
+
+    params = dict(detection["locate"])
+    if engine == "tiles":
+        params["tile"] = detection["tile"]
+        params["gate"] = detection["gate"]
+    elif engine == "pyramid":
+        params["factor"] = detection["factor"]
+        params["refine"] = detection["refine"]
+
+    # only frames [start, stop) are located, with their global frame numbers;
+    # a shard or range gets its own output so concurrent jobs don't collide
+    source = open_video(video, decoder)
+    length = source.frame_count
+
+    # frames are cropped as they are decoded; features are shifted back
+    roi = Roi.from_settings(profile["roi"])
+    crop, mask = roi.resolve(source.shape) if roi else (None, None)
+    if crop is not None:
+        x0, x1, y0, y1 = crop
+        print(f"Cropping to x {x0}-{x1}, y {y0}-{y1}.")
+
+    if shard is not None:
+        start, stop = shard_range(length, shard, shards, chunk)
+        base = f"{base}.shard{shard}"
+    elif start > 0 or stop is not None:
+        stop = length if stop is None else min(stop, length)
+        base = f"{base}.frames{start}-{stop}"
+    stop = length if stop is None else stop
+    print(f"Tracking frames {start} to {stop} of {length}.")
+
+    # with segment > 0, detections are committed every segment frames and a
+    # rerun of the same command resumes after the last committed segment
+    resume = start
+    if segment:
+        run = dict(video=Path(video).name, size=os.path.getsize(video),
+                   start=start, stop=stop, profile=profile["name"],
+                   version=profile["version"], detection=detection,
+                   background=background, roi=profile["roi"],
+                   crop=list(crop) if crop else None, decoder=decoder,
+                   format=format, segment=segment)
+        checkpoint = Checkpoint(Path(output, f"{base}.segments"), run, format,
+                                segment, start)
+        resume = checkpoint.resume()
+        if resume > start:
+            print(f"Resuming from frame {resume}.")
+
+    model = (make_background(background["mode"], chunk,
+                             background["percentile"]) if kernel else None)
+    # read just enough frames around [resume, stop) to rebuild its
+    # backgrounds exactly as in a run over the whole video
+    first, last = model.padded(resume, stop, length) if model else (resume, stop)
+
+    # decode on a background thread so it overlaps with subtraction/locate
+    frames = open_video(video, decoder, start=first, stop=last, crop=crop)
+    shape = frames.shape
+    frames = metrics.timed("decode", frames)
+
+    if model is not None:
+        frames = metrics.timed("subtract", subtract_frames(
+            frames, model, output, base, kernel, detection["threshold"],
+            first, mask))
+    elif mask is not None:
+        frames = ((i, cv2.bitwise_and(frame, mask, dst=frame))
+                  for i, frame in enumerate(frames, first))
     else:
-        diameter = 83
-        minmass = 148000
+        frames = enumerate(frames, first)
+    frames = ((i, frame) for i, frame in frames if resume <= i < stop)
+
+    slots = None
+    processes = performance["processes"] or available_cores()
+    if performance["memory_mb"]:
+        # the background window and the prefetch queue hold frames too
+        reserved = (chunk if model else 0) + 8
+        processes, slots = plan_workers(performance["memory_mb"], shape,
+                                        reserved, processes,
+                                        performance["worker_mb"])
+    origin = (crop[2], crop[0]) if crop else (0, 0)
 
-        with tp.PandasHDFStoreBig(Path(output, f"{base}.hdf5")) as s:
-            tp.batch(worm_arr, diameter=diameter, minmass=minmass, output=s)
+    if not segment:
+        with open_writer(output, base, format) as s:
+            locate_stream(frames, s, processes, ENGINES[engine], slots,
+                          origin, **params)
+    else:
+        if resume < stop:
+            with checkpoint as s:
+                locate_stream(frames, s, processes, ENGINES[engine], slots,
+                              origin, **params)
+                s.commit(stop)
+        with metrics.stage("merge"):
+            checkpoint.finalize(Path(output, base + WRITERS[format].suffix))
+
+    metrics.write(Path(output, f"{base}.metrics.jsonl"), video=str(video),
+                  profile=profile["name"], engine=engine, start=resume,
+                  stop=stop, processes=processes)
 
 
 if __name__ == "__main__":
@@ -115,14 +255,105 @@ if __name__ == "__main__":
     parser.add_argument("video", type=str, help="Path to the video.")
     parser.add_argument("output", type=str,
                         help="Path to the output directory.")
-    # parser.add_argument('-l', '--left', type=int,
-    #                     help='Number of cols to remove from the left.')
-    # parser.add_argument('-r', '--right', type=int,
-    #                     help='Number of cols to remove from the right.')
-    # parser.add_argument('-t', '--top', type=int,
-    #                     help='Number of cols to remove from the top.')
-    # parser.add_argument('-b', '--bottom', type=int,
-    #                     help='Number of cols to remove from the bottom.')
+    parser.add_argument("--profile", type=str, default=None,
+                        help="Species profile from --profiles (default: the "
+                        "profile whose match strings are in the output "
+                        "path). The options below override it.")
+    parser.add_argument("--profiles", type=str, default=str(PROFILES),
+                        help="Profile registry (default: profiles.yml next "
+                        "to this script).")
+    parser.add_argument("-c", "--chunk", type=int, default=None,
+                        help="Frames per background chunk or window. Only "
+                        "about one window of frames is held in memory.")
+    parser.add_argument("--background", choices=list(BACKGROUNDS),
+                        default=None,
+                        help="Background model: blocky chunk max or median "
+                        "(chunk-median), or a sliding-window max, median or "
+                        "percentile.")
+    parser.add_argument("--percentile", type=float, default=None,
+                        help="Percentile for --background percentile.")
+    parser.add_argument("--kernel", choices=list(KERNELS), default=None,
+                        help="Background subtraction kernel. 'legacy' "
+                        "reproduces the old wrap-around int8 subtraction.")
+    parser.add_argument("--threshold", type=int, default=None,
+                        help="Zero background-subtracted pixels at or below "
+                        "this value before locate.")
+    parser.add_argument("--engine", choices=list(ENGINES), default=None,
+                        help="Detection engine: tp.locate ('trackpy'), "
+                        "threshold + connected components ('cc'), which is "
+                        "much faster for small, high-contrast organisms, "
+                        "tp.locate on moving tiles only ('tiles'), or "
+                        "tp.locate on a downsampled frame ('pyramid'), for "
+                        "large organisms.")
+    parser.add_argument("--tile", type=int, default=None,
+                        help="Tile size in pixels for --engine tiles.")
+    parser.add_argument("--gate", type=float, default=None,
+                        help="Minimum tile max searched by --engine tiles "
+                        "(default: estimated from each frame's noise).")
+    parser.add_argument("--factor", type=int, default=None,
+                        help="Downsampling factor for --engine pyramid.")
+    parser.add_argument("--refine", action=argparse.BooleanOptionalAction,
+                        default=None,
+                        help="Refine --engine pyramid positions at full "
+                        "resolution.")
+    parser.add_argument("--format", choices=list(WRITERS), default="hdf5",
+                        help="Detection output: a trackpy HDF5 store "
+                        "(default) or zstd Parquet written in large row "
+                        "groups.")
+    parser.add_argument("--segment", type=int, default=None,
+                        help="Commit detections every this many frames so an "
+                        "interrupted run resumes where it stopped when "
+                        "rerun (0 = no checkpoints).")
+    parser.add_argument("--start", type=int, default=0,
+                        help="First frame to track. Output is written to "
+                        "<base>.frames<start>-<stop>.")
+    parser.add_argument("--stop", type=int, default=None,
+                        help="Frame to stop before (default: end of video).")
+    parser.add_argument("--shard", type=int, default=None,
+                        help="Track only this (0-based) shard of --shards "
+                        "equal frame ranges, aligned to --chunk. Output is "
+                        "written to <base>.shard<shard>; merge the shards "
+                        "with merge_shards.py.")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Number of shards for --shard.")
+    parser.add_argument("--decoder", choices=list(DECODERS), default=None,
+                        help="Frame decoder: cv2 or an ffmpeg pipe that "
+                        "decodes straight to luma.")
+    parser.add_argument("-p", "--processes", type=int, default=None,
+                        help="Number of processes: one decodes, the rest run "
+                        "locate (default: cores allocated by SLURM, else all "
+                        "available cores).")
+    parser.add_argument("--memory", type=int, default=None,
+                        help="Memory budget in MB for buffered frames and "
+                        "locate workers; limits the shared-memory ring and "
+                        "the number of processes.")
+    parser.add_argument("--worker-memory", type=int, default=None,
+                        help="Peak memory in MB of one locate worker "
+                        "(default: estimated from the frame size).")
+    parser.add_argument("--crop", type=int, nargs=4, default=None,
+                        metavar=("MIN_X", "MAX_X", "MIN_Y", "MAX_Y"),
+                        help="Crop every frame to this box before background "
+                        "subtraction and locate. Coordinates are written in "
+                        "full-frame pixels.")
+    parser.add_argument("--roi", type=str, default=None,
+                        help="split_wells.py config: pixels outside its "
+                        "outer_bounds are masked and, without --crop, frames "
+                        "are cropped to them.")
+    parser.add_argument("--wall", type=int, default=None,
+                        help="Also mask this many pixels along each grid line "
+                        "of --roi.")
     args = parser.parse_args()
 
-    track_batch(args.video, args.output)
+    profile = get_profile(args.profile, args.profiles, hint=args.output)
+    override(profile, "detection", engine=args.engine, tile=args.tile,
+             gate=args.gate, factor=args.factor, refine=args.refine,
+             kernel=args.kernel, threshold=args.threshold)
+    override(profile, "background", mode=args.background, chunk=args.chunk,
+             percentile=args.percentile)
+    override(profile, "roi", bounds=args.crop, wells=args.roi, wall=args.wall)
+    override(profile, "performance", decoder=args.decoder,
+             processes=args.processes, segment=args.segment,
+             memory_mb=args.memory, worker_mb=args.worker_memory)
+
+    track_batch(args.video, args.output, profile, args.format, args.start,
+                args.stop, args.shard, args.shards)
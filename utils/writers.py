@@ -0,0 +1,260 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import trackpy as tp
+from trackpy.framewise_data import code_key
+
+########################################################################
+####                                                                ####
+####                        detection writers                       ####
+####                                                                ####
+########################################################################
+
+# A writer takes one frame's features at a time through put(), like a
+# trackpy store, and is used as a context manager. The HDF5 writer is the
+# original trackpy store; the Parquet writer buffers many frames and writes
+# them as a single zstd-compressed row group with compact dtypes, which is
+# much less per-frame overhead than an HDF5 append.
+
+# y and x stay float64 for linking; everything else fits in 32 bits
+DTYPES = {
+    "y": np.float64,
+    "x": np.float64,
+    "mass": np.float32,
+    "size": np.float32,
+    "ecc": np.float32,
+    "signal": np.float32,
+    "raw_mass": np.float32,
+    "ep": np.float32,
+    "frame": np.int32,
+}
+
+
+def compact(features):
+    """Cast the known feature columns to their compact dtypes."""
+    return features.astype(
+        {c: t for c, t in DTYPES.items() if c in features.columns}, copy=False
+    )
+
+
+class HDF5Writer:
+    """Append each frame to a trackpy PandasHDFStoreBig (the original format)."""
+
+    suffix = ".hdf5"
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def __enter__(self):
+        self._store = tp.PandasHDFStoreBig(self.path)
+        return self
+
+    def __exit__(self, *exc):
+        self._store.close()
+
+    def put(self, features):
+        self._store.put(features)
+
+
+class ParquetWriter:
+    """Buffer frames in memory and write them as zstd Parquet row groups.
+
+    Args:
+        path: Output .parquet file.
+        frames_per_group: Frames buffered per row group.
+        compression: Parquet codec.
+    """
+
+    suffix = ".parquet"
+
+    def __init__(self, path, frames_per_group=1000, compression="zstd"):
+        self.path = Path(path)
+        self.frames_per_group = frames_per_group
+        self.compression = compression
+
+    def __enter__(self):
+        self._buffer = []
+        self._writer = None
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+        if self._writer is None:
+            # nothing was found: still leave a readable, empty file
+            empty = compact(pd.DataFrame({c: [] for c in DTYPES}))
+            self._open(empty)
+        self._writer.close()
+
+    def put(self, features):
+        self._buffer.append(features)
+        if len(self._buffer) >= self.frames_per_group:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        import pyarrow as pa
+
+        batch = compact(pd.concat(self._buffer, ignore_index=True))
+        self._buffer = []
+        if self._writer is None:
+            self._open(batch)
+        table = pa.Table.from_pandas(batch, preserve_index=False)
+        self._writer.write_table(table.cast(self._writer.schema))
+
+    def _open(self, batch):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.Schema.from_pandas(batch, preserve_index=False)
+        self._writer = pq.ParquetWriter(self.path, schema,
+                                        compression=self.compression)
+
+
+class FeatherWriter:
+    """Append batches of features to an Arrow IPC (feather v2) file.
+
+    Each put() is written straight out as one lz4-compressed record batch
+    with the columns and dtypes of the first, so a table of any size can be
+    written without holding it in memory. Values are written as given (no
+    compact dtypes), and the file reads back with pd.read_feather.
+
+    Args:
+        path: Output .feather file.
+        compression: Arrow IPC codec ("lz4", "zstd" or None).
+    """
+
+    suffix = ".feather"
+
+    def __init__(self, path, compression="lz4"):
+        self.path = Path(path)
+        self.compression = compression
+
+    def __enter__(self):
+        self._writer = None
+        return self
+
+    def __exit__(self, *exc):
+        if self._writer is None:
+            self._open(pd.DataFrame({c: pd.Series(dtype=t) for c, t in DTYPES.items()}))
+        self._writer.close()
+
+    def put(self, features):
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(features, preserve_index=False)
+        if self._writer is None:
+            self._open(features)
+        self._writer.write_table(table.select(self._schema.names).cast(self._schema))
+
+    def _open(self, batch):
+        import pyarrow as pa
+
+        self._schema = pa.Schema.from_pandas(batch, preserve_index=False)
+        options = pa.ipc.IpcWriteOptions(compression=self.compression)
+        self._writer = pa.ipc.new_file(str(self.path), self._schema, options=options)
+
+
+WRITERS = {
+    "hdf5": HDF5Writer,
+    "parquet": ParquetWriter,
+}
+
+# formats a merged, multi-video table can be written to (see
+# link_trajectories.merge_data)
+SINKS = {
+    "feather": FeatherWriter,
+    "parquet": ParquetWriter,
+}
+
+
+def open_writer(output, base, format="hdf5", **kwargs):
+    """Return a writer for output/base with the named format (see WRITERS)."""
+    if format not in WRITERS:
+        raise ValueError(
+            f"Unknown format '{format}'. Choose from: {', '.join(WRITERS)}"
+        )
+    writer = WRITERS[format]
+    return writer(Path(output, base + writer.suffix), **kwargs)
+
+
+def read_features(path):
+    """Read every feature from an .hdf5 store, .parquet or .feather file.
+
+    Returns an empty DataFrame if nothing was written.
+    """
+    path = Path(path)
+    if path.suffix == ".parquet":
+        return pd.read_parquet(path)
+    if path.suffix == ".feather":
+        return pd.read_feather(path)
+    with tp.PandasHDFStore(path, mode="r") as hdf5:
+        try:
+            return hdf5.dump()
+        except ValueError as e:
+            if "No objects to concatenate" in str(e):
+                return pd.DataFrame()
+            raise
+
+
+def describe_features(path, frames_per_batch=1000):
+    """Summarize an .hdf5 store or .parquet file and split it into batches
+    of consecutive frames, reading only metadata and frame numbers.
+
+    Returns a dict with the last frame number (None if nothing was
+    written), the number of rows, and the batches in frame order, each of
+    which read_batch() reads: frames_per_batch frame numbers of an HDF5
+    store, or one row group of a Parquet file (which ParquetWriter makes
+    frames_per_group frames).
+    """
+    path = Path(path)
+    if path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        metadata = pq.ParquetFile(path).metadata
+        frames = pd.read_parquet(path, columns=["frame"])["frame"]
+        batches = [i for i in range(metadata.num_row_groups)
+                   if metadata.row_group(i).num_rows]
+        return {"last_frame": int(frames.max()) if len(frames) else None,
+                "rows": metadata.num_rows, "batches": batches}
+    with tp.PandasHDFStore(path, mode="r") as hdf5:
+        frames = hdf5.frames
+        rows = sum(hdf5.store.get_storer(code_key(frame)).nrows for frame in frames)
+    return {"last_frame": int(frames[-1]) if len(frames) else None,
+            "rows": rows,
+            "batches": [frames[i:i + frames_per_batch]
+                        for i in range(0, len(frames), frames_per_batch)]}
+
+
+def read_batch(path, batch):
+    """Read one batch listed by describe_features() from path."""
+    path = Path(path)
+    if path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        return pq.ParquetFile(path).read_row_group(batch).to_pandas()
+    with tp.PandasHDFStore(path, mode="r") as hdf5:
+        return pd.concat([hdf5.get(frame) for frame in batch], ignore_index=True)
+
+
+def copy_features(path, writer):
+    """Put every frame read from path into writer, one put() per frame in
+    frame order, as tracking.py wrote it."""
+    features = read_features(path)
+    if len(features) == 0:
+        return
+    for _, frame in features.groupby("frame", sort=True):
+        writer.put(frame.reset_index(drop=True))
+
+
+def writer_for(path, writers=WRITERS):
+    """Return the writer class in writers whose suffix matches path."""
+    suffix = Path(path).suffix
+    for writer in writers.values():
+        if writer.suffix == suffix:
+            return writer
+    raise ValueError(
+        f"Unknown output suffix '{suffix}'. "
+        f"Choose from: {', '.join(w.suffix for w in writers.values())}"
+    )